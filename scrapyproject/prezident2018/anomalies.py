@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Score every polling station on a battery of tests for anomalies, and rank them.
+
+    python -m prezident2018.anomalies results.json.gz -o anomalies.csv
+
+Each test gives a station a score of -log10(p), where p is roughly the
+probability of seeing something at least as odd by chance, so 2 means about
+one in a hundred and 0 means nothing odd.  The ranking is by the sum of the
+scores.  The tests:
+
+    integer      the turnout, or the leading candidate's share, is a whole
+                 percentage, which is unlikely for a station with many voters
+    correlation  both the turnout and the leading candidate's share are far
+                 above the average for the station's region
+    digits       the last digits of the votes for the candidates at the
+                 station's territory (TIK) aren't uniformly distributed
+    monotonic    the turnout reported during the day went down, or past the
+                 final turnout (the ballots issued, as a percentage of the
+                 voters on the list); this can't happen, so each decrease
+                 scores MONOTONIC_SCORE
+
+Turnout here is the valid ballots as a fraction of the voters on the list (see
+histograms.turnout), and the leading candidate is the one with the most votes
+across all the stations scored.  Everything is computed on whole columns of
+stations.Stations at once.
+"""
+import collections
+import csv
+import io
+import math
+
+import numpy as np
+import scipy.special
+
+from . import histograms
+from . import stations
+
+TESTS = ('integer', 'correlation', 'digits', 'monotonic')
+"""The names of the tests, in the order they're written out."""
+
+MONOTONIC_SCORE = 2
+"""The score for each decrease in the reported turnout."""
+
+MONOTONIC_TOLERANCE = 0.5
+"""Ignore decreases in the reported turnout of up to this many percentage points."""
+
+MIN_DIGITS = 50
+"""Only test the last digits of territories with at least this many vote counts."""
+
+MIN_COUNT = 10
+"""Only test the last digits of vote counts at least this large."""
+
+ISSUED = stations.MEASURES[2:5]
+"""The ballots issued early, in the polling station and outside it."""
+
+
+def _surprise(p):
+    """Turn probabilities into scores."""
+    return np.log10(1 / np.clip(p, 1e-300, 1))
+
+
+def integer_score(numerator, denominator):
+    """Score fractions that are whole percentages.
+
+    There are about denominator / 100 ways for a fraction with that
+    denominator to come out at a whole percentage, so p is 100 / denominator.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = numerator / denominator * 100
+        whole = np.abs(percent - np.rint(percent)) * denominator < 50
+        p = np.where(whole & (denominator > 100), 100 / denominator, 1)
+    return _surprise(np.nan_to_num(p, nan=1))
+
+
+def _group_z(values, groups):
+    """Standardise values within each group.  NaN stays NaN, and scores 0 later on."""
+    ok = ~np.isnan(values)
+    count = np.bincount(groups[ok], minlength=groups.max() + 1 if len(groups) else 0)
+    total = np.bincount(groups[ok], weights=values[ok], minlength=len(count))
+    squares = np.bincount(groups[ok], weights=values[ok] ** 2, minlength=len(count))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        std = np.sqrt(squares / count - mean ** 2)
+        return (values - mean[groups]) / std[groups]
+
+
+def correlation_score(turnout, share, groups):
+    """Score stations where both turnout and share are high for their group.
+
+    Scores by how many standard deviations above the group's mean the lesser
+    of the two is, so each station's score grows with its contribution to
+    the correlation between turnout and share.
+    """
+    z = np.fmin(_group_z(turnout, groups), _group_z(share, groups))
+    z = np.where(np.isfinite(z) & (z > 0), z, 0)
+    #
+    # Given that the station is above average, which is what half of them are.
+    #
+    return _surprise(2 * scipy.special.ndtr(-z))
+
+
+def digit_score(counts, groups, min_digits=MIN_DIGITS, min_count=MIN_COUNT):
+    """Score each station by the chi-squared test of the last digits of its group.
+
+    counts has a row for each station.  Counts below min_count are left out,
+    since their last digits aren't uniform to begin with.
+    """
+    num_groups = groups.max() + 1 if len(groups) else 0
+    ok = ~np.isnan(counts) & (counts >= min_count)
+    rows, _ = np.nonzero(ok)
+    digits = counts[ok].astype(np.int64) % 10
+    observed = np.bincount(groups[rows] * 10 + digits, minlength=num_groups * 10)
+    observed = observed.reshape(num_groups, 10)
+
+    total = observed.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = total[:, np.newaxis] / 10
+        chi2 = ((observed - expected) ** 2 / expected).sum(axis=1)
+        #
+        # The Wilson-Hilferty approximation of the chi-squared distribution
+        # with 9 degrees of freedom.
+        #
+        dof = 9
+        z = ((chi2 / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    z = np.where((total >= min_digits) & np.isfinite(z), z, -np.inf)
+    return _surprise(scipy.special.ndtr(-z))[groups]
+
+
+def monotonic_score(readings, tolerance=MONOTONIC_TOLERANCE):
+    """Score each station by the number of times its readings (a row each) go down."""
+    with np.errstate(invalid='ignore'):
+        decreases = (np.diff(readings, axis=1) < -tolerance).sum(axis=1)
+    return decreases * MONOTONIC_SCORE
+
+
+def leader(st):
+    """Return the candidate with the most votes."""
+    totals = np.nansum(histograms.candidate_votes(st), axis=0)
+    return stations.CANDIDATES[int(np.argmax(totals))]
+
+
+def score(st, candidate=None):
+    """Score the stations.  Returns an OrderedDict of arrays, keyed by test, and 'total'."""
+    if candidate is None:
+        candidate = leader(st)
+    eligible = st.measure(histograms.ELIGIBLE)
+    valid = st.measure(histograms.VALID)
+    votes = st.measure(candidate)
+    turnout = histograms.turnout(st)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = votes / valid
+
+    scores = collections.OrderedDict()
+    scores['integer'] = integer_score(valid, eligible) + integer_score(votes, valid)
+    scores['correlation'] = correlation_score(turnout, share, st.region_code)
+    scores['digits'] = digit_score(histograms.candidate_votes(st), st.territory_code)
+    issued = sum(st.measure(measure) for measure in ISSUED)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        final = issued / eligible * 100
+    scores['monotonic'] = monotonic_score(np.column_stack([st.turnout, final]))
+    scores['total'] = sum(scores[test] for test in TESTS)
+    return scores
+
+
+def write(st, scores, fout, limit=None):
+    """Write the stations to a text file object as CSV, the most anomalous first."""
+    order = np.argsort(-scores['total'], kind='stable')
+    if limit:
+        order = order[:limit]
+    writer = csv.writer(fout)
+    writer.writerow(['region', 'territory', 'name', 'total'] + list(TESTS))
+    for row in order:
+        writer.writerow(list(st.keys[row]) + [
+            '%.2f' % scores[test][row] for test in ('total',) + TESTS
+        ])
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Rank the polling stations by how odd they look')
+    parser.add_argument('dataset', help='e.g. results.json.gz')
+    parser.add_argument('-o', '--output', required=True, help='e.g. anomalies.csv')
+    parser.add_argument('--candidate', help='the candidate to test (default: the leader)')
+    parser.add_argument('--limit', type=int, help='write only this many stations')
+    args = parser.parse_args()
+
+    st = stations.load(args.dataset)
+    scores = score(st, candidate=args.candidate)
+    with io.open(args.output, 'wt', encoding='utf-8', newline='') as fout:
+        write(st, scores, fout, limit=args.limit)
+    print('scored %d stations, %d with a total score of at least 2' % (
+        len(st), np.count_nonzero(scores['total'] >= 2)
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the parsing hot path against the saved HTML pages.
+
+Runs offline: the pages are the same ones the tests use, plus synthetic pages
+made by widening them to hundreds of polling stations.  For each case, reports
+pages per second, the cost per table cell and the peak memory allocated while
+parsing a page (as seen by tracemalloc, so Python objects only).  Compare
+against the stored baselines to spot regressions before crawling the whole
+country:
+
+    python -m prezident2018.benchmark               # compare against the baseline
+    python -m prezident2018.benchmark --save        # replace the baseline
+
+The baselines are machine-specific, so refresh them when switching machines.
+
+Each page is parsed the way the parsers pick by default, and both in a
+single pass and with an xpath per cell.  Per-cell parsing is a little faster
+on the saved pages, which have 7 to 20 polling stations.  The two break even
+at around 50 stations, and single-pass gets well ahead from there, so the
+parsers pick single-pass from myspider.SINGLE_PASS_MIN_STATIONS on.
+"""
+import collections.abc
+import copy
+import io
+import json
+import os.path as P
+import sys
+import time
+import tracemalloc
+
+import lxml.html
+import scrapy
+
+from .spiders import myspider
+
+CURR_DIR = P.dirname(P.abspath(__file__))
+FIXTURES_DIR = P.join(CURR_DIR, 'spiders')
+
+BASELINE_PATH = P.join(CURR_DIR, 'benchmark-baseline.json')
+"""Where the baselines are stored."""
+
+TOLERANCE = 0.25
+"""How much slower than the baseline a case can get before it's a regression."""
+
+MIN_TIME = 0.5
+"""Keep repeating each case for at least this many seconds."""
+
+WIDE_STATIONS = (50, 100, 500)
+"""The number of polling stations on the synthetic pages."""
+
+
+def read_fixture(filename):
+    """Read one of the saved pages, converted to UTF-8 like the tests do."""
+    with open(P.join(FIXTURES_DIR, filename), 'rb') as fin:
+        return fin.read().decode('cp1251').encode('utf-8')
+
+
+def make_page(url, body):
+    return myspider.Page(url, body, scrapy.Selector(text=body.decode('utf-8')))
+
+
+def _cycle_children(parent, tag, count, skip=0):
+    """Append copies of the children of parent (after the first skip) until there are count."""
+    children = [child for child in parent if child.tag == tag][skip:]
+    template = list(children)
+    while len(children) < count:
+        clone = copy.deepcopy(template[len(children) % len(template)])
+        parent.append(clone)
+        children.append(clone)
+
+
+def _parse(body):
+    #
+    # The fixtures don't declare their encoding, so lxml would assume Latin-1.
+    #
+    return lxml.html.fromstring(body.decode('utf-8'))
+
+
+def widen_results(body, data_type, stations):
+    """Make a results page that reports on the specified number of stations."""
+    root = _parse(body)
+    table, = root.xpath(myspider.XPATHS[data_type]['cell_table'])
+    for row in table:
+        if row.tag == 'tr':
+            _cycle_children(row, 'td', stations)
+    return lxml.html.tostring(root, encoding='utf-8')
+
+
+def widen_turnout(body, data_type, stations):
+    """Make a turnout page that reports on the specified number of stations."""
+    root = _parse(body)
+    table, = root.xpath(myspider.XPATHS[data_type]['cell_table'])
+    #
+    # The extra row is the total across all stations.
+    #
+    skip = myspider.SKIP_TURNOUT_ROWS + 1
+    _cycle_children(table, 'tr', stations, skip=skip)
+    return lxml.html.tostring(root, encoding='utf-8')
+
+
+def count_cells(result):
+    return sum(len(row) for row in result['data'])
+
+
+def make_cases():
+    """Return a list of (name, data_type, function) tuples."""
+    results_tik = read_fixture('regional_ik_results.html')
+    results_uik = read_fixture('territorial_ik_results.html')
+    turnout_tik = read_fixture('regional_ik_turnout.html')
+    turnout_uik = read_fixture('territorial_ik_uik_turnout.html')
+    intermediate = read_fixture('territorial_ik_intermediate.html')
+
+    pages = [
+        (myspider.RESULTS_TIK, myspider.RESULTS_TIK, results_tik),
+        (myspider.RESULTS_UIK, myspider.RESULTS_UIK, results_uik),
+        (myspider.TURNOUT_TIK, myspider.TURNOUT_TIK, turnout_tik),
+        (myspider.TURNOUT_UIK, myspider.TURNOUT_UIK, turnout_uik),
+    ]
+    for stations in WIDE_STATIONS:
+        pages.append(('%s/%d' % (myspider.RESULTS_UIK, stations), myspider.RESULTS_UIK,
+                      widen_results(results_uik, myspider.RESULTS_UIK, stations)))
+        pages.append(('%s/%d' % (myspider.TURNOUT_UIK, stations), myspider.TURNOUT_UIK,
+                      widen_turnout(turnout_uik, myspider.TURNOUT_UIK, stations)))
+
+    cases = []
+    for name, data_type, body in pages:
+        parser = myspider.PARSERS[data_type]
+        page = make_page(name, body)
+        for single_pass, suffix in ((None, ''), (True, '/single-pass'), (False, '/per-cell')):
+
+            def function(page=page, parser=parser, data_type=data_type, single_pass=single_pass):
+                return parser(page, data_type=data_type, single_pass=single_pass)
+            cases.append((name + suffix, data_type, function))
+
+    page = make_page('intermediate', intermediate)
+    cases.append(('get_uik_link', None, lambda: myspider.get_uik_link(page.selector)))
+    return cases
+
+
+def run_case(function, min_time=MIN_TIME):
+    """Time a case.  Returns a dict of measurements."""
+    tracemalloc.start()
+    result = function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    repeats = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < min_time:
+        function()
+        repeats += 1
+        elapsed = time.perf_counter() - start
+
+    seconds_per_page = elapsed / repeats
+    cells = count_cells(result) if isinstance(result, collections.abc.Mapping) else 0
+    return {
+        'pages_per_sec': 1 / seconds_per_page,
+        'us_per_cell': seconds_per_page / cells * 1e6 if cells else None,
+        'cells': cells,
+        'peak_kib': peak / 1024,
+    }
+
+
+def run(min_time=MIN_TIME):
+    """Run all the cases.  Returns a dict of measurements keyed by case name."""
+    measurements = {}
+    for name, data_type, function in make_cases():
+        measurement = run_case(function, min_time=min_time)
+        measurement['data_type'] = data_type
+        measurements[name] = measurement
+    return measurements
+
+
+def find_regressions(measurements, baseline, tolerance=TOLERANCE):
+    """Return the names of the cases that got slower than the baseline by more than tolerance."""
+    return sorted(
+        name for (name, measurement) in measurements.items()
+        if name in baseline and
+        measurement['pages_per_sec'] < baseline[name]['pages_per_sec'] * (1 - tolerance)
+    )
+
+
+def print_report(measurements, baseline, fout=sys.stdout):
+    fout.write('%-28s %-12s %10s %10s %7s %10s %8s\n' % (
+        'case', 'data_type', 'pages/s', 'us/cell', 'cells', 'peak KiB', 'vs base'
+    ))
+    for name, m in sorted(measurements.items()):
+        if name in baseline:
+            versus = '%+.0f%%' % ((m['pages_per_sec'] / baseline[name]['pages_per_sec'] - 1) * 100)
+        else:
+            versus = '-'
+        us_per_cell = '-' if m['us_per_cell'] is None else '%.2f' % m['us_per_cell']
+        fout.write('%-28s %-12s %10.1f %10s %7d %10.1f %8s\n' % (
+            name, m['data_type'] or '-', m['pages_per_sec'], us_per_cell,
+            m['cells'], m['peak_kib'], versus
+        ))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--min-time', type=float, default=MIN_TIME)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    baseline = {}
+    if P.isfile(args.baseline):
+        with io.open(args.baseline, 'rt', encoding='utf-8') as fin:
+            baseline = json.load(fin)
+
+    measurements = run(min_time=args.min_time)
+    print_report(measurements, baseline)
+
+    if args.save:
+        with io.open(args.baseline, 'wt', encoding='utf-8') as fout:
+            json.dump(measurements, fout, indent=2, sort_keys=True)
+        return
+
+    regressions = find_regressions(measurements, baseline, tolerance=args.tolerance)
+    if regressions:
+        print('regressions: %s' % ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Record which parts of the crawl are done, so that a dead crawl can resume.
+
+The pages form a tree: central -> region -> TIK -> UIK.  Each time a callback
+finishes with a page, we append a line to the checkpoint file:
+
+    {"url": url, "children": [url, ...], "items": 1}
+
+where url is the URL the page was requested under, children are the pages it
+requested and items is the number of tables it emitted.  If the request was
+redirected, the entry also has the URL of the table, which is the URL of
+the response, as table_url.  A page's subtree is complete when the page has
+been handled, its table (if any) made it into the output, and the subtrees
+of all its children are complete.  The output is checked separately because
+the exporters write tables in batches, so a table can be emitted but never
+written.
+
+Tables that the pipelines dropped (e.g. quarantined by validation) will never
+be in the output, so they're recorded as
+
+    {"dropped": url}
+
+and count as written.
+
+The checkpoint is append-only: when a page is handled more than once, e.g.
+by a resumed crawl, the children and items of all its entries are combined.
+"""
+import io
+import json
+import logging
+import os.path as P
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Checkpoint(object):
+    """The pages handled so far, keyed by URL."""
+
+    def __init__(self, path):
+        self.path = path
+        self.children = {}
+        self.items = {}
+        self.table_urls = {}
+        self.dropped = set()
+        line = b''
+        if P.isfile(path):
+            with io.open(path, 'rb') as fin:
+                for line in fin:
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        #
+                        # The crawl died while writing this line.
+                        #
+                        LOGGER.warning('%r: ignoring incomplete line', path)
+                        continue
+                    if 'dropped' in entry:
+                        self.dropped.add(entry['dropped'])
+                    else:
+                        self._add(entry['url'], entry['children'], entry['items'],
+                                  entry.get('table_url'))
+        LOGGER.debug('loaded %d pages from %r', len(self.children), path)
+        self._file = io.open(path, 'ab')
+        if self._file.tell() and not line.endswith(b'\n'):
+            #
+            # Don't let the next entry continue the incomplete line.
+            #
+            self._file.write(b'\n')
+
+    def close(self):
+        self._file.close()
+
+    def __contains__(self, url):
+        return url in self.children
+
+    def __len__(self):
+        return len(self.children)
+
+    def _add(self, url, children, items, table_url=None):
+        self.children.setdefault(url, set()).update(children)
+        self.items[url] = max(self.items.get(url, 0), items)
+        if table_url:
+            self.table_urls[url] = table_url
+
+    def _write(self, entry):
+        self._file.write((json.dumps(entry) + '\n').encode('utf-8'))
+        self._file.flush()
+
+    def record(self, url, children, items, table_url=None):
+        """Record that a page has been handled.  table_url is where it was redirected to, if it was."""
+        self._add(url, children, items, table_url)
+        entry = {'url': url, 'children': children, 'items': items}
+        if table_url and table_url != url:
+            entry['table_url'] = table_url
+        self._write(entry)
+
+    def record_dropped(self, url):
+        """Record that the table of a page was dropped, so won't ever be in the output."""
+        self.dropped.add(url)
+        self._write({'dropped': url})
+
+    def completed(self, written):
+        """Return the URLs of the pages whose subtrees are complete.
+
+        written is a set of the URLs of the tables in the output.
+        """
+        written = set(written) | self.dropped
+        complete = {}
+
+        def is_complete(url):
+            if url not in complete:
+                #
+                # Guard against cycles while we recurse.
+                #
+                complete[url] = False
+                complete[url] = url in self.children and \
+                    (not self.items[url] or self.table_urls.get(url, url) in written) and \
+                    all([is_complete(child) for child in self.children[url]])
+            return complete[url]
+
+        for url in self.children:
+            is_complete(url)
+        return set(url for (url, done) in complete.items() if done)
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""A compact columnar format for the scraped tables.
+
+The JSON-lines output repeats the row and column headers of every table in full.
+This format stores each distinct string once, and the numbers for each data_type
+as a single 2D array, so the whole dataset can be memory-mapped in one go.
+
+Each table is broken up into entities: the polling stations or committees that
+the table reports on.  For the results tables, the entities are the columns
+(the measures are the rows); for the turnout tables, the entities are the rows
+(the measures are the four times).  Each entity is a row in the values array
+for its data_type, and the entity arrays record which table it came from and
+its name, so individual polling stations can be looked up directly.
+
+The layout of the file is:
+
+    MAGIC
+    the length of the header, as a little-endian unsigned 64-bit integer
+    the header, as UTF-8 JSON
+    the arrays, each aligned to ALIGNMENT bytes
+
+The header only holds the dtype, shape and offset of each array.  Offsets are
+relative to the first aligned byte after the header.  Everything else is in
+the arrays, so opening a dataset doesn't decode anything up front:
+
+    strings/data, strings/offsets   the strings, as UTF-8, one after another
+    header_set/positions, header_set/offsets
+                                    each distinct list of headers, as the
+                                    positions of the headers among the measures
+    table/...                       a row per table: its data_type, region,
+                                    territory, url, md5, timestamp (as string
+                                    IDs), header_set, and its first entity and
+                                    number of entities
+    <data_type>/measures            the string IDs of the measures
+    <data_type>/values              a row per entity, a column per measure
+    <data_type>/table, /name        the table and the name of each entity
+
+Missing values (None) are stored as NaN.
+"""
+import array
+import io
+import json
+import math
+import struct
+
+import numpy as np
+
+from . import records
+from .spiders import myspider
+
+MAGIC = b'PRZCOL02'
+"""Identifies files in this format."""
+
+ALIGNMENT = 64
+"""Byte alignment of each array within the file."""
+
+DATA_TYPES = (
+    myspider.RESULTS_TIK, myspider.RESULTS_UIK, myspider.TURNOUT_TIK, myspider.TURNOUT_UIK
+)
+"""All the data types, in the order their codes are stored in."""
+
+TRANSPOSED = (myspider.RESULTS_TIK, myspider.RESULTS_UIK)
+"""Data types whose entities are the columns of the table, not the rows."""
+
+NO_TERRITORY = -1
+"""Stands in for the territory of tables that don't have one."""
+
+TABLE_COLUMNS = ('data_type', 'region', 'territory', 'url', 'md5', 'timestamp',
+                 'header_set', 'start', 'count')
+"""The per-table arrays, all of them int32."""
+
+_HEADER_LENGTH = struct.Struct('<Q')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _cells(table):
+    """Return the cells of a table as a 2D array, padding short rows with NaN."""
+    if isinstance(table, records.Table) and table.lengths is None:
+        return np.frombuffer(table.values).reshape(-1, table.width)
+    rows = table['data']
+    cells = np.full((len(rows), max((len(row) for row in rows), default=0)), math.nan)
+    for number, row in enumerate(rows):
+        cells[number, :len(row)] = [math.nan if value is None else value for value in row]
+    return cells
+
+
+class ColumnarWriter(object):
+    """Accumulate tables and write them in columnar format.
+
+    The cells of each table are kept as a block in the table's own order of
+    measures, and only go into the values arrays when the file gets written.
+    """
+
+    def __init__(self):
+        self.strings = []
+        self._string_ids = {}
+        self.header_sets = []
+        self._header_set_ids = {}
+        self.measures = {data_type: [] for data_type in DATA_TYPES}
+        self._measure_positions = {data_type: {} for data_type in DATA_TYPES}
+        self.table_columns = {key: array.array('i') for key in TABLE_COLUMNS}
+        self.blocks = {data_type: [] for data_type in DATA_TYPES}
+        self.entity_table = {data_type: array.array('i') for data_type in DATA_TYPES}
+        self.entity_name = {data_type: array.array('i') for data_type in DATA_TYPES}
+
+    def intern(self, string):
+        """Return the ID of the string, adding it to the string table if necessary."""
+        try:
+            return self._string_ids[string]
+        except KeyError:
+            self._string_ids[string] = len(self.strings)
+            self.strings.append(string)
+            return self._string_ids[string]
+
+    def _header_set(self, data_type, headers):
+        """Return the ID of the list of positions of the headers within the measures.
+
+        Most tables share their headers (see records.share), so each distinct
+        tuple of headers is only looked at once.
+        """
+        key = (data_type, tuple(headers))
+        try:
+            return self._header_set_ids[key]
+        except KeyError:
+            pass
+
+        measures = self.measures[data_type]
+        measure_positions = self._measure_positions[data_type]
+        positions = []
+        for header in headers:
+            string_id = self.intern(header)
+            if string_id not in measure_positions:
+                measure_positions[string_id] = len(measures)
+                measures.append(string_id)
+            positions.append(measure_positions[string_id])
+
+        self._header_set_ids[key] = len(self.header_sets)
+        self.header_sets.append(positions)
+        return self._header_set_ids[key]
+
+    def add(self, table):
+        """Add a table, as emitted by the spider."""
+        data_type = table['data_type']
+        cells = _cells(table)
+        if data_type in TRANSPOSED:
+            measure_headers, entity_headers = table['row_headers'], table['column_headers']
+            cells = cells.T
+        else:
+            measure_headers, entity_headers = table['column_headers'], table['row_headers']
+
+        header_set = self._header_set(data_type, measure_headers)
+        positions = self.header_sets[header_set]
+        count = min(len(entity_headers), cells.shape[0])
+        width = min(len(positions), cells.shape[1])
+        start = len(self.entity_table[data_type])
+        table_id = len(self.table_columns['url'])
+        block = np.array(cells[:count, :width], dtype=np.float64)
+        self.blocks[data_type].append((header_set, start, block))
+        self.entity_table[data_type].extend([table_id] * count)
+        self.entity_name[data_type].extend(self.intern(name) for name in entity_headers[:count])
+
+        columns = self.table_columns
+        columns['data_type'].append(DATA_TYPES.index(data_type))
+        columns['region'].append(self.intern(table['region']))
+        territory = table.get('territory')
+        columns['territory'].append(NO_TERRITORY if territory is None else self.intern(territory))
+        for key in ('url', 'md5', 'timestamp'):
+            columns[key].append(self.intern(table[key]))
+        columns['header_set'].append(header_set)
+        columns['start'].append(start)
+        columns['count'].append(count)
+
+    def _values(self, data_type):
+        """Put the blocks of the tables of a data_type together into one array."""
+        values = np.full((len(self.entity_table[data_type]), len(self.measures[data_type])),
+                         math.nan)
+        for header_set, start, block in self.blocks[data_type]:
+            positions = self.header_sets[header_set][:block.shape[1]]
+            values[start:start + block.shape[0], positions] = block
+        return values
+
+    def _arrays(self):
+        encoded = [string.encode('utf-8') for string in self.strings]
+        string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=string_offsets[1:])
+        header_set_offsets = np.zeros(len(self.header_sets) + 1, dtype=np.int32)
+        np.cumsum([len(positions) for positions in self.header_sets], out=header_set_offsets[1:])
+        arrays = {
+            'strings/data': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            'strings/offsets': string_offsets,
+            'header_set/positions': np.array(
+                [p for positions in self.header_sets for p in positions], dtype=np.int32
+            ),
+            'header_set/offsets': header_set_offsets,
+        }
+        for key, column in self.table_columns.items():
+            arrays['table/' + key] = np.frombuffer(column, dtype=np.int32)
+        for data_type in DATA_TYPES:
+            arrays[data_type + '/measures'] = np.array(self.measures[data_type], dtype=np.int32)
+            arrays[data_type + '/values'] = self._values(data_type)
+            arrays[data_type + '/table'] = np.frombuffer(self.entity_table[data_type], np.int32)
+            arrays[data_type + '/name'] = np.frombuffer(self.entity_name[data_type], np.int32)
+        return arrays
+
+    def write(self, fout):
+        """Write everything added so far to a binary file object."""
+        arrays = self._arrays()
+        offset = 0
+        layout = {}
+        for name, arr in sorted(arrays.items()):
+            layout[name] = {'dtype': arr.dtype.str, 'shape': arr.shape, 'offset': offset}
+            offset = _align(offset + arr.nbytes)
+        header = json.dumps({'arrays': layout}).encode('utf-8')
+
+        fout.write(MAGIC)
+        fout.write(_HEADER_LENGTH.pack(len(header)))
+        fout.write(header)
+        position = len(MAGIC) + _HEADER_LENGTH.size + len(header)
+        fout.write(b'\0' * (_align(position) - position))
+
+        position = 0
+        for name, arr in sorted(arrays.items()):
+            padding = layout[name]['offset'] - position
+            fout.write(b'\0' * padding)
+            fout.write(arr.tobytes())
+            position += padding + arr.nbytes
+
+
+class ColumnarDataset(object):
+    """A memory-mapped dataset in columnar format.
+
+    The arrays attribute maps names like 'results_uik/values' to NumPy arrays.
+    """
+
+    def __init__(self, path):
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError('%r is not in columnar format' % path)
+        position = len(MAGIC)
+        header_length, = _HEADER_LENGTH.unpack(bytes(buf[position:position + _HEADER_LENGTH.size]))
+        position += _HEADER_LENGTH.size
+        header = json.loads(bytes(buf[position:position + header_length]).decode('utf-8'))
+        data_start = _align(position + header_length)
+
+        self.arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape'], dtype=np.int64))
+            start = data_start + spec['offset']
+            self.arrays[name] = buf[start:start + count * dtype.itemsize].view(dtype).reshape(
+                spec['shape']
+            )
+        self._table_columns = {key: self.arrays['table/' + key] for key in TABLE_COLUMNS}
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._table_columns['url'])
+
+    def string(self, string_id):
+        """Return the string with the ID."""
+        try:
+            return self._strings[string_id]
+        except KeyError:
+            pass
+        offsets = self.arrays['strings/offsets']
+        start, stop = offsets[string_id], offsets[string_id + 1]
+        string = bytes(self.arrays['strings/data'][start:stop]).decode('utf-8')
+        self._strings[string_id] = string
+        return string
+
+    def header_set(self, header_set):
+        """Return the positions of the headers of a header set among the measures."""
+        offsets = self.arrays['header_set/offsets']
+        return self.arrays['header_set/positions'][offsets[header_set]:offsets[header_set + 1]]
+
+    def measure_headers(self, data_type):
+        """Return the names of the columns of the values array for data_type."""
+        return [self.string(i) for i in self.arrays[data_type + '/measures'].tolist()]
+
+    def entity_names(self, data_type):
+        """Return the name of each row of the values array for data_type."""
+        return [self.string(i) for i in self.arrays[data_type + '/name'].tolist()]
+
+    def table(self, table_id):
+        """Return the table as a dict, in the same shape the spider emits them."""
+        column = {key: int(arr[table_id]) for (key, arr) in self._table_columns.items()}
+        data_type = DATA_TYPES[column['data_type']]
+        positions = self.header_set(column['header_set'])
+        start, stop = column['start'], column['start'] + column['count']
+
+        values = self.arrays[data_type + '/values'][start:stop][:, positions]
+        data = [[None if math.isnan(v) else v for v in row] for row in values.tolist()]
+        names = [self.string(i) for i in self.arrays[data_type + '/name'][start:stop].tolist()]
+        measures = self.arrays[data_type + '/measures'][positions]
+        measure_headers = [self.string(i) for i in measures.tolist()]
+
+        result = {'region': self.string(column['region'])}
+        if column['territory'] != NO_TERRITORY:
+            result['territory'] = self.string(column['territory'])
+        if data_type in TRANSPOSED:
+            result.update(row_headers=measure_headers, column_headers=names,
+                          data=[list(row) for row in zip(*data)])
+        else:
+            result.update(row_headers=names, column_headers=measure_headers, data=data)
+        result['data_type'] = data_type
+        for key in ('url', 'md5', 'timestamp'):
+            result[key] = self.string(column[key])
+        return result
+
+    def iter_tables(self):
+        for table_id in range(len(self)):
+            yield self.table(table_id)
+
+
+def write_dataset(tables, path):
+    """Convert tables (e.g. from dataset.iter_tables) to a columnar file at path."""
+    writer = ColumnarWriter()
+    for table in tables:
+        writer.add(table)
+    with io.open(path, 'wb') as fout:
+        writer.write(fout)
+
+
+def main():
+    import argparse
+
+    from . import dataset
+
+    parser = argparse.ArgumentParser(description='Convert a JSON-lines dataset to columnar format')
+    parser.add_argument('source', help='e.g. results.json.gz')
+    parser.add_argument('destination', help='e.g. results.col')
+    args = parser.parse_args()
+
+    write_dataset(dataset.iter_tables(args.source), args.destination)
+
+
+if __name__ == '__main__':
+    main()
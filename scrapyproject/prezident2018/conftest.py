@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from . import histograms
+from . import stations
+
+
+@pytest.fixture
+def random_stations():
+    """Return 200 stations with random votes and turnout."""
+    count = 200
+    random = np.random.RandomState(0)
+    results = np.zeros((count, len(stations.MEASURES)))
+    votes = random.randint(0, 300, size=(count, len(stations.CANDIDATES)))
+    first = stations.MEASURES.index(stations.CANDIDATES[0])
+    results[:, first:] = votes
+    results[:, stations.MEASURES.index(histograms.VALID)] = votes.sum(axis=1)
+    results[:, 0] = votes.sum(axis=1) + random.randint(0, 2000, size=count)
+    #
+    # No one voted at the first station.
+    #
+    results[0] = 0
+    turnout = np.sort(random.uniform(0, 100, size=(count, 4)), axis=1)
+    turnout[1] = np.nan
+    keys = [stations.Key('region', 'territory', 'УИК №%d' % i) for i in range(count)]
+    return stations.Stations(keys, results, turnout)
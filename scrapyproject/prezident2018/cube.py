@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Sum the results of the polling stations by region and territory, once.
+
+Reports like "the votes for each candidate in each region" used to filter
+the tables once per region.  A Cube gets built in one pass over the
+results_uik tables, and holds the sum of each of stations.MEASURES for every
+(region, territory), every region and the whole country, so that each of
+those is a lookup:
+
+    >>> c = cube.load('results.json.gz')
+    >>> c.value('Путин Владимир Владимирович', region='Сахалинская область')
+    >>> for territory, values in c.drill_down('Сахалинская область'):
+    ...     print(territory, values['Число действительных избирательных бюллетеней'])
+
+load saves the cube next to the dataset (the name of the dataset with
+.cube.npz appended), and rebuilds it only once the dataset is newer.
+The sums come from the Сумма column of each table, so they're only as good
+as the tables (see validation).
+"""
+import io
+import os.path as P
+
+import numpy as np
+
+from . import stations
+from .spiders import myspider
+
+MEASURES = stations.MEASURES
+"""The measures that get summed, in order."""
+
+SUFFIX = '.cube.npz'
+"""Appended to the name of the dataset to get the name of its cube."""
+
+
+class Cube(object):
+    """The sums of the measures by territory, region and for the whole country.
+
+    territories is a sorted list of (region, territory) pairs, and regions
+    a sorted list of regions.  territory_sums, region_sums and total have a
+    column for each of MEASURES, and territory_stations, region_stations and
+    total_stations count the polling stations that went into each sum.
+    """
+
+    def __init__(self, territories, territory_sums, territory_stations):
+        self.territories = territories
+        self.territory_sums = territory_sums
+        self.territory_stations = territory_stations
+        self.regions = sorted(set(region for (region, _) in territories))
+
+        self._territory_index = {key: row for (row, key) in enumerate(territories)}
+        self._region_index = {region: row for (row, region) in enumerate(self.regions)}
+        self._measure_index = {measure: column for (column, measure) in enumerate(MEASURES)}
+
+        #
+        # The territories are sorted, so those of each region are contiguous.
+        #
+        self._region_slices = {}
+        for row, (region, _) in enumerate(territories):
+            start, _ = self._region_slices.get(region, (row, row))
+            self._region_slices[region] = (start, row + 1)
+
+        starts = np.array([self._region_slices[region][0] for region in self.regions],
+                          dtype=np.intp)
+        if len(territories):
+            self.region_sums = np.add.reduceat(territory_sums, starts, axis=0)
+            self.region_stations = np.add.reduceat(territory_stations, starts)
+        else:
+            self.region_sums = np.zeros((0, len(MEASURES)))
+            self.region_stations = np.zeros(0, dtype=np.int64)
+        self.total = territory_sums.sum(axis=0)
+        self.total_stations = int(territory_stations.sum())
+
+    @classmethod
+    def from_tables(cls, tables):
+        """Build from the tables emitted by the spider.  Only the results_uik tables are used.
+
+        If there's more than one version of the table of a territory,
+        the last one wins.
+        """
+        sums = {}
+        counts = {}
+        for table in tables:
+            if table['data_type'] != myspider.RESULTS_UIK:
+                continue
+            key = (table['region'], table['territory'])
+            row_headers, data = table['row_headers'], table['data']
+            positions = [row_headers.index(measure) for measure in MEASURES]
+            sums[key] = [data[position][0] for position in positions]
+            counts[key] = len(table['column_headers']) - 1
+
+        territories = sorted(sums)
+        territory_sums = np.array([sums[key] for key in territories], dtype=float)
+        territory_stations = np.array([counts[key] for key in territories], dtype=np.int64)
+        return cls(territories, territory_sums.reshape(len(territories), len(MEASURES)),
+                   territory_stations)
+
+    def save(self, fout):
+        """Save to a binary file object."""
+        np.savez(
+            fout,
+            regions=np.array([region for (region, _) in self.territories], dtype=str),
+            territories=np.array([territory for (_, territory) in self.territories], dtype=str),
+            measures=np.array(MEASURES, dtype=str),
+            sums=self.territory_sums,
+            stations=self.territory_stations,
+        )
+
+    @classmethod
+    def read(cls, fin):
+        """Read what save wrote.  Returns None if it was saved with different MEASURES."""
+        with np.load(fin) as saved:
+            if tuple(saved['measures']) != MEASURES:
+                return None
+            territories = list(zip(saved['regions'].tolist(), saved['territories'].tolist()))
+            return cls(territories, saved['sums'], saved['stations'])
+
+    def _row(self, region, territory):
+        if territory is not None:
+            return self.territory_sums[self._territory_index[region, territory]]
+        elif region is not None:
+            return self.region_sums[self._region_index[region]]
+        return self.total
+
+    def value(self, measure, region=None, territory=None):
+        """Return the sum of one measure for a territory, a region or the whole country."""
+        return float(self._row(region, territory)[self._measure_index[measure]])
+
+    def rollup(self, region=None, territory=None):
+        """Return the sums of all the measures, as a dict keyed by measure."""
+        return dict(zip(MEASURES, self._row(region, territory).tolist()))
+
+    def num_stations(self, region=None, territory=None):
+        """Return the number of polling stations in a territory, a region or the whole country."""
+        if territory is not None:
+            return int(self.territory_stations[self._territory_index[region, territory]])
+        elif region is not None:
+            return int(self.region_stations[self._region_index[region]])
+        return self.total_stations
+
+    def territories_of(self, region):
+        """Return the territories of a region, in order."""
+        start, stop = self._region_slices[region]
+        return [territory for (_, territory) in self.territories[start:stop]]
+
+    def drill_down(self, region=None):
+        """Return (name, sums) pairs for each region, or each territory of a region.
+
+        The sums are dicts keyed by measure, like rollup returns.
+        """
+        if region is None:
+            return [(name, dict(zip(MEASURES, row)))
+                    for (name, row) in zip(self.regions, self.region_sums.tolist())]
+        start, stop = self._region_slices[region]
+        return [(name, dict(zip(MEASURES, row))) for (name, row) in zip(
+            self.territories_of(region), self.territory_sums[start:stop].tolist()
+        )]
+
+
+def cube_path(dataset_path):
+    return dataset_path + SUFFIX
+
+
+def load(dataset_path, rebuild=False):
+    """Load the cube of a dataset, building and saving it first if it's missing or stale."""
+    path = cube_path(dataset_path)
+    if not rebuild and P.isfile(path) and P.getmtime(path) >= P.getmtime(dataset_path):
+        with io.open(path, 'rb') as fin:
+            cube = Cube.read(fin)
+        if cube is not None:
+            return cube
+
+    cube = Cube.from_tables(
+        stations.iter_any_tables(dataset_path, data_type=myspider.RESULTS_UIK)
+    )
+    with io.open(path, 'wb') as fout:
+        cube.save(fout)
+    return cube
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sum the results by region and territory')
+    parser.add_argument('dataset', help='e.g. results.json.gz')
+    parser.add_argument('region', nargs='?', help='show the territories of this region')
+    parser.add_argument('--measure', default=MEASURES[9],
+                        help='the measure to show, e.g. a candidate (default: valid ballots)')
+    parser.add_argument('--rebuild', action='store_true')
+    args = parser.parse_args()
+
+    cube = load(args.dataset, rebuild=args.rebuild)
+    if args.region:
+        names = cube.territories_of(args.region)
+        rows = [(name, cube.num_stations(args.region, name),
+                 cube.value(args.measure, args.region, name)) for name in names]
+    else:
+        rows = [(region, cube.num_stations(region), cube.value(args.measure, region))
+                for region in cube.regions]
+    print('%s|stations|%s' % ('territory' if args.region else 'region', args.measure))
+    for name, num_stations, value in rows:
+        print('%s|%d|%g' % (name, num_stations, value))
+
+
+if __name__ == '__main__':
+    main()
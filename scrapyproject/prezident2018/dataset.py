@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Read the datasets written by the spider.
+
+A dataset is a JSON-lines file with one scraped table per line, optionally
+compressed with gzip (.gz) or zstd (.zst).  Compressed datasets may consist of
+several concatenated gzip members or zstd frames, as written by
+pipelines.LineExporter.
+
+To read only some of the tables, e.g. for a regional analysis, use select:
+
+    for table in dataset.select('results.json.gz', data_type='results_uik',
+                                region='Сахалинская область', fields=('territory', 'data')):
+        ...
+
+It only holds one table at a time, and doesn't bother decoding the lines
+that can't match.
+"""
+import gzip
+import io
+import json
+import logging
+import os.path as P
+import zlib
+
+LOGGER = logging.getLogger(__name__)
+
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+"""The compression used for files with each of these extensions."""
+
+CHUNK_SIZE = 1 << 20
+"""How many bytes to read from the dataset at a time."""
+
+
+def import_zstd():
+    """Import the zstd module from the standard library or its backport."""
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            from backports import zstd
+        except ImportError:
+            raise ImportError('zstd support requires Python 3.14 or backports.zstd')
+    return zstd
+
+
+def compression_for(path):
+    """Return the compression implied by the name of the file, or None."""
+    return COMPRESSION_EXTENSIONS.get(P.splitext(path)[1])
+
+
+def compressor(compression):
+    """Return a function that compresses bytes into a self-contained member or frame."""
+    if compression is None:
+        return bytes
+    elif compression == 'gzip':
+        return gzip.compress
+    elif compression == 'zstd':
+        return import_zstd().compress
+    raise ValueError('unsupported compression: %r' % compression)
+
+
+def _decompressor_factory(compression):
+    if compression == 'gzip':
+        return lambda: zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    elif compression == 'zstd':
+        return import_zstd().ZstdDecompressor
+    raise ValueError('unsupported compression: %r' % compression)
+
+
+def _iter_decompressed(fin, compression):
+    """Decompress the chunks of a file made up of concatenated members or frames.
+
+    If the crawl that wrote the file died, the last member may be truncated.
+    Decompress as much of it as we can instead of failing.
+    """
+    new_decompressor = _decompressor_factory(compression)
+    decompressor = new_decompressor()
+    pending = False
+    for data in iter(lambda: fin.read(CHUNK_SIZE), b''):
+        while data:
+            #
+            # Repetitive tables compress really well, so limit the output
+            # instead of decompressing a whole chunk in one go.
+            #
+            yield decompressor.decompress(data, CHUNK_SIZE)
+            pending = not decompressor.eof
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = new_decompressor()
+            elif hasattr(decompressor, 'unconsumed_tail'):
+                data = decompressor.unconsumed_tail
+            elif not decompressor.needs_input:
+                data = b''
+                while not (decompressor.needs_input or decompressor.eof):
+                    yield decompressor.decompress(b'', CHUNK_SIZE)
+                pending = not decompressor.eof
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = new_decompressor()
+            else:
+                data = b''
+    if pending:
+        LOGGER.warning('%r: the last compressed member is truncated', fin.name)
+
+
+def iter_lines(path):
+    """Yield each complete line of the dataset as bytes, decompressing if necessary."""
+    compression = compression_for(path)
+    with io.open(path, 'rb') as fin:
+        if compression is None:
+            chunks = iter(lambda: fin.read(CHUNK_SIZE), b'')
+        else:
+            chunks = _iter_decompressed(fin, compression)
+
+        remainder = b''
+        for chunk in chunks:
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line
+
+    if remainder:
+        LOGGER.warning('%r: ignoring incomplete last line', path)
+
+
+def iter_tables(path):
+    """Yield each table in the dataset as a dict."""
+    for line in iter_lines(path):
+        if line:
+            yield json.loads(line.decode('utf-8'))
+
+
+FILTER_FIELDS = ('data_type', 'region', 'territory')
+"""The fields that select can filter on."""
+
+
+def _needles(values):
+    """Return the ways each of the values can appear in a line, as encoded JSON strings."""
+    needles = set()
+    for value in values:
+        needles.add(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        needles.add(json.dumps(value).encode('utf-8'))
+    return tuple(needles)
+
+
+def select(path, data_type=None, region=None, territory=None, fields=None):
+    """Yield the tables in the dataset that match the filters, as dicts.
+
+    Each filter is a value or a collection of values.  A line gets decoded
+    only if it contains one of the values of each filter somewhere, and then
+    the table is checked properly.  If fields is set, the dicts only have
+    those fields.
+    """
+    filters = []
+    for field, values in zip(FILTER_FIELDS, (data_type, region, territory)):
+        if values is None:
+            continue
+        values = frozenset([values] if isinstance(values, str) else values)
+        filters.append((field, values, _needles(values)))
+
+    for line in iter_lines(path):
+        if not line:
+            continue
+        if not all(any(needle in line for needle in needles) for (_, _, needles) in filters):
+            continue
+        table = json.loads(line.decode('utf-8'))
+        if not all(table.get(field) in values for (field, values, _) in filters):
+            continue
+        if fields is not None:
+            table = {field: table.get(field) for field in fields}
+        yield table
+
+
+def read_index(path):
+    """Return the entries of the index that pipelines.LineExporter writes next to a dataset.
+
+    Skips the line the crawl that wrote the index was writing if it died.
+    """
+    entries = []
+    if not P.isfile(path):
+        return entries
+    with io.open(path, 'rb') as fin:
+        for line in fin:
+            try:
+                entries.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                continue
+    return entries
+
+
+def repair(path):
+    """Cut off the batch that was being written when the crawl that wrote the dataset died.
+
+    Uses the index that pipelines.LineExporter writes next to the dataset, so
+    that the next crawl can append to it.  Returns the number of bytes cut off.
+    """
+    index_path = path + '.idx'
+    if not (P.isfile(path) and P.isfile(index_path)):
+        return 0
+
+    end = 0
+    for entry in read_index(index_path):
+        if 'offset' in entry:
+            end = max(end, entry['offset'] + entry['length'])
+
+    size = P.getsize(path)
+    if size <= end:
+        return 0
+    LOGGER.warning('%r: cutting off %d bytes after the last complete batch', path, size - end)
+    with io.open(path, 'r+b') as fout:
+        fout.truncate(end)
+    return size - end
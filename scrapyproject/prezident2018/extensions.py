@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Define your extensions here
+#
+# Don't forget to add your extension to the EXTENSIONS setting
+# See: http://doc.scrapy.org/en/latest/topics/extensions.html
+import io
+import logging
+import os
+import time
+
+import scrapy.exceptions
+import scrapy.signals
+from twisted.internet import task
+
+from . import instrumentation
+
+LOGGER = logging.getLogger(__name__)
+
+
+class InstrumentationExtension(object):
+    """Periodically write out the metrics collected by the instrumentation module.
+
+    Enabled by setting INSTRUMENTATION_FILE.  Every INSTRUMENTATION_INTERVAL
+    seconds (and when the spider closes), writes the metrics to that file in
+    the Prometheus text format, e.g. for the node_exporter textfile collector,
+    and logs how many pages of each level have been handled and are queued.
+    """
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('INSTRUMENTATION_FILE')
+        if not path:
+            raise scrapy.exceptions.NotConfigured
+        extension = cls(path, crawler.settings.getfloat('INSTRUMENTATION_INTERVAL'))
+        crawler.signals.connect(extension.spider_opened, signal=scrapy.signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=scrapy.signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        instrumentation.METRICS.reset()
+        self.task = task.LoopingCall(self.dump)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.dump()
+
+    def dump(self):
+        """Write the metrics, replacing the file atomically so readers never see half of it."""
+        LOGGER.info('pages: %s', instrumentation.METRICS.summary())
+        temp_path = self.path + '.tmp'
+        with io.open(temp_path, 'wt', encoding='utf-8') as fout:
+            fout.write(instrumentation.METRICS.to_prometheus())
+        os.rename(temp_path, self.path)
+
+
+ERROR_STATUSES = (429, 500, 502, 503, 504)
+"""Responses that mean the server is struggling."""
+
+
+class AdaptiveConcurrencyExtension(object):
+    """Adapt the number of concurrent requests to how the server is coping.
+
+    Enabled by setting ADAPTIVE_CONCURRENCY_ENABLED.  AutoThrottle adapts the
+    delay between requests, but keeps their concurrency fixed.  Here, we keep
+    the delay and adapt the concurrency of each download slot instead, like
+    TCP does with its congestion window: every response that arrives within
+    ADAPTIVE_CONCURRENCY_TARGET_LATENCY seconds adds about one request to the
+    concurrency per round trip, and a slower response or a server error halves
+    it (at most once per target latency, so that a burst of slow responses
+    counts once).  The concurrency stays between 1 and
+    ADAPTIVE_CONCURRENCY_MAX.
+    """
+
+    def __init__(self, crawler, target_latency, max_concurrency):
+        self.crawler = crawler
+        self.target_latency = target_latency
+        self.max_concurrency = max_concurrency
+        self.windows = {}
+        self.last_decrease = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise scrapy.exceptions.NotConfigured
+        extension = cls(
+            crawler,
+            crawler.settings.getfloat('ADAPTIVE_CONCURRENCY_TARGET_LATENCY'),
+            crawler.settings.getint('ADAPTIVE_CONCURRENCY_MAX'),
+        )
+        crawler.signals.connect(extension.response_received,
+                                signal=scrapy.signals.response_received)
+        return extension
+
+    def response_received(self, response, request, spider):
+        key = request.meta.get('download_slot')
+        latency = request.meta.get('download_latency')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None or latency is None:
+            return
+        concurrency = self.adjust(key, slot.concurrency, latency, response.status)
+        if concurrency != slot.concurrency:
+            LOGGER.debug('slot %r: concurrency %d -> %d (latency %.2fs, status %d)',
+                         key, slot.concurrency, concurrency, latency, response.status)
+            slot.concurrency = concurrency
+
+    def adjust(self, key, concurrency, latency, status, now=None):
+        """Return the new concurrency of a slot after one of its responses."""
+        if now is None:
+            now = time.monotonic()
+        window = self.windows.get(key, float(concurrency))
+
+        if status in ERROR_STATUSES or latency > self.target_latency:
+            if now - self.last_decrease.get(key, -self.target_latency) >= self.target_latency:
+                window = window / 2
+                self.last_decrease[key] = now
+        else:
+            window += 1 / window
+
+        window = min(max(window, 1.0), self.max_concurrency)
+        self.windows[key] = window
+        return int(window)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Crawl without Scrapy's engine: drive the spider's callbacks from an asyncio loop.
+
+Good for quick crawls of a region or two, where starting up Scrapy's crawler
+and the Twisted reactor takes longer than the crawl itself:
+
+    python -m prezident2018.fetch -o results.json.gz
+    python -m prezident2018.fetch -o adygea.json.gz --callback cb_region_ik_home REGION_URL
+
+where REGION_URL is one of the region links on the central page.
+
+The callbacks are the same ones the spider uses (see myspider), so the
+tables are the same too.  All the downloads share a pool of keep-alive
+connections, and at most CONCURRENCY pages are downloaded at once.  Like the
+spider's scheduler, the crawler prefers deeper pages, so tables get written
+as each TIK completes.  Like Scrapy, it doesn't request the same URL twice
+and retries errors a couple of times.
+
+None of the spider's middlewares, pipelines and extensions run here, and the
+tables get parsed in the event loop, in between downloads.  Scrapy still gets
+imported, since the callbacks yield scrapy.Request objects (only their url,
+callback and dont_filter are used here), but the reactor never does.
+"""
+import asyncio
+import io
+import itertools
+import logging
+
+import aiohttp
+import scrapy
+
+from . import instrumentation
+from .spiders import myspider
+
+LOGGER = logging.getLogger(__name__)
+
+CONCURRENCY = 8
+"""The maximum number of pages to download at once."""
+
+TIMEOUT = 60
+"""Give up on a download after this many seconds."""
+
+RETRY_TIMES = 2
+"""Retry a failed download this many times."""
+
+RETRY_DELAY = 1
+"""Wait this many seconds before the first retry, and twice as long before each next one."""
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+"""Retry the downloads that fail with these HTTP statuses."""
+
+
+class Crawler(object):
+    """Download pages and hand them to their callbacks.
+
+    export gets called with each table the callbacks yield.  pages, items
+    and failed count what happened.
+    """
+
+    def __init__(self, export, concurrency=CONCURRENCY, timeout=TIMEOUT,
+                 retry_times=RETRY_TIMES, retry_delay=RETRY_DELAY):
+        self.export = export
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retry_times = retry_times
+        self.retry_delay = retry_delay
+        self.seen = set()
+        self.pages = 0
+        self.items = 0
+        self.failed = 0
+        self._queue = None
+        self._sequence = itertools.count()
+
+    def run(self, requests):
+        """Crawl, starting with the requests, until there's nothing left to crawl."""
+        asyncio.run(self.crawl(requests))
+
+    async def crawl(self, requests):
+        self._queue = asyncio.PriorityQueue()
+        for request in requests:
+            self.enqueue(request)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            workers = [asyncio.ensure_future(self._work(session))
+                       for _ in range(self.concurrency)]
+            try:
+                await self._queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        LOGGER.info('crawled %d pages, %d tables, %d failed', self.pages, self.items, self.failed)
+
+    def enqueue(self, request):
+        if not request.dont_filter:
+            if request.url in self.seen:
+                return
+            self.seen.add(request.url)
+        #
+        # Deeper pages first, and otherwise in the order they were requested.
+        #
+        depth = instrumentation.LEVELS.index(request.callback.level)
+        self._queue.put_nowait((-depth, next(self._sequence), request))
+
+    async def _work(self, session):
+        while True:
+            _, _, request = await self._queue.get()
+            try:
+                body = await self.download(session, request.url)
+                if body is None:
+                    self.failed += 1
+                else:
+                    self.handle(request, body)
+            except Exception:
+                self.failed += 1
+                LOGGER.exception('%r: callback failed', request.url)
+            finally:
+                self._queue.task_done()
+
+    async def download(self, session, url):
+        """Return the body of the page, or None if we couldn't get it."""
+        for attempt in range(self.retry_times + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                async with session.get(url) as response:
+                    body = await response.read()
+                    if response.status == 200:
+                        return body
+                    if response.status not in RETRY_STATUSES:
+                        LOGGER.error('%r: HTTP %d', url, response.status)
+                        return None
+                    LOGGER.warning('%r: HTTP %d (attempt %d)', url, response.status, attempt + 1)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                LOGGER.warning('%r: %r (attempt %d)', url, err, attempt + 1)
+        LOGGER.error('%r: giving up after %d attempts', url, self.retry_times + 1)
+        return None
+
+    def handle(self, request, body):
+        """Run the request's callback on the page."""
+        self.pages += 1
+        page = myspider.Page(request.url, body, myspider.make_selector(body))
+        for thing in request.callback(page):
+            if isinstance(thing, scrapy.Request):
+                self.enqueue(thing)
+            else:
+                self.items += 1
+                self.export(thing)
+
+
+def main():
+    import argparse
+
+    from . import pipelines
+
+    parser = argparse.ArgumentParser(description="Crawl without Scrapy's engine")
+    parser.add_argument('url', nargs='?', default=myspider.TOP_URL)
+    parser.add_argument('--callback', default='cb_central_ik_home',
+                        help='the callback for the first page, e.g. cb_region_ik_home')
+    parser.add_argument('-o', '--output', required=True, help='e.g. results.json.gz')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--loglevel', default='INFO')
+    args = parser.parse_args()
+
+    if not args.callback.startswith('cb_'):
+        parser.error('callback name should start with cb_')
+
+    logging.basicConfig(level=args.loglevel)
+    with io.open(args.output, 'wb') as fout:
+        #
+        # Nothing would run the flush timer, which needs the reactor, so
+        # flush every flush_items tables only.
+        #
+        exporter = pipelines.LineExporter(fout, flush_seconds=0)
+        exporter.start_exporting()
+        crawler = Crawler(exporter.export_item, concurrency=args.concurrency)
+        crawler.run([scrapy.Request(args.url, callback=getattr(myspider, args.callback))])
+        exporter.finish_exporting()
+    LOGGER.info('%s', instrumentation.METRICS.summary())
+
+
+if __name__ == '__main__':
+    main()
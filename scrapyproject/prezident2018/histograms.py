@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Bin the polling stations, for all the candidates or turnout times at once.
+
+Each function takes a stations.Stations and returns a Binned, whose values
+have a row for each of its labels (the candidates or the turnout times) and
+a column for each bin.  The bins are centred on multiples of the width, and
+each station goes into the bin nearest to its value, so a width of 0.01
+(or 1, for percentages) gives the integer-percent peaks:
+
+    >>> st = stations.load('results.json.gz')
+    >>> binned = histograms.vote_share(st, width=0.01)
+    >>> plt.plot(binned.centres, binned.row('Путин Владимир Владимирович'))
+
+Stations whose value is missing (NaN), e.g. because they had no valid
+ballots, aren't counted.
+"""
+import collections
+
+import numpy as np
+
+from . import stations
+
+ELIGIBLE = stations.MEASURES[0]
+"""The number of voters on the list of a polling station."""
+
+VALID = stations.MEASURES[9]
+"""The number of valid ballots at a polling station."""
+
+
+class Binned(collections.namedtuple('Binned', 'centres labels values')):
+    """A histogram for each of labels: values[i, j] is the total for labels[i] in bin j."""
+
+    __slots__ = ()
+
+    def row(self, label):
+        return self.values[self.labels.index(label)]
+
+
+def binned(values, width, low=0, high=1, weights=None):
+    """Sum the weights of the values in each bin, for each column of values.
+
+    values has a row for each station and a column for each histogram.
+    weights has the same shape, or a single column of values gets binned
+    with each column of weights.  Without weights, the stations get counted.
+    Returns the centres of the bins and an array with a row for each histogram.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+        if weights.ndim == 1:
+            weights = weights[:, np.newaxis]
+        values, weights = np.broadcast_arrays(values, weights)
+    num_bins = int(round((high - low) / width)) + 1
+    positions = np.rint((values - low) / width)
+
+    ok = (positions >= 0) & (positions < num_bins)
+    #
+    # Turn the position within each histogram into a position within all of them,
+    # so that one bincount does them all.
+    #
+    columns = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    flat = columns[ok] * num_bins + positions[ok].astype(np.intp)
+    if weights is not None:
+        weights = weights[ok]
+    sums = np.bincount(flat, weights=weights, minlength=values.shape[1] * num_bins)
+    centres = low + width * np.arange(num_bins)
+    return centres, sums.reshape(values.shape[1], num_bins)
+
+
+def candidate_votes(st):
+    """Return the votes for each candidate: a row for each station, a column for each candidate."""
+    first = stations.MEASURES.index(stations.CANDIDATES[0])
+    return st.results[:, first:first + len(stations.CANDIDATES)]
+
+
+def turnout(st):
+    """Return the valid ballots as a fraction of the voters on the list, for each station."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return st.measure(VALID) / st.measure(ELIGIBLE)
+
+
+def vote_share(st, width=0.002):
+    """Bin the stations by each candidate's share of the valid ballots there.
+
+    The values are the candidate's votes in each bin.
+    """
+    votes = candidate_votes(st)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = votes / st.measure(VALID)[:, np.newaxis]
+    centres, values = binned(shares, width, weights=votes)
+    return Binned(centres, stations.CANDIDATES, values)
+
+
+def votes_by_turnout(st, width=0.01):
+    """Bin the stations by turnout (see turnout).  The values are each candidate's votes."""
+    votes = candidate_votes(st)
+    centres, values = binned(turnout(st), width, weights=votes)
+    return Binned(centres, stations.CANDIDATES, values)
+
+
+def turnout_times(st, width=1):
+    """Bin the stations by the turnout percentage reported at each of TURNOUT_TIMES.
+
+    The values are the number of stations in each bin.
+    """
+    centres, values = binned(st.turnout, width, high=100)
+    return Binned(centres, stations.TURNOUT_TIMES, values)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Count and time the spider's callbacks and parse functions.
+
+Decorate a callback with instrument_callback(level) and a parse function
+with instrument_parser.  The metrics accumulate in the module-level METRICS,
+which extensions.InstrumentationExtension periodically writes out in the
+Prometheus text format.
+
+For each callback, we record the number of calls, a histogram of the time
+spent inside it (for generators, only the time spent producing output, not
+the time the consumer spends between items), a histogram of response sizes,
+and the number of requests and items it yielded.  For each parse function,
+we record a histogram of time by data_type.
+
+For each level of the hierarchy (central -> region -> tik -> uik), we record
+how many requests have been yielded for that level's callbacks and how many
+of those callbacks have started.  The difference is the number of pages of
+that level waiting to be downloaded (or dropped along the way, e.g. by errors).
+
+The parse functions' caches (see myspider.compile_xpath and
+myspider.HeaderCache) count their hits and misses here, too.
+"""
+import bisect
+import collections
+import functools
+import inspect
+import time
+
+import scrapy
+
+CENTRAL = 'central'
+REGION = 'region'
+TIK = 'tik'
+UIK = 'uik'
+
+LEVELS = (CENTRAL, REGION, TIK, UIK)
+"""The levels of the hierarchy, from the top down."""
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+"""Upper bounds of the histogram buckets for durations, in seconds."""
+
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+"""Upper bounds of the histogram buckets for response sizes, in bytes."""
+
+PREFIX = 'prezident2018_'
+"""Prepended to the names of all the metrics."""
+
+
+class Histogram(object):
+    """A histogram with fixed buckets, like a Prometheus histogram."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Yield (upper bound, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics(object):
+    """Counters and histograms for the callbacks, parsers and levels."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = collections.Counter()
+        self.requests = collections.Counter()
+        self.items = collections.Counter()
+        self.callback_seconds = collections.defaultdict(lambda: Histogram(TIME_BUCKETS))
+        self.response_bytes = collections.defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.parse_seconds = collections.defaultdict(lambda: Histogram(TIME_BUCKETS))
+        self.enqueued = collections.Counter()
+        self.started = collections.Counter()
+        self.cache_hits = collections.Counter()
+        self.cache_misses = collections.Counter()
+
+    def hit_rate(self, cache):
+        """Return the fraction of lookups in the cache that were hits (None if there were none)."""
+        lookups = self.cache_hits[cache] + self.cache_misses[cache]
+        return self.cache_hits[cache] / lookups if lookups else None
+
+    def queue_depth(self, level):
+        """Return the number of requests for this level that haven't been handled yet."""
+        return max(0, self.enqueued[level] - self.started[level])
+
+    def summary(self):
+        """Return a one-line summary, suitable for logging."""
+        summary = ' '.join(
+            '%s=%d/%d' % (level, self.started[level], self.queue_depth(level))
+            for level in LEVELS
+        ) + ' (handled/queued)'
+        caches = sorted(set(self.cache_hits) | set(self.cache_misses))
+        rates = [(cache, self.hit_rate(cache)) for cache in caches]
+        if rates:
+            summary += ' cache hit rates: ' + ' '.join(
+                '%s=%.1f%%' % (cache, rate * 100) for (cache, rate) in rates
+            )
+        return summary
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def counter(name, help_text, values, label_names):
+            lines.append('# HELP %s%s %s' % (PREFIX, name, help_text))
+            lines.append('# TYPE %s%s counter' % (PREFIX, name))
+            for labels, value in sorted(values.items()):
+                lines.append('%s%s{%s} %s' % (PREFIX, name, _labels(label_names, labels), value))
+
+        def histogram(name, help_text, histograms, label_names):
+            lines.append('# HELP %s%s %s' % (PREFIX, name, help_text))
+            lines.append('# TYPE %s%s histogram' % (PREFIX, name))
+            for labels, hist in sorted(histograms.items()):
+                label_text = _labels(label_names, labels)
+                for bound, count in hist.cumulative():
+                    lines.append('%s%s_bucket{%s,le="%s"} %d' % (
+                        PREFIX, name, label_text, '+Inf' if bound == float('inf') else bound, count
+                    ))
+                lines.append('%s%s_sum{%s} %s' % (PREFIX, name, label_text, hist.sum))
+                lines.append('%s%s_count{%s} %d' % (PREFIX, name, label_text, hist.count))
+
+        callback_labels = ('callback', 'level')
+        counter('callback_calls_total', 'Calls to each callback.', self.calls, callback_labels)
+        counter('callback_requests_total', 'Requests yielded by each callback.',
+                self.requests, callback_labels)
+        counter('callback_items_total', 'Items yielded by each callback.',
+                self.items, callback_labels)
+        histogram('callback_seconds', 'Time spent in each callback.',
+                  self.callback_seconds, callback_labels)
+        histogram('response_bytes', 'Size of the responses handled by each callback.',
+                  self.response_bytes, callback_labels)
+        histogram('parse_seconds', 'Time spent parsing each kind of table.',
+                  self.parse_seconds, ('function', 'data_type'))
+
+        lines.append('# HELP %squeue_depth Requests yielded but not yet handled.' % PREFIX)
+        lines.append('# TYPE %squeue_depth gauge' % PREFIX)
+        for level in LEVELS:
+            lines.append('%squeue_depth{level="%s"} %d' % (PREFIX, level, self.queue_depth(level)))
+        lookups = collections.Counter()
+        for cache, count in self.cache_hits.items():
+            lookups[cache, 'hit'] = count
+        for cache, count in self.cache_misses.items():
+            lookups[cache, 'miss'] = count
+        counter('cache_lookups_total', 'Lookups in the parsing caches.', lookups,
+                ('cache', 'result'))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(names, values):
+    return ','.join('%s="%s"' % (name, value) for (name, value) in zip(names, values))
+
+
+METRICS = Metrics()
+"""Where all the measurements go."""
+
+
+def _response_size(response):
+    try:
+        return len(response.body)
+    except TypeError:
+        return None
+
+
+def instrument_callback(level):
+    """Decorate a callback for a page at the specified level of the hierarchy."""
+    def decorator(callback):
+        key = (callback.__name__, level)
+
+        @functools.wraps(callback)
+        def wrapper(response, *args, **kwargs):
+            METRICS.calls[key] += 1
+            METRICS.started[level] += 1
+            size = _response_size(response)
+            if size is not None:
+                METRICS.response_bytes[key].observe(size)
+
+            elapsed = 0
+            output = callback(response, *args, **kwargs)
+            while True:
+                start = time.perf_counter()
+                try:
+                    thing = next(output)
+                except StopIteration:
+                    elapsed += time.perf_counter() - start
+                    break
+                elapsed += time.perf_counter() - start
+
+                if isinstance(thing, scrapy.Request):
+                    METRICS.requests[key] += 1
+                    target_level = getattr(thing.callback, 'level', None)
+                    if target_level:
+                        METRICS.enqueued[target_level] += 1
+                else:
+                    METRICS.items[key] += 1
+                yield thing
+            METRICS.callback_seconds[key].observe(elapsed)
+
+        assert inspect.isgeneratorfunction(callback), 'callbacks must be generators'
+        wrapper.level = level
+        return wrapper
+    return decorator
+
+
+def instrument_parser(parser):
+    """Decorate a function that parses a table, given a response and data_type."""
+    default_data_type = inspect.signature(parser).parameters['data_type'].default
+
+    @functools.wraps(parser)
+    def wrapper(response, *args, **kwargs):
+        start = time.perf_counter()
+        result = parser(response, *args, **kwargs)
+        data_type = kwargs.get('data_type', args[0] if args else default_data_type)
+        METRICS.parse_seconds[parser.__name__, data_type].observe(time.perf_counter() - start)
+        return result
+    return wrapper
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Join the results_uik tables to the turnout_uik tables, station by station.
+
+The results for a polling station are a column of a results_uik table, and its
+turnout is a row of a turnout_uik table.  A JoinIndex maps each station, keyed
+by (region, territory, name), to both, and records the stations that only
+appear in one kind of table.  It's built while exporting (see
+pipelines.JoinIndexExporter) or from an existing dataset, and saved as JSON:
+
+    {
+        "urls": [url, ...],
+        "matched": [[region, territory, name, results_url_id, column, turnout_url_id, row], ...],
+        "unmatched_results": [[region, territory, name, results_url_id, column], ...],
+        "unmatched_turnout": [[region, territory, name, turnout_url_id, row], ...],
+        "duplicates": [[region, territory, name], ...]
+    }
+
+where the url_ids are positions in the urls list.
+"""
+import collections
+import io
+import json
+import logging
+
+from .spiders import myspider
+
+LOGGER = logging.getLogger(__name__)
+
+
+class JoinIndex(object):
+    """Where to find the results and turnout of each polling station.
+
+    The matched and unmatched stations are kept sorted, the way they're
+    saved, so that a loaded index serves them as is.  The dicts keyed by
+    station are only needed to add more tables, and get rebuilt if a loaded
+    index is added to.
+    """
+
+    def __init__(self):
+        self.urls = []
+        self._url_ids = {}
+        self.results = {}
+        self.turnout = {}
+        self.duplicates = set()
+        self._sorted = None
+
+    def _url_id(self, url):
+        if url not in self._url_ids:
+            self._url_ids[url] = len(self.urls)
+            self.urls.append(url)
+        return self._url_ids[url]
+
+    def _put(self, locations, key, location):
+        if key in locations:
+            LOGGER.warning('duplicate polling station: %r', key)
+            self.duplicates.add(key)
+        locations[key] = location
+
+    def add(self, table):
+        """Add a table, as emitted by the spider.  Only the *_uik tables matter."""
+        if table['data_type'] not in (myspider.RESULTS_UIK, myspider.TURNOUT_UIK):
+            return
+        self._thaw()
+        if table['data_type'] == myspider.RESULTS_UIK:
+            url_id = self._url_id(table['url'])
+            #
+            # Skip the first column, it's the sum across all stations.
+            #
+            for column, name in enumerate(table['column_headers'][1:], 1):
+                key = (table['region'], table['territory'], name)
+                self._put(self.results, key, (url_id, column))
+        else:
+            url_id = self._url_id(table['url'])
+            #
+            # Skip the first row, it's the total across all stations.
+            #
+            for row, name in enumerate(table['row_headers'][1:], 1):
+                key = (table['region'], table['territory'], name)
+                self._put(self.turnout, key, (url_id, row))
+
+    def _freeze(self):
+        """Sort the stations into the lists that get saved, once per batch of adds."""
+        if self._sorted is None:
+            self._sorted = {
+                'matched': sorted(
+                    key + self.results[key] + self.turnout[key]
+                    for key in self.results if key in self.turnout
+                ),
+                'unmatched_results': sorted(
+                    key + loc for (key, loc) in self.results.items() if key not in self.turnout
+                ),
+                'unmatched_turnout': sorted(
+                    key + loc for (key, loc) in self.turnout.items() if key not in self.results
+                ),
+            }
+        return self._sorted
+
+    def _thaw(self):
+        """Rebuild the dicts from the sorted lists of a loaded index, so that it can be added to."""
+        if self._sorted is not None and not self.results and not self.turnout:
+            self._url_ids = {url: url_id for (url_id, url) in enumerate(self.urls)}
+            for region, territory, name, r_url, column, t_url, row in self._sorted['matched']:
+                self.results[region, territory, name] = (r_url, column)
+                self.turnout[region, territory, name] = (t_url, row)
+            for region, territory, name, url_id, column in self._sorted['unmatched_results']:
+                self.results[region, territory, name] = (url_id, column)
+            for region, territory, name, url_id, row in self._sorted['unmatched_turnout']:
+                self.turnout[region, territory, name] = (url_id, row)
+        self._sorted = None
+
+    def matched(self):
+        return self._freeze()['matched']
+
+    def unmatched_results(self):
+        return self._freeze()['unmatched_results']
+
+    def unmatched_turnout(self):
+        return self._freeze()['unmatched_turnout']
+
+    def to_dict(self):
+        return {
+            'urls': self.urls, 'matched': self.matched(),
+            'unmatched_results': self.unmatched_results(),
+            'unmatched_turnout': self.unmatched_turnout(),
+            'duplicates': sorted(self.duplicates),
+        }
+
+    def write(self, fout):
+        """Write the index as JSON to a binary file object."""
+        fout.write(json.dumps(self.to_dict(), ensure_ascii=False).encode('utf-8'))
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved index.  The stations are served as saved, without rebuilding anything."""
+        with io.open(path, 'rb') as fin:
+            saved = json.loads(fin.read().decode('utf-8'))
+        index = cls()
+        index.urls = saved['urls']
+        index.duplicates = set(tuple(key) for key in saved['duplicates'])
+        index._sorted = {
+            key: saved[key] for key in ('matched', 'unmatched_results', 'unmatched_turnout')
+        }
+        return index
+
+
+def build(tables):
+    """Build a JoinIndex from tables, e.g. those from dataset.iter_tables."""
+    index = JoinIndex()
+    for table in tables:
+        index.add(table)
+    return index
+
+
+def iter_joined(tables, index):
+    """Yield the results and turnout of each matched polling station.
+
+    The records have the same shape as those the notebooks build by hand:
+    region, territory, polling_station, turnout, results (a dict keyed by
+    row header) and url (of the results table).
+
+    Streams through tables once, e.g. dataset.iter_tables, and holds on to a
+    table only until the tables it's joined to have come by.  So the stations
+    come out as their pairs of tables complete, rather than sorted.
+    """
+    url_ids = {url: url_id for (url_id, url) in enumerate(index.urls)}
+    stations = collections.defaultdict(list)
+    partners = collections.defaultdict(set)
+    for region, territory, name, r_url, column, t_url, row in index.matched():
+        stations[r_url, t_url].append((region, territory, name, column, row))
+        partners[r_url].add(t_url)
+        partners[t_url].add(r_url)
+
+    pending = {}
+    for table in tables:
+        if table['data_type'] not in (myspider.RESULTS_UIK, myspider.TURNOUT_UIK):
+            continue
+        url_id = url_ids.get(table['url'])
+        if not partners.get(url_id) or url_id in pending:
+            continue
+        pending[url_id] = (table['data_type'], table['url'], table['row_headers'], table['data'])
+
+        for partner in [partner for partner in partners[url_id] if partner in pending]:
+            if table['data_type'] == myspider.RESULTS_UIK:
+                r_url, t_url = url_id, partner
+            else:
+                r_url, t_url = partner, url_id
+            _, url, row_headers, results = pending[r_url]
+            turnout = pending[t_url][3]
+            for region, territory, name, column, row in stations.pop((r_url, t_url)):
+                yield {
+                    'region': region, 'territory': territory, 'polling_station': name,
+                    'turnout': turnout[row],
+                    'results': {
+                        header: values[column] for (header, values) in zip(row_headers, results)
+                    },
+                    'url': url,
+                }
+            partners[r_url].discard(t_url)
+            partners[t_url].discard(r_url)
+            for done in (r_url, t_url):
+                if not partners[done]:
+                    del pending[done]
+
+
+def main():
+    import argparse
+
+    from . import dataset
+
+    parser = argparse.ArgumentParser(description='Build the join index for an existing dataset')
+    parser.add_argument('source', help='e.g. results.json.gz')
+    parser.add_argument('destination', help='e.g. results.join.json')
+    args = parser.parse_args()
+
+    index = build(dataset.iter_tables(args.source))
+    with io.open(args.destination, 'wb') as fout:
+        index.write(fout)
+    print('matched: %d unmatched results: %d unmatched turnout: %d' % (
+        len(index.matched()), len(index.unmatched_results()), len(index.unmatched_turnout())
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,760 @@
+# -*- coding: utf-8 -*-
+
+# Define your downloader and spider middlewares here
+#
+# Don't forget to add your middleware to the DOWNLOADER_MIDDLEWARES
+# or SPIDER_MIDDLEWARES setting
+# See: http://doc.scrapy.org/en/latest/topics/downloader-middleware.html
+# See: http://doc.scrapy.org/en/latest/topics/spider-middleware.html
+import codecs
+import collections
+import datetime
+import email.utils
+import io
+import json
+import logging
+import os.path as P
+import time
+import urllib.parse
+
+import scrapy.exceptions
+import scrapy.http
+import scrapy.signals
+from twisted.internet import task
+
+from . import checkpoint
+from . import dataset
+from . import instrumentation
+from . import pagestore
+from . import sharding
+from .spiders import myspider
+
+LOGGER = logging.getLogger(__name__)
+
+LEAF_DATA_TYPES = (myspider.RESULTS_UIK, myspider.TURNOUT_UIK)
+"""Tables on pages that don't link anywhere else.
+
+We can ask the server whether these changed without downloading them,
+because we don't need anything else from those pages.
+"""
+
+REGION_RANK = 'region_rank'
+"""The request meta key holding the position of the region the page belongs to."""
+
+_COUNTED = 'region_counted'
+"""The request meta key marking requests that RegionSchedulingMiddleware has seen the end of."""
+
+SHARD_REGION = 'shard_region'
+"""The request meta key marking requests for regions claimed from the shard queue."""
+
+CLAIM_RENEWALS = 4
+"""Renew the claims on shard regions this many times per SHARD_CLAIM_TIMEOUT."""
+
+POLL = 'poll'
+"""The request meta key marking requests made by PollingMiddleware."""
+
+POLL_ROOT = 'poll_root'
+"""The request meta key holding the URL of the region page a page was found through."""
+
+
+class FastHtmlResponse(scrapy.http.HtmlResponse):
+    """An HtmlResponse whose selector is parsed straight from the body's bytes.
+
+    See myspider.make_selector.  The text of the response is only decoded if
+    something other than the selector asks for it.
+    """
+
+    @property
+    def selector(self):
+        if self._cached_selector is None:
+            self._cached_selector = myspider.make_selector(self.body, self.encoding)
+        return self._cached_selector
+
+
+class FastDecodeMiddleware(object):
+    """Turn responses in the encoding of the izbirkom pages into FastHtmlResponses."""
+
+    def process_response(self, request, response, spider=None):
+        if isinstance(response, scrapy.http.HtmlResponse) and \
+                not isinstance(response, FastHtmlResponse) and \
+                codecs.lookup(response.encoding).name == myspider.SOURCE_ENCODING:
+            return response.replace(cls=FastHtmlResponse)
+        return response
+
+
+class PageStoreMiddleware(object):
+    """Record downloaded pages to a PageStore, or replay them from it.
+
+    Enabled by setting PAGESTORE_DIR.  If PAGESTORE_REPLAY is also set,
+    no requests hit the network: pages are served from the store, and
+    requests for pages that aren't in the store are dropped.
+    """
+
+    def __init__(self, store, replay=False):
+        self.store = store
+        self.replay = replay
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('PAGESTORE_DIR')
+        if not path:
+            raise scrapy.exceptions.NotConfigured
+        middleware = cls(pagestore.PageStore(path),
+                         replay=crawler.settings.getbool('PAGESTORE_REPLAY'))
+        crawler.signals.connect(middleware.spider_closed, signal=scrapy.signals.spider_closed)
+        return middleware
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+    def process_request(self, request, spider=None):
+        if not self.replay:
+            return None
+        stored = self.store.get(request.url)
+        if stored is None:
+            raise scrapy.exceptions.IgnoreRequest('not in page store: %r' % request.url)
+        body, encoding = stored
+        return scrapy.http.HtmlResponse(request.url, body=body, encoding=encoding,
+                                        request=request)
+
+    def process_response(self, request, response, spider=None):
+        if not self.replay and response.status == 200:
+            self.store.put(request.url, response.body, response.encoding)
+        return response
+
+
+class IncrementalMiddleware(object):
+    """Skip tables that haven't changed since a previous crawl.
+
+    Enabled by setting INCREMENTAL_PREVIOUS to the output of the previous crawl
+    (results.json or results.json.gz).  Pages whose MD5 matches the previous crawl
+    are marked as unchanged, so the spider follows their links but doesn't parse
+    or emit their tables.  Leaf pages are requested with If-Modified-Since, so a
+    server that supports it doesn't need to send them at all.
+
+    When the spider closes, writes a manifest of new, changed, unchanged and
+    missing table URLs to INCREMENTAL_MANIFEST.
+    """
+
+    def __init__(self, previous, manifest_path=None):
+        self.previous = previous
+        self.manifest_path = manifest_path
+        self.new = []
+        self.changed = []
+        self.unchanged = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('INCREMENTAL_PREVIOUS')
+        if not path:
+            raise scrapy.exceptions.NotConfigured
+        middleware = cls(load_previous(path), crawler.settings.get('INCREMENTAL_MANIFEST'))
+        crawler.signals.connect(middleware.item_scraped, signal=scrapy.signals.item_scraped)
+        crawler.signals.connect(middleware.spider_closed, signal=scrapy.signals.spider_closed)
+        return middleware
+
+    def process_request(self, request, spider=None):
+        previous = self.previous.get(request.url)
+        if previous and previous['data_type'] in LEAF_DATA_TYPES:
+            request.headers.setdefault('If-Modified-Since', http_date(previous['timestamp']))
+            request.meta.setdefault('handle_httpstatus_list', []).append(304)
+        return None
+
+    def process_response(self, request, response, spider=None):
+        previous = self.previous.get(request.url)
+        if previous is None:
+            return response
+        if response.status == 304 or pagestore.md5(response.body) == previous['md5']:
+            request.meta[myspider.UNCHANGED] = True
+            self.unchanged.append(request.url)
+        return response
+
+    def item_scraped(self, item, response, spider):
+        if item['url'] in self.previous:
+            self.changed.append(item['url'])
+        else:
+            self.new.append(item['url'])
+
+    def spider_closed(self, spider):
+        seen = set(self.new) | set(self.changed) | set(self.unchanged)
+        manifest = {
+            'new': self.new, 'changed': self.changed, 'unchanged': self.unchanged,
+            'missing': sorted(url for url in self.previous if url not in seen),
+        }
+        LOGGER.info('incremental crawl: %s',
+                    ', '.join('%d %s' % (len(urls), key) for (key, urls) in manifest.items()))
+        if self.manifest_path:
+            with io.open(self.manifest_path, 'wt', encoding='utf-8') as fout:
+                json.dump(manifest, fout, indent=2)
+
+
+class RegionSchedulingMiddleware(object):
+    """Crawl the regions one after another, each one depth-first.
+
+    Left alone, the scheduler fetches all the region pages first, then all
+    their intermediate pages, and gets to the UIK tables last, with thousands
+    of requests waiting in between.  Instead, we number the regions in the
+    order the central page lists them, and give each request a priority
+    from its region's number and its depth in the hierarchy:  earlier regions
+    come first, and within a region, deeper pages come first.
+
+    If SCHEDULER_ACTIVE_REGIONS is set, only that many regions are crawled at
+    a time.  The requests for the other regions are held back here, and
+    released one by one as the regions in progress run out of requests.
+    This keeps the scheduler's queue, and the memory it takes, small.
+    """
+
+    def __init__(self, active_regions=0):
+        self.active_regions = active_regions
+        self.next_rank = 0
+        self.held = collections.deque()
+        self.outstanding = collections.Counter()
+        self.crawler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler.settings.getint('SCHEDULER_ACTIVE_REGIONS'))
+        middleware.crawler = crawler
+        crawler.signals.connect(middleware.spider_idle, signal=scrapy.signals.spider_idle)
+        crawler.signals.connect(middleware.request_dropped, signal=scrapy.signals.request_dropped)
+        crawler.signals.connect(middleware.spider_error, signal=scrapy.signals.spider_error)
+        return middleware
+
+    def process_spider_exception(self, response, exception, spider=None):
+        #
+        # e.g. HttpErrorMiddleware dropping an error page, or the callback
+        # failing.  Let the others handle the exception.
+        #
+        self._finish(response, spider)
+        return None
+
+    def request_dropped(self, request, spider):
+        """Count requests dropped by the scheduler (e.g. the duplicate filter) as handled."""
+        self._finish(request, spider)
+
+    def spider_error(self, failure, response, spider):
+        self._finish(response, spider)
+
+    def _handled(self, thing):
+        """Count a request, or its response, as handled, once.
+
+        A region that's been released already is no longer in outstanding,
+        and stays that way.
+        """
+        rank = _region_rank(thing)
+        if rank is not None and not thing.meta.get(_COUNTED):
+            thing.meta[_COUNTED] = True
+            if rank in self.outstanding:
+                self.outstanding[rank] -= 1
+
+    def _finish(self, thing, spider):
+        """Count a request that won't make it to process_spider_output as handled.
+
+        If it was the last one of its region, start on the next region.
+        """
+        self._handled(thing)
+        for request in self.region_handled(thing):
+            _crawl(self.crawler.engine, request, spider)
+
+    #
+    # A response only counts as handled once the requests it yielded are
+    # counted, or its region could look finished while the other responses
+    # of the region are still being handled.
+    #
+    def process_spider_output(self, response, result, spider=None):
+        for thing in result:
+            if self.schedule(response, thing):
+                yield thing
+        self._handled(response)
+        for request in self.region_handled(response):
+            yield request
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        async for thing in result:
+            if self.schedule(response, thing):
+                yield thing
+        self._handled(response)
+        for request in self.region_handled(response):
+            yield request
+
+    def schedule(self, response, thing):
+        """Prioritize a request yielded by a callback.
+
+        Returns False if the request is being held back.
+        """
+        if not isinstance(thing, scrapy.Request):
+            return True
+        rank = _region_rank(response)
+        new_region = rank is None
+        if new_region:
+            #
+            # A request from the central page: the start of a new region.
+            #
+            rank = self.next_rank
+            self.next_rank += 1
+        thing.meta[REGION_RANK] = rank
+        thing.priority = priority(rank, getattr(thing.callback, 'level', None))
+        if new_region and self.active_regions and rank >= self.active_regions:
+            self.held.append(thing)
+            return False
+        self.outstanding[rank] += 1
+        return True
+
+    def region_handled(self, response):
+        """Release the next region if this response was the last one of its region."""
+        rank = _region_rank(response)
+        if rank is None or rank not in self.outstanding or self.outstanding[rank] > 0:
+            return []
+        del self.outstanding[rank]
+        LOGGER.info('finished region #%d', rank)
+        return self.release(1)
+
+    def release(self, count):
+        """Return up to count of the requests being held back."""
+        released = []
+        while self.held and len(released) < count:
+            request = self.held.popleft()
+            self.outstanding[request.meta[REGION_RANK]] += 1
+            released.append(request)
+        return released
+
+    def spider_idle(self, spider):
+        #
+        # Requests that were dropped (e.g. by errors or the duplicate filter)
+        # never make it back here, so a region may never look finished.
+        # When nothing is left to do, start on the next regions anyway.
+        #
+        self.outstanding.clear()
+        released = self.release(self.active_regions or len(self.held))
+        if not released:
+            return
+        for request in released:
+            _crawl(self.crawler.engine, request, spider)
+        raise scrapy.exceptions.DontCloseSpider
+
+
+class CheckpointMiddleware(object):
+    """Record the progress of the crawl, and resume it from where it died.
+
+    Enabled by setting CHECKPOINT_FILE.  Every page the spider handles is
+    recorded there, along with the pages it requested and the number of
+    tables it emitted (see the checkpoint module).
+
+    If CHECKPOINT_RESUME is also set, reads the checkpoint and the existing
+    output (the JSON-lines FEEDS) first, and drops requests for pages whose
+    subtrees are already complete, so only the missing regions, TIKs and UIKs
+    get crawled again.  The output is cut back to its last complete batch,
+    so the new tables can be appended to it: use -o, not -O.  Tables that are
+    already in the output (e.g. from the region pages, which get crawled again
+    to find the missing TIKs) aren't emitted twice.
+    """
+
+    def __init__(self, checkpoint, completed=(), written=()):
+        self.checkpoint = checkpoint
+        self.completed = set(completed)
+        self.written = set(written)
+        self.skipped = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('CHECKPOINT_FILE')
+        if not path:
+            raise scrapy.exceptions.NotConfigured
+        saved = checkpoint.Checkpoint(path)
+        completed = written = ()
+        if crawler.settings.getbool('CHECKPOINT_RESUME'):
+            written = set()
+            for output_path in feed_paths(crawler.settings):
+                dataset.repair(output_path)
+                written.update(table['url'] for table in dataset.iter_tables(output_path))
+            written.update(saved.dropped)
+            completed = saved.completed(written)
+            LOGGER.info('resuming: %d of %d pages handled so far have complete subtrees',
+                        len(completed), len(saved))
+        middleware = cls(saved, completed, written)
+        crawler.signals.connect(middleware.spider_closed, signal=scrapy.signals.spider_closed)
+        crawler.signals.connect(middleware.item_dropped, signal=scrapy.signals.item_dropped)
+        return middleware
+
+    def item_dropped(self, item, response, exception, spider):
+        #
+        # Otherwise the page would look incomplete, and get crawled again on every resume.
+        #
+        url = item.get('url')
+        if url:
+            self.checkpoint.record_dropped(url)
+
+    def spider_closed(self, spider):
+        if self.completed:
+            LOGGER.info('resumed: skipped %d complete subtrees', self.skipped)
+        self.checkpoint.close()
+
+    def process_spider_output(self, response, result, spider=None):
+        children = []
+        items = 0
+        for thing in result:
+            if not isinstance(thing, scrapy.Request):
+                items += 1
+                if thing.get('url') in self.written:
+                    continue
+            elif not self.keep(thing, children):
+                continue
+            yield thing
+        self.checkpoint.record(_request_url(response), children, items, response.url)
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        children = []
+        items = 0
+        async for thing in result:
+            if not isinstance(thing, scrapy.Request):
+                items += 1
+                if thing.get('url') in self.written:
+                    continue
+            elif not self.keep(thing, children):
+                continue
+            yield thing
+        self.checkpoint.record(_request_url(response), children, items, response.url)
+
+    def keep(self, request, children):
+        """Should the request be crawled?  If so, add it to the children."""
+        if request.url in self.completed:
+            LOGGER.debug('skipping complete subtree: %r', request.url)
+            self.skipped += 1
+            return False
+        children.append(request.url)
+        return True
+
+
+class ShardMiddleware(object):
+    """Crawl only the regions claimed from a queue shared with other workers.
+
+    Enabled by setting SHARD_QUEUE to the path of the queue (see the sharding
+    module).  The requests for the regions on the central page go into the
+    queue instead of being crawled.  The worker then claims one region at a
+    time, and claims the next one when the spider runs out of requests.
+    SHARD_WORKER names the worker in the queue (by default, host:pid), and
+    SHARD_CLAIM_TIMEOUT is how long a claim lasts without being renewed.
+    The claims on the regions the worker has crawled and is crawling get
+    renewed CLAIM_RENEWALS times per SHARD_CLAIM_TIMEOUT, on the reactor
+    unless a clock (e.g. a twisted.internet.task.Clock) is passed.
+    """
+
+    def __init__(self, queue, worker, claim_timeout=None, clock=None):
+        self.queue = queue
+        self.worker = worker
+        self.claim_timeout = claim_timeout
+        self.clock = clock
+        self.region_callback = None
+        self.current = None
+        self.crawled = []
+        self.crawler = None
+        self.renewal = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('SHARD_QUEUE')
+        if not path:
+            raise scrapy.exceptions.NotConfigured
+        middleware = cls(
+            sharding.RegionQueue(path),
+            crawler.settings.get('SHARD_WORKER') or sharding.default_worker(),
+            crawler.settings.getfloat('SHARD_CLAIM_TIMEOUT'),
+        )
+        middleware.crawler = crawler
+        crawler.signals.connect(middleware.spider_opened, signal=scrapy.signals.spider_opened)
+        crawler.signals.connect(middleware.spider_idle, signal=scrapy.signals.spider_idle)
+        crawler.signals.connect(middleware.spider_closed, signal=scrapy.signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        if self.claim_timeout:
+            self.renewal = task.LoopingCall(self.renew)
+            if self.clock is not None:
+                self.renewal.clock = self.clock
+            self.renewal.start(self.claim_timeout / CLAIM_RENEWALS, now=False)
+
+    def renew(self):
+        """Renew the claims on the regions crawled so far and the one being crawled."""
+        current = [self.current] if self.current else []
+        self.queue.touch(self.crawled + current, self.worker, now=self.renewal.clock.seconds())
+
+    def process_spider_output(self, response, result, spider=None):
+        regions = []
+        for thing in result:
+            if is_region_request(response, thing):
+                regions.append(thing)
+            else:
+                yield thing
+        if regions:
+            request = self.enqueue(regions)
+            if request:
+                yield request
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        regions = []
+        async for thing in result:
+            if is_region_request(response, thing):
+                regions.append(thing)
+            else:
+                yield thing
+        if regions:
+            request = self.enqueue(regions)
+            if request:
+                yield request
+
+    def enqueue(self, regions):
+        """Add the regions to the queue, and return the request for the first one we claim."""
+        self.region_callback = regions[0].callback
+        added = self.queue.fill([request.url for request in regions])
+        LOGGER.info('added %d of %d regions to the shard queue', added, len(regions))
+        return self.next_region()
+
+    def next_region(self):
+        """Claim the next region.  Returns the request for it, or None if there are none left."""
+        if self.current:
+            self.crawled.append(self.current)
+        self.queue.touch(self.crawled, self.worker)
+        claimed = self.queue.claim(self.worker, timeout=self.claim_timeout)
+        if claimed is None:
+            self.current = None
+            return None
+        self.current, position = claimed
+        LOGGER.info('claimed region #%d: %r (%s)', position, self.current,
+                    ' '.join('%s=%d' % item for item in sorted(self.queue.counts().items())))
+        return scrapy.Request(self.current, callback=self.region_callback,
+                              meta={REGION_RANK: position, SHARD_REGION: True})
+
+    def spider_idle(self, spider):
+        if self.region_callback is None:
+            return
+        request = self.next_region()
+        if request is None:
+            return
+        _crawl(self.crawler.engine, request, spider)
+        raise scrapy.exceptions.DontCloseSpider
+
+    def spider_closed(self, spider, reason='finished'):
+        if self.renewal is not None and self.renewal.running:
+            self.renewal.stop()
+        current = [self.current] if self.current else []
+        if reason == 'finished':
+            self.queue.done(self.crawled + current)
+        else:
+            #
+            # We didn't get to the end of the current region, so let someone else crawl it.
+            # The exporters still get to write out the regions we did finish.
+            #
+            self.queue.done(self.crawled)
+            self.queue.release(current)
+        LOGGER.info('crawled %d regions (%s)', len(self.crawled), reason)
+        self.queue.close()
+
+
+class PollingMiddleware(object):
+    """Keep polling the tables for changes once the crawl is done.
+
+    Enabled by setting POLL_INTERVAL to the number of seconds between rounds
+    of polling.  During the crawl, we remember every page that had a table on
+    it, and the region page (results_tik or turnout_tik) it was found through.
+    Each round re-requests the region pages.  The table of a region page sums
+    up all the tables below it, so if the region page hasn't changed (by MD5),
+    neither have they, and we leave them be.  If it has, we re-request the
+    pages below it, too.  Only the tables that changed get emitted, each with
+    the timestamp of when it was parsed, so the output becomes a time series.
+
+    Stops after POLL_ROUNDS rounds, or never if that's 0.
+    """
+
+    def __init__(self, interval, rounds=0):
+        self.interval = interval
+        self.rounds = rounds
+        self.round = 0
+        self.changed = 0
+        self.next_round = None
+        self.pages = {}
+        self.below = collections.defaultdict(list)
+        self.crawler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        interval = crawler.settings.getfloat('POLL_INTERVAL')
+        if not interval:
+            raise scrapy.exceptions.NotConfigured
+        middleware = cls(interval, crawler.settings.getint('POLL_ROUNDS'))
+        middleware.crawler = crawler
+        crawler.signals.connect(middleware.spider_idle, signal=scrapy.signals.spider_idle)
+        return middleware
+
+    def process_spider_input(self, response, spider=None):
+        page = self.pages.get(response.url)
+        if page and response.meta.get(POLL):
+            digest = pagestore.md5(response.body)
+            if digest == page['md5']:
+                response.meta[myspider.UNCHANGED] = True
+            else:
+                page['md5'] = digest
+                self.changed += 1
+        return None
+
+    def process_spider_output(self, response, result, spider=None):
+        items = 0
+        for thing in result:
+            if isinstance(thing, scrapy.Request):
+                if not self.follow(response, thing):
+                    continue
+            else:
+                items += 1
+            yield thing
+        for request in self.handled(response, items):
+            yield request
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        items = 0
+        async for thing in result:
+            if isinstance(thing, scrapy.Request):
+                if not self.follow(response, thing):
+                    continue
+            else:
+                items += 1
+            yield thing
+        for request in self.handled(response, items):
+            yield request
+
+    def follow(self, response, request):
+        """Should a request yielded by a callback be crawled?"""
+        if response.meta.get(POLL):
+            #
+            # We already know about everything below a polled page.
+            #
+            return False
+        if response_level(response) == instrumentation.REGION:
+            request.meta[POLL_ROOT] = response.url
+        elif POLL_ROOT in response.meta:
+            request.meta[POLL_ROOT] = response.meta[POLL_ROOT]
+        return True
+
+    def handled(self, response, items):
+        """Remember a page with a table.
+
+        If it's a region page that changed since the last round, returns
+        requests for the pages below it.
+        """
+        if response.meta.get(POLL):
+            if response.url in self.below and not myspider.is_unchanged(response):
+                return [self.make_request(url) for url in self.below[response.url]]
+            return []
+
+        if items or myspider.is_unchanged(response):
+            self.pages[response.url] = {
+                'callback': response.request.callback, 'md5': pagestore.md5(response.body),
+                'rank': response.meta.get(REGION_RANK),
+            }
+            if response_level(response) == instrumentation.REGION:
+                self.below.setdefault(response.url, [])
+            elif POLL_ROOT in response.meta:
+                self.below[response.meta[POLL_ROOT]].append(response.url)
+        return []
+
+    def make_request(self, url):
+        page = self.pages[url]
+        meta = {POLL: True}
+        if page['rank'] is not None:
+            meta[REGION_RANK] = page['rank']
+        return scrapy.Request(url, callback=page['callback'], meta=meta, dont_filter=True)
+
+    def spider_idle(self, spider, now=None):
+        if self.rounds and self.round >= self.rounds:
+            LOGGER.info('polling round %d: %d pages changed', self.round, self.changed)
+            return
+        if now is None:
+            now = time.time()
+        if self.next_round is None:
+            self.next_round = now + self.interval
+        if now >= self.next_round:
+            if self.round:
+                LOGGER.info('polling round %d: %d pages changed', self.round, self.changed)
+            self.round += 1
+            self.changed = 0
+            self.next_round = now + self.interval
+            for url in self.below:
+                _crawl(self.crawler.engine, self.make_request(url), spider)
+        raise scrapy.exceptions.DontCloseSpider
+
+
+def is_region_request(response, thing):
+    """Is this a request for a region page, from the central page?"""
+    if not isinstance(thing, scrapy.Request) or \
+            getattr(thing.callback, 'level', None) != instrumentation.REGION:
+        return False
+    return response_level(response) in (None, instrumentation.CENTRAL)
+
+
+def response_level(response):
+    """Return the level of the hierarchy the response's page is at, if known."""
+    request = getattr(response, 'request', None)
+    return getattr(getattr(request, 'callback', None), 'level', None)
+
+
+def feed_paths(settings):
+    """Return the paths of the local JSON-lines files in the FEEDS setting."""
+    paths = []
+    for uri, options in settings.getdict('FEEDS').items():
+        parsed = urllib.parse.urlparse(str(uri))
+        if parsed.scheme in ('', 'file') and options.get('format') in ('lines', 'jsonlines'):
+            paths.append(parsed.path if parsed.scheme else str(uri))
+    return [path for path in paths if P.isfile(path)]
+
+
+def _request_url(response):
+    """Return the URL the page was requested under, i.e. before any redirects.
+
+    RedirectMiddleware makes a new request for each redirect, so that's not
+    response.request.url, but the first of the redirect_urls.
+    """
+    try:
+        redirect_urls = response.meta.get('redirect_urls')
+    except AttributeError:
+        redirect_urls = None
+    if isinstance(redirect_urls, list) and redirect_urls:
+        return redirect_urls[0]
+    return response.url
+
+
+def _region_rank(response):
+    try:
+        return response.meta.get(REGION_RANK)
+    except AttributeError:
+        return None
+
+
+def _crawl(engine, request, spider):
+    try:
+        engine.crawl(request)
+    except TypeError:
+        #
+        # Older Scrapy versions want the spider, too.
+        #
+        engine.crawl(request, spider)
+
+
+def priority(rank, level):
+    """Return the priority of a request for a page of the specified region and level.
+
+    Requests with higher priorities are handled first.
+    """
+    depth = instrumentation.LEVELS.index(level) if level else 0
+    return depth - rank * len(instrumentation.LEVELS)
+
+
+def load_previous(path):
+    """Load the digests of the tables in a previous crawl, keyed by URL."""
+    return {
+        table['url']: {key: table[key] for key in ('md5', 'timestamp', 'data_type')}
+        for table in dataset.iter_tables(path)
+    }
+
+
+def http_date(timestamp):
+    """Convert an ISO timestamp, as emitted by the spider, to an HTTP date."""
+    parsed = datetime.datetime.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S')
+    return email.utils.format_datetime(parsed.replace(tzinfo=datetime.timezone.utc), usegmt=True)
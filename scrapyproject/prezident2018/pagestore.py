@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""A content-addressed on-disk store of downloaded pages.
+
+The layout of the store directory is:
+
+    index.jsonl         one JSON object per stored page: url, md5, encoding, timestamp
+    pages/ab/abcd...    the page bodies, named after the MD5 of their contents
+
+The MD5 is the same one the spider records in the md5 field of each item.
+Bodies are only written once, so identical pages fetched from different URLs
+or during different crawls share storage.  The index is append-only: when a
+URL is stored more than once, the most recent entry wins.  If the crawl died
+while writing the index, the incomplete last line is ignored.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import os.path as P
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'index.jsonl'
+"""The name of the index file within the store directory."""
+
+
+def md5(body):
+    """Return the hex digest of a page body."""
+    return hashlib.md5(body).hexdigest()
+
+
+class PageStore(object):
+    """Store and retrieve page bodies by URL."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        if not P.isdir(path):
+            os.makedirs(path)
+
+        index_path = P.join(path, INDEX_FILENAME)
+        line = b''
+        if P.isfile(index_path):
+            with open(index_path, 'rb') as fin:
+                for line in fin:
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        #
+                        # The crawl died while writing this line.
+                        #
+                        LOGGER.warning('%r: ignoring incomplete line', index_path)
+                        continue
+                    self.index[entry['url']] = entry
+        LOGGER.debug('loaded %d entries from %r', len(self.index), index_path)
+
+        self._index_file = open(index_path, 'ab')
+        if self._index_file.tell() and not line.endswith(b'\n'):
+            #
+            # Don't let the next entry continue the incomplete line.
+            #
+            self._index_file.write(b'\n')
+
+    def close(self):
+        self._index_file.close()
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def _body_path(self, digest):
+        return P.join(self.path, 'pages', digest[:2], digest)
+
+    def put(self, url, body, encoding):
+        """Store the body of the page fetched from url.  Returns its MD5."""
+        digest = md5(body)
+        body_path = self._body_path(digest)
+        if not P.isfile(body_path):
+            if not P.isdir(P.dirname(body_path)):
+                os.makedirs(P.dirname(body_path))
+            #
+            # Write to a temporary file first so that a crash never leaves
+            # a truncated body behind under a valid digest.
+            #
+            temp_path = body_path + '.tmp'
+            with open(temp_path, 'wb') as fout:
+                fout.write(body)
+            os.rename(temp_path, body_path)
+
+        entry = {
+            'url': url, 'md5': digest, 'encoding': encoding,
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+        }
+        self.index[url] = entry
+        self._index_file.write((json.dumps(entry) + '\n').encode('utf-8'))
+        self._index_file.flush()
+        return digest
+
+    def get(self, url):
+        """Return the (body, encoding) stored for url, or None."""
+        try:
+            entry = self.index[url]
+        except KeyError:
+            return None
+        with open(self._body_path(entry['md5']), 'rb') as fin:
+            return fin.read(), entry['encoding']
@@ -4,15 +4,360 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
+import concurrent.futures
+import io
 import json
+import logging
+import os
 
+import scrapy.exceptions
 import scrapy.exporters
 import scrapy.utils.serialize
+import twisted.internet.defer
+import twisted.internet.threads
+
+from . import columnar
+from . import dataset
+from . import joinindex
+from . import records
+from . import snapshots
+from . import validation
+from .spiders import myspider
+
+LOGGER = logging.getLogger(__name__)
 
 
 class LineExporter(scrapy.exporters.JsonLinesItemExporter):
+    """Export one JSON object per line, optionally compressed.
+
+    The compression is picked from the name of the output file: .gz for gzip
+    and .zst for zstd.  Compressed items are written in batches, once
+    flush_items have accumulated or every flush_seconds, whichever comes
+    first.  Each batch is compressed as a separate gzip member or zstd frame,
+    and synced to disk, so if the crawl dies, everything up to the last batch
+    is still readable.  Uncompressed items are written as they come, and
+    synced to disk at the same points.
+
+    If the output is a regular file, the offset, length and number of items
+    of each batch are also appended to an index (the name of the output file
+    with .idx appended), which ends with a footer once the crawl completes.
+    A crawl that appends to an existing output file carries on its index, so
+    there's only ever one footer, after the last batch.
+
+    The timer starts with start_exporting, on the reactor unless a clock
+    (e.g. a twisted.internet.task.Clock) is passed.
+    """
+
+    def __init__(self, file, flush_items=1000, flush_seconds=60, compression=None, clock=None,
+                 **kwargs):
+        super(LineExporter, self).__init__(file, **kwargs)
+        name = getattr(file, 'name', None)
+        if not isinstance(name, str):
+            name = None
+        if compression is None and name:
+            compression = dataset.compression_for(name)
+        self.compress = dataset.compressor(compression) if compression else None
+        self.flush_items = flush_items
+        self.flush_seconds = flush_seconds
+        self.clock = clock
+        self.index_file = None
+        self._batch = []
+        self._pending_items = 0
+        self._pending_bytes = 0
+        self._num_items = 0
+        self._timer = None
+        if name:
+            self.index_file = self._open_index(name + '.idx', append=bool(_tell(file)))
+
+    def _open_index(self, path, append):
+        """Start a new index, or carry on the index of the output file we're appending to."""
+        if not append:
+            return io.open(path, 'wb')
+        #
+        # Leave out the footer of the crawl that wrote the output, and anything
+        # it didn't finish writing.
+        #
+        batches = [entry for entry in dataset.read_index(path) if 'offset' in entry]
+        self._num_items = sum(entry['items'] for entry in batches)
+        temp_path = path + '.tmp'
+        with io.open(temp_path, 'wb') as fout:
+            for entry in batches:
+                fout.write((json.dumps(entry) + '\n').encode('utf-8'))
+            _sync(fout)
+        os.replace(temp_path, path)
+        return io.open(path, 'ab')
+
+    def start_exporting(self):
+        super(LineExporter, self).start_exporting()
+        if self.flush_seconds:
+            if self.clock is None:
+                from twisted.internet import reactor
+                self.clock = reactor
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        self._timer = self.clock.callLater(self.flush_seconds, self._flush_on_timer)
+
+    def _flush_on_timer(self):
+        self.flush()
+        self._schedule_flush()
 
     def export_item(self, item):
-        itemdict = dict(self._get_serialized_fields(item))
-        data = json.dumps(itemdict, ensure_ascii=False) + '\n'
-        self.file.write(data.encode("utf-8"))
+        if isinstance(item, records.Table) and not self.fields_to_export:
+            itemdict = item.to_dict()
+        else:
+            #
+            # Newer versions of Scrapy dropped the leading underscore.
+            #
+            get_fields = getattr(self, 'get_serialized_fields', None) or self._get_serialized_fields
+            itemdict = dict(get_fields(item))
+        data = (json.dumps(itemdict, ensure_ascii=False) + '\n').encode("utf-8")
+        if self.compress is None:
+            #
+            # Nothing to gain from holding on to uncompressed lines.
+            #
+            self.file.write(data)
+        else:
+            self._batch.append(data)
+        self._pending_items += 1
+        self._pending_bytes += len(data)
+
+        if self._pending_items >= self.flush_items:
+            self.flush()
+
+    def flush(self):
+        """Write out the current batch, compressing it if need be, and sync it to disk."""
+        if not self._pending_items:
+            return
+        if self.compress is None:
+            offset = _tell(self.file)
+            length = self._pending_bytes
+            if offset is not None:
+                offset -= length
+        else:
+            data = self.compress(b''.join(self._batch))
+            offset = _tell(self.file)
+            length = len(data)
+            self.file.write(data)
+        _sync(self.file)
+        self._num_items += self._pending_items
+        self._write_index({'offset': offset, 'length': length, 'items': self._pending_items})
+        self._batch = []
+        self._pending_items = 0
+        self._pending_bytes = 0
+
+    def _write_index(self, entry):
+        if self.index_file:
+            self.index_file.write((json.dumps(entry) + '\n').encode('utf-8'))
+            _sync(self.index_file)
+
+    def finish_exporting(self):
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self.flush()
+        self._write_index({'complete': True, 'items': self._num_items})
+        if self.index_file:
+            self.index_file.close()
+
+
+def _tell(fileobj):
+    """Return the current position in the file, or None if it doesn't have one."""
+    try:
+        return fileobj.tell()
+    except (AttributeError, IOError, ValueError):
+        return None
+
+
+def _sync(fileobj):
+    """Flush the file all the way to disk, if it is a real file."""
+    fileobj.flush()
+    try:
+        os.fsync(fileobj.fileno())
+    except (AttributeError, IOError, ValueError):
+        pass
+
+
+class ColumnarExporter(scrapy.exporters.BaseItemExporter):
+    """Export the tables in the compact columnar format.  See the columnar module.
+
+    The tables are held in memory (in compact form) until the crawl finishes.
+    """
+
+    def __init__(self, file, **kwargs):
+        super(ColumnarExporter, self).__init__(**kwargs)
+        self.file = file
+        self.writer = columnar.ColumnarWriter()
+
+    def export_item(self, item):
+        self.writer.add(item)
+
+    def finish_exporting(self):
+        self.writer.write(self.file)
+
+
+class JoinIndexExporter(scrapy.exporters.BaseItemExporter):
+    """Export the index joining results_uik and turnout_uik tables.  See the joinindex module."""
+
+    def __init__(self, file, **kwargs):
+        super(JoinIndexExporter, self).__init__(**kwargs)
+        self.file = file
+        self.index = joinindex.JoinIndex()
+
+    def export_item(self, item):
+        self.index.add(item)
+
+    def finish_exporting(self):
+        self.index.write(self.file)
+
+
+class ParsePoolPipeline(object):
+    """Parse the pages deferred by the spider in a pool of worker processes.
+
+    Enabled by setting PARSE_POOL_SIZE to the number of workers.  At most
+    PARSE_POOL_MAX_PENDING pages are handed to the pool at any one time.
+    The rest wait in the pipeline, which eventually makes Scrapy stop
+    scheduling new downloads until the workers catch up.
+    """
+
+    def __init__(self, size, max_pending):
+        self.size = size
+        self.semaphore = twisted.internet.defer.DeferredSemaphore(max_pending)
+        self.executor = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        size = crawler.settings.getint('PARSE_POOL_SIZE')
+        if not size:
+            raise scrapy.exceptions.NotConfigured
+        max_pending = crawler.settings.getint('PARSE_POOL_MAX_PENDING') or 4 * size
+        return cls(size, max_pending)
+
+    def open_spider(self, spider=None):
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.size)
+
+    def close_spider(self, spider=None):
+        #
+        # Wait for the workers to exit in a thread, so as not to block the reactor.
+        #
+        return twisted.internet.threads.deferToThread(self.executor.shutdown)
+
+    def process_item(self, item, spider=None):
+        if not item.get(myspider.UNPARSED):
+            return item
+        return self.semaphore.run(self._parse, item)
+
+    def _parse(self, item):
+        future = self.executor.submit(
+            myspider.parse_page, item['url'], item['body'], item['encoding'], item['data_type']
+        )
+        return deferred_from_future(future)
+
+
+def deferred_from_future(future):
+    """Return a Deferred that fires in the reactor thread when the future completes."""
+    #
+    # Importing the reactor installs it, so don't do that before Scrapy has picked one.
+    #
+    from twisted.internet import reactor
+
+    deferred = twisted.internet.defer.Deferred()
+
+    def fire(future):
+        try:
+            result = future.result()
+        except Exception:
+            deferred.errback()
+        else:
+            deferred.callback(result)
+
+    future.add_done_callback(
+        lambda future: reactor.callFromThread(fire, future)
+    )
+    return deferred
+
+
+class ValidationPipeline(object):
+    """Check that each table adds up, and quarantine the ones that don't.
+
+    Enabled by setting VALIDATION_QUARANTINE to the path of the quarantine
+    file.  Tables that fail any of validation.check are written there, as
+    {"failures": [...], "table": {...}}, instead of to the output.  Where
+    a TIK summary doesn't match the table below it, the mismatch is written
+    there too, but by then one of the two tables has usually been exported
+    already, so both go through.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.crosscheck = validation.CrossCheck()
+        self.quarantined = 0
+        self.mismatches = 0
+        self._file = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('VALIDATION_QUARANTINE')
+        if not path:
+            raise scrapy.exceptions.NotConfigured
+        return cls(path)
+
+    def open_spider(self, spider=None):
+        self._file = io.open(self.path, 'ab')
+
+    def close_spider(self, spider=None):
+        self._file.close()
+        LOGGER.info('quarantined %d tables, %d TIK summaries mismatched',
+                    self.quarantined, self.mismatches)
+
+    def _write(self, record):
+        self._file.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        self._file.flush()
+
+    def process_item(self, item, spider=None):
+        #
+        # Both checks read the cells of a records.Table straight from its array,
+        # so only the tables that get quarantined are turned into dicts.
+        #
+        failures = validation.check(item)
+        if failures:
+            self.quarantined += 1
+            table = item.to_dict() if isinstance(item, records.Table) else dict(item)
+            self._write({'failures': [failure._asdict() for failure in failures], 'table': table})
+            raise scrapy.exceptions.DropItem(
+                'quarantined %r: %s' % (table['url'], ' '.join(f.check for f in failures))
+            )
+        for mismatch in self.crosscheck.add(item):
+            self.mismatches += 1
+            LOGGER.warning('TIK summary mismatch: %r %r %r', mismatch['data_type'],
+                           mismatch['region'], mismatch['territory'])
+            self._write(mismatch)
+        return item
+
+
+class SnapshotPipeline(object):
+    """Add each table to a snapshots.SnapshotStore as it's scraped.
+
+    Enabled by setting SNAPSHOT_STORE to the path of the store.  Only the
+    cells that changed since the version already in the store are written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('SNAPSHOT_STORE')
+        if not path:
+            raise scrapy.exceptions.NotConfigured
+        return cls(path)
+
+    def open_spider(self, spider=None):
+        self.store = snapshots.SnapshotStore(self.path)
+
+    def close_spider(self, spider=None):
+        self.store.close()
+
+    def process_item(self, item, spider=None):
+        self.store.add(item)
+        return item
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Compact records for the scraped tables.
+
+The parsers used to return each table as a dict, with the cells as lists of
+Python floats and a new list of the same row headers in every results table.
+A Table keeps the cells in one flat array of doubles, row by row, and the
+headers in tuples.  Header tuples registered with share (the row headers of
+the results tables and the times of the turnout tables, see myspider) are
+the same object in every table.
+
+For reading, a Table behaves like a read-only version of the dict it
+replaces: table['data'] is a list of lists, table['row_headers'] a list, and
+a *_tik table has no 'territory'.  Those get built on every lookup, so code
+that reads the same field over and over should use the attributes, or
+to_dict the table first.  to_dict and from_dict convert between the two.
+Blank cells (None) are stored as NaN, so a NaN cell comes back as None, and
+cells that couldn't be parsed (BAD_COLUMN) come back as the int they were,
+so a cell of -1.0 does too.
+
+Tables go through Scrapy as items thanks to TableAdapter, so the feed
+exporters see the same fields as before.  Importing this module doesn't
+touch itemadapter: call register_adapter first (MySpider.from_crawler does).
+"""
+import array
+import collections.abc
+import itertools
+import math
+
+import itemadapter
+import itemadapter.adapter
+
+KEYS = ('region', 'territory', 'data_type', 'url', 'md5', 'timestamp',
+        'row_headers', 'column_headers', 'data')
+"""The keys of a table, in the order to_dict puts them."""
+
+BAD_COLUMN = -1
+"""What the parsers put in the cells they can't parse, see myspider.BAD_COLUMN."""
+
+_SHARED = {}
+
+
+def share(headers):
+    """Register a header tuple, so that equal tuples get replaced by it.  Returns it."""
+    headers = tuple(headers)
+    return _SHARED.setdefault(headers, headers)
+
+
+def shared(headers):
+    """Return the registered tuple equal to headers, or headers as a new tuple."""
+    headers = tuple(headers)
+    return _SHARED.get(headers, headers)
+
+
+def _to_cell(value):
+    return math.nan if value is None else value
+
+
+def _from_cell(value):
+    if value != value:
+        return None
+    return BAD_COLUMN if value == BAD_COLUMN else value
+
+
+class Table(collections.abc.Mapping):
+    """A scraped table.  values holds the cells, width to a row.
+
+    If the rows aren't all the same length (the page is broken, see
+    validation), width is None and lengths has the length of each row.
+    """
+
+    __slots__ = ('region', 'territory', 'data_type', 'url', 'md5', 'timestamp',
+                 'row_headers', 'column_headers', 'values', 'width', 'lengths')
+
+    def __init__(self, data_type, url, md5, timestamp, region, territory,
+                 row_headers, column_headers, data):
+        self.data_type = data_type
+        self.url = url
+        self.md5 = md5
+        self.timestamp = timestamp
+        self.region = region
+        self.territory = territory
+        self.row_headers = shared(row_headers)
+        self.column_headers = shared(column_headers)
+
+        lengths = tuple(len(row) for row in data)
+        if len(set(lengths)) > 1:
+            self.width = None
+            self.lengths = lengths
+        else:
+            self.width = lengths[0] if lengths else len(self.column_headers)
+            #
+            # Rows of nothing don't add to values, so count them.
+            #
+            self.lengths = None if self.width else lengths
+        self.values = array.array('d', [_to_cell(value) for row in data for value in row])
+
+    @classmethod
+    def from_dict(cls, table):
+        """Make a Table from a table as the parsers used to return them."""
+        return cls(
+            table['data_type'], table['url'], table['md5'], table['timestamp'],
+            table['region'], table.get('territory'),
+            table['row_headers'], table['column_headers'], table['data'],
+        )
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '<Table %s %r %r (%d rows)>' % (
+            self.data_type, self.region, self.territory, len(self.row_headers)
+        )
+
+    def rows(self):
+        """Return the cells as a list of lists, as they used to be."""
+        values = self.values
+        if self.lengths is None:
+            lengths = [self.width] * (len(values) // self.width)
+        else:
+            lengths = self.lengths
+        starts = itertools.accumulate(lengths, initial=0)
+        if values.count(BAD_COLUMN) or any(value != value for value in values):
+            return [[_from_cell(value) for value in values[start:start + length]]
+                    for (start, length) in zip(starts, lengths)]
+        return [values[start:start + length].tolist() for (start, length) in zip(starts, lengths)]
+
+    def to_dict(self):
+        """Return the table as a dict, as the parsers used to return it."""
+        return {key: self[key] for key in self}
+
+    def __iter__(self):
+        for key in KEYS:
+            if key != 'territory' or self.territory is not None:
+                yield key
+
+    def __len__(self):
+        return len(KEYS) - (self.territory is None)
+
+    def __getitem__(self, key):
+        if key == 'data':
+            return self.rows()
+        elif key in ('row_headers', 'column_headers'):
+            return list(getattr(self, key))
+        elif key in KEYS and (key != 'territory' or self.territory is not None):
+            return getattr(self, key)
+        raise KeyError(key)
+
+
+class TableAdapter(itemadapter.adapter.AdapterInterface):
+    """Let Scrapy treat a Table as an item with the same fields as the dict it replaces."""
+
+    @classmethod
+    def is_item_class(cls, item_class):
+        return issubclass(item_class, Table)
+
+    @classmethod
+    def get_field_names_from_class(cls, item_class):
+        return list(KEYS)
+
+    def __getitem__(self, field_name):
+        return self.item[field_name]
+
+    def __setitem__(self, field_name, value):
+        raise TypeError('tables are read-only, use to_dict to get a copy to change')
+
+    def __delitem__(self, field_name):
+        raise TypeError('tables are read-only, use to_dict to get a copy to change')
+
+    def __iter__(self):
+        return iter(self.item)
+
+    def __len__(self):
+        return len(self.item)
+
+
+def register_adapter():
+    """Register TableAdapter with itemadapter, so that Scrapy accepts Tables as items."""
+    if TableAdapter not in itemadapter.ItemAdapter.ADAPTER_CLASSES:
+        itemadapter.ItemAdapter.ADAPTER_CLASSES.appendleft(TableAdapter)
@@ -47,27 +47,90 @@ ROBOTSTXT_OBEY = False
 
 # Enable or disable spider middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    'prezident2018.middlewares.MyCustomSpiderMiddleware': 543,
-#}
+SPIDER_MIDDLEWARES = {
+    'prezident2018.middlewares.RegionSchedulingMiddleware': 600,
+    # Above the scheduling middleware, so that it never sees skipped requests
+    'prezident2018.middlewares.CheckpointMiddleware': 650,
+    'prezident2018.middlewares.ShardMiddleware': 700,
+    'prezident2018.middlewares.PollingMiddleware': 750,
+}
+
+# Crawl at most this many regions at a time (0 for no limit)
+SCHEDULER_ACTIVE_REGIONS = 0
+
+# Record the progress of the crawl to this file (disabled if unset)
+CHECKPOINT_FILE = None
+# Skip the parts of the crawl that CHECKPOINT_FILE and the output say are done
+CHECKPOINT_RESUME = False
+
+# Share the regions with other workers through this queue (disabled if unset)
+SHARD_QUEUE = None
+# The name of this worker in the queue (defaults to host:pid)
+SHARD_WORKER = None
+# Hand a worker's regions to someone else if it doesn't renew its claim for this many seconds
+SHARD_CLAIM_TIMEOUT = 1800
+
+# Once crawled, poll the tables for changes every this many seconds (disabled if 0)
+POLL_INTERVAL = 0
+# Stop after this many rounds of polling (0 to poll until stopped)
+POLL_ROUNDS = 0
 
 # Enable or disable downloader middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    'prezident2018.middlewares.MyCustomDownloaderMiddleware': 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    # Below HttpCompressionMiddleware (590), so that they see decompressed bodies
+    'prezident2018.middlewares.FastDecodeMiddleware': 560,
+    'prezident2018.middlewares.IncrementalMiddleware': 570,
+    'prezident2018.middlewares.PageStoreMiddleware': 580,
+}
+
+# Record downloaded pages to this directory (disabled if unset)
+PAGESTORE_DIR = None
+# Serve pages from PAGESTORE_DIR instead of the network
+PAGESTORE_REPLAY = False
+
+# Skip tables that haven't changed since this previous crawl (disabled if unset)
+INCREMENTAL_PREVIOUS = None
+# Write the list of new, changed, unchanged and missing tables here
+INCREMENTAL_MANIFEST = 'delta.json'
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+EXTENSIONS = {
+    'prezident2018.extensions.InstrumentationExtension': 500,
+    'prezident2018.extensions.AdaptiveConcurrencyExtension': 510,
+}
+
+# Write per-callback metrics to this file in Prometheus text format (disabled if unset)
+INSTRUMENTATION_FILE = None
+# How often to write them, in seconds
+INSTRUMENTATION_INTERVAL = 60
+
+# Adapt the concurrency of requests to the server's latency and errors
+ADAPTIVE_CONCURRENCY_ENABLED = False
+# Back off when responses take longer than this many seconds
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 2.0
+# Never have more than this many requests in flight
+ADAPTIVE_CONCURRENCY_MAX = 16
 
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    'prezident2018.pipelines.SomePipeline': 300,
-#}
+ITEM_PIPELINES = {
+    'prezident2018.pipelines.ParsePoolPipeline': 100,
+    'prezident2018.pipelines.ValidationPipeline': 150,
+    'prezident2018.pipelines.SnapshotPipeline': 200,
+}
+
+# Parse tables in this many worker processes (0 parses them in the crawler process)
+PARSE_POOL_SIZE = 0
+# Hand at most this many pages to the workers at a time (defaults to 4 per worker)
+PARSE_POOL_MAX_PENDING = 0
+
+# Write the tables that don't add up to this file instead of the output (disabled if unset)
+VALIDATION_QUARANTINE = None
+
+# Keep every version of every table in this snapshot store (disabled if unset)
+SNAPSHOT_STORE = None
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See http://doc.scrapy.org/en/latest/topics/autothrottle.html
@@ -90,4 +153,8 @@ ROBOTSTXT_OBEY = False
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
 
-FEED_EXPORTERS = {"lines": "prezident2018.pipelines.LineExporter"}
+FEED_EXPORTERS = {
+    "lines": "prezident2018.pipelines.LineExporter",
+    "columnar": "prezident2018.pipelines.ColumnarExporter",
+    "joinindex": "prezident2018.pipelines.JoinIndexExporter",
+}
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Share the regions out between several crawler processes.
+
+Each worker is an ordinary crawl with SHARD_QUEUE pointing at the same SQLite
+database and its own output file (its shard):
+
+    scrapy runspider -t lines prezident2018/spiders/myspider.py -o shard1.json.gz -s SHARD_QUEUE=regions.sqlite
+    scrapy runspider -t lines prezident2018/spiders/myspider.py -o shard2.json.gz -s SHARD_QUEUE=regions.sqlite
+
+Every worker fetches the central page and adds the regions it lists to the
+queue (only the first one to get there actually adds anything).  Then each
+worker repeatedly claims the next pending region and crawls it (see
+middlewares.ShardMiddleware).  The exporters write in batches, so the regions
+a worker crawled are only marked done once it has finished and closed its
+shard.  Until then, the worker keeps renewing its claims.  Once all the
+regions are done, merge the shards:
+
+    python -m prezident2018.sharding merge shard*.json.gz -o results.json.gz
+
+Regions claimed by a worker that died are handed out again once they've been
+claimed for longer than SHARD_CLAIM_TIMEOUT, so the same tables may end up
+in more than one shard.  Merging keeps the first copy of each table.
+
+SQLite wants a local file system, so all the workers must run on the same
+machine, or share a file system with working locks.
+"""
+import io
+import logging
+import os
+import socket
+import sqlite3
+import time
+
+from . import dataset
+from . import pipelines
+
+LOGGER = logging.getLogger(__name__)
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS regions (
+    url TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    claimed_at REAL
+)
+"""
+
+
+def default_worker():
+    """Return a name for this worker that's unique across machines."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class RegionQueue(object):
+    """The regions to crawl, and who is crawling them."""
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        #
+        # Autocommit mode: we manage the transactions ourselves.
+        #
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def fill(self, urls):
+        """Add the regions, unless they're already there.  Returns the number added."""
+        with self._transaction():
+            before = self._count()
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO regions (url, position, state) VALUES (?, ?, ?)',
+                [(url, position, PENDING) for (position, url) in enumerate(urls)]
+            )
+            return self._count() - before
+
+    def claim(self, worker, timeout=None, now=None):
+        """Claim the next pending region.  Returns its (url, position), or None.
+
+        If timeout is set, regions claimed longer ago than that are pending again.
+        """
+        if now is None:
+            now = time.time()
+        with self._transaction():
+            if timeout:
+                self.conn.execute(
+                    'UPDATE regions SET state = ?, worker = NULL '
+                    'WHERE state = ? AND claimed_at < ?',
+                    (PENDING, CLAIMED, now - timeout)
+                )
+            row = self.conn.execute(
+                'SELECT url, position FROM regions WHERE state = ? ORDER BY position LIMIT 1',
+                (PENDING,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                'UPDATE regions SET state = ?, worker = ?, claimed_at = ? WHERE url = ?',
+                (CLAIMED, worker, now, row[0])
+            )
+        return row
+
+    def touch(self, urls, worker, now=None):
+        """Renew the worker's claims on the regions, so they don't time out."""
+        if now is None:
+            now = time.time()
+        with self._transaction():
+            self.conn.executemany(
+                'UPDATE regions SET claimed_at = ? WHERE url = ? AND worker = ? AND state = ?',
+                [(now, url, worker, CLAIMED) for url in urls]
+            )
+
+    def done(self, urls):
+        with self._transaction():
+            self.conn.executemany('UPDATE regions SET state = ? WHERE url = ?',
+                                  [(DONE, url) for url in urls])
+
+    def release(self, urls):
+        """Put claimed regions back, e.g. if the worker is shutting down early."""
+        with self._transaction():
+            self.conn.executemany(
+                'UPDATE regions SET state = ?, worker = NULL WHERE url = ? AND state = ?',
+                [(PENDING, url, CLAIMED) for url in urls]
+            )
+
+    def counts(self):
+        """Return the number of regions in each state."""
+        counts = {PENDING: 0, CLAIMED: 0, DONE: 0}
+        counts.update(self.conn.execute('SELECT state, COUNT(*) FROM regions GROUP BY state'))
+        return counts
+
+    def _count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM regions').fetchone()[0]
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+
+class _Transaction(object):
+    """Take the write lock up front, so that two workers can't claim the same region."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def merge(shard_paths, fout, flush_items=1000):
+    """Merge the shards into a single dataset, written to a binary file object.
+
+    Keeps the first copy of each table, by URL.  Returns the number of tables written.
+    """
+    exporter = pipelines.LineExporter(fout, flush_items=flush_items)
+    exporter.start_exporting()
+    seen = set()
+    for path in shard_paths:
+        duplicates = 0
+        for table in dataset.iter_tables(path):
+            if table['url'] in seen:
+                duplicates += 1
+                continue
+            seen.add(table['url'])
+            exporter.export_item(table)
+        if duplicates:
+            LOGGER.info('%r: skipped %d tables that are already in other shards',
+                        path, duplicates)
+    exporter.finish_exporting()
+    return len(seen)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Manage a sharded crawl')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    status_parser = subparsers.add_parser('status', help='show the progress of the crawl')
+    status_parser.add_argument('queue', help='e.g. regions.sqlite')
+
+    merge_parser = subparsers.add_parser('merge', help='merge the shards into one dataset')
+    merge_parser.add_argument('shards', nargs='+')
+    merge_parser.add_argument('-o', '--output', required=True, help='e.g. results.json.gz')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        queue = RegionQueue(args.queue)
+        print(' '.join('%s=%d' % item for item in sorted(queue.counts().items())))
+        queue.close()
+    else:
+        with io.open(args.output, 'wb') as fout:
+            count = merge(args.shards, fout)
+        print('merged %d tables from %d shards' % (count, len(args.shards)))
+
+
+if __name__ == '__main__':
+    main()
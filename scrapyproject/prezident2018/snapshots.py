@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""Keep every version of every table, storing only what changed between versions.
+
+The store is a single append-only JSON-lines file.  The first version of a
+table is stored in full:
+
+    {"url": ..., "timestamp": ..., "md5": ..., "full": {the table, minus the three above}}
+
+and each later version as the cells of data that changed since the previous one:
+
+    {"url": ..., "timestamp": ..., "md5": ..., "cells": [[row, column, value], ...]}
+
+A version whose headers changed is stored in full again, as is every
+KEYFRAME_INTERVAL-th version, so that getting at any version means reading
+at most that many lines.  Versions whose MD5 is the same as the previous
+version's aren't stored at all, and neither are versions older than the
+latest one, so adding the same crawl twice does nothing.
+
+Add crawls to the store as they happen (see pipelines.SnapshotPipeline), or
+after the fact:
+
+    python -m prezident2018.snapshots add snapshots.jsonl results.json.gz
+    python -m prezident2018.snapshots as-of snapshots.jsonl 2018-03-18T21:00 -o at9pm.json.gz
+    python -m prezident2018.snapshots history snapshots.jsonl 'Сахалинская область' \\
+        'Александровск-Сахалинская' 'УИК №1'
+
+Timestamps are compared as strings, which works for the ISO timestamps the
+spider emits, since they're all in UTC.
+"""
+import bisect
+import collections
+import io
+import json
+import logging
+import os.path as P
+
+from .spiders import myspider
+
+LOGGER = logging.getLogger(__name__)
+
+KEYFRAME_INTERVAL = 16
+"""Store every this many versions of a table in full."""
+
+LATEST_CACHE_SIZE = 256
+"""Keep the latest versions of this many tables in memory, least recently used out first."""
+
+KEY_FIELDS = ('url', 'timestamp', 'md5')
+"""The fields stored in every line."""
+
+Version = collections.namedtuple('Version', 'timestamp md5 offset full')
+"""Where to find a version of a table in the store."""
+
+
+class SnapshotStore(object):
+    """An append-only store of the versions of each table, keyed by URL.
+
+    versions maps each URL to a list of Version, oldest first, and tables
+    maps each URL to the region, territory and data_type of its table.  The
+    latest versions of the cache_size most recently added tables are kept in
+    memory; the others get rebuilt from the store when needed.
+    """
+
+    def __init__(self, path, cache_size=LATEST_CACHE_SIZE):
+        self.path = path
+        self.versions = collections.defaultdict(list)
+        self.tables = {}
+        self.cache_size = cache_size
+        self._latest = collections.OrderedDict()
+        self._timestamps = collections.defaultdict(list)
+
+        end = 0
+        if P.isfile(path):
+            with io.open(path, 'rb') as fin:
+                for line in fin:
+                    if not line.endswith(b'\n'):
+                        break
+                    self._index(json.loads(line.decode('utf-8')), end)
+                    end += len(line)
+            if end < P.getsize(path):
+                #
+                # The process writing the store died halfway through a line.
+                #
+                LOGGER.warning('%r: cutting off an incomplete last line', path)
+                with io.open(path, 'r+b') as fout:
+                    fout.truncate(end)
+
+        self._file = io.open(path, 'a+b')
+        LOGGER.debug('loaded %d versions of %d tables from %r',
+                     sum(len(v) for v in self.versions.values()), len(self.versions), path)
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return len(self.versions)
+
+    def __contains__(self, url):
+        return url in self.versions
+
+    def _index(self, record, offset):
+        full = record.get('full')
+        url = record['url']
+        if full is not None:
+            self.tables[url] = {
+                key: full.get(key) for key in ('region', 'territory', 'data_type')
+            }
+        self.versions[url].append(
+            Version(record['timestamp'], record['md5'], offset, full is not None)
+        )
+        #
+        # Versions only ever get added in order, so this stays sorted.
+        #
+        self._timestamps[url].append(record['timestamp'])
+
+    def _read(self, offset):
+        self._file.seek(offset)
+        return json.loads(self._file.readline().decode('utf-8'))
+
+    def _append(self, record):
+        self._file.seek(0, io.SEEK_END)
+        offset = self._file.tell()
+        self._file.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        self._file.flush()
+        self._index(record, offset)
+
+    def add(self, table):
+        """Add a version of a table, as emitted by the spider.
+
+        Returns False if it's the same as the latest version we have, or older.
+        """
+        url = table['url']
+        versions = self.versions.get(url)
+        if versions and (versions[-1].md5 == table['md5'] or
+                         table['timestamp'] <= versions[-1].timestamp):
+            return False
+
+        #
+        # A records.Table builds its data on every lookup, so do that just once,
+        # and only for the versions that get stored.
+        #
+        table = dict(table)
+        record = {key: table[key] for key in KEY_FIELDS}
+        latest = self.latest(url) if versions else None
+        cells = _diff(latest, table)
+        if cells is None or _since_keyframe(versions) + 1 >= KEYFRAME_INTERVAL:
+            record['full'] = {key: value for (key, value) in table.items()
+                              if key not in KEY_FIELDS}
+        else:
+            record['cells'] = cells
+        self._append(record)
+        self._cache(url, _copy_table(table))
+        return True
+
+    def _cache(self, url, table):
+        self._latest[url] = table
+        self._latest.move_to_end(url)
+        while len(self._latest) > self.cache_size:
+            self._latest.popitem(last=False)
+
+    def latest(self, url):
+        """Return the latest version of a table."""
+        if url in self._latest:
+            self._latest.move_to_end(url)
+        else:
+            self._cache(url, self._rebuild(url, len(self.versions[url]) - 1))
+        return _copy_table(self._latest[url])
+
+    def as_of(self, url, timestamp):
+        """Return the version of a table current at the timestamp, or None if there wasn't one."""
+        position = bisect.bisect_right(self._timestamps.get(url, ()), timestamp) - 1
+        if position < 0:
+            return None
+        return self._rebuild(url, position)
+
+    def snapshot(self, timestamp):
+        """Yield the version of every table current at the timestamp."""
+        for url in self.versions:
+            table = self.as_of(url, timestamp)
+            if table is not None:
+                yield table
+
+    def iter_versions(self, url):
+        """Yield every version of a table, oldest first."""
+        table = None
+        for version in self.versions.get(url, ()):
+            table = _apply(table, self._read(version.offset))
+            yield _copy_table(table)
+
+    def _rebuild(self, url, position):
+        versions = self.versions[url]
+        start = position
+        while not versions[start].full:
+            start -= 1
+        table = None
+        for version in versions[start:position + 1]:
+            table = _apply(table, self._read(version.offset))
+        return table
+
+    def history(self, region, territory, name):
+        """Return how the results and turnout of a polling station changed.
+
+        Returns a list of (timestamp, data_type, values) tuples, oldest first,
+        where values is a dict keyed by row header (results) or time (turnout).
+        A tuple is only included when the values changed.
+        """
+        changes = []
+        for url, info in self.tables.items():
+            if (info['region'], info['territory']) != (region, territory):
+                continue
+            previous = None
+            for table in self.iter_versions(url):
+                values = station_values(table, name)
+                if values is not None and values != previous:
+                    changes.append((table['timestamp'], table['data_type'], values))
+                previous = values
+        return sorted(changes, key=lambda change: change[0])
+
+
+def station_values(table, name):
+    """Return the values of a polling station in a *_uik table, or None if it's not there."""
+    if table['data_type'] == myspider.RESULTS_UIK:
+        if name not in table['column_headers']:
+            return None
+        column = table['column_headers'].index(name)
+        return {header: row[column] for (header, row) in zip(table['row_headers'], table['data'])}
+    elif table['data_type'] == myspider.TURNOUT_UIK:
+        #
+        # The first row is the total across all stations.
+        #
+        if name not in table['row_headers'][1:]:
+            return None
+        row = table['data'][table['row_headers'].index(name, 1)]
+        return dict(zip(table['column_headers'], row))
+    return None
+
+
+def _since_keyframe(versions):
+    count = 0
+    for version in reversed(versions or ()):
+        if version.full:
+            break
+        count += 1
+    return count
+
+
+def _diff(old, new):
+    """Return the cells of data that differ, or None if the tables aren't comparable."""
+    if old is None or any(old.get(key) != new.get(key) for key in (
+            'row_headers', 'column_headers', 'region', 'territory', 'data_type')):
+        return None
+    old_data, new_data = old['data'], new['data']
+    if len(old_data) != len(new_data):
+        return None
+    cells = []
+    for row_number, (old_row, new_row) in enumerate(zip(old_data, new_data)):
+        if len(old_row) != len(new_row):
+            return None
+        cells.extend(
+            [row_number, column_number, new_value]
+            for (column_number, (old_value, new_value)) in enumerate(zip(old_row, new_row))
+            if old_value != new_value
+        )
+    return cells
+
+
+def _apply(table, record):
+    """Apply a record from the store to the previous version of the table."""
+    if 'full' in record:
+        table = dict(record['full'])
+        table['data'] = [list(row) for row in table['data']]
+    else:
+        table = _copy_table(table)
+        for row, column, value in record['cells']:
+            table['data'][row][column] = value
+    for key in KEY_FIELDS:
+        table[key] = record[key]
+    return table
+
+
+def _copy_table(table):
+    copy = dict(table)
+    copy['data'] = [list(row) for row in copy['data']]
+    return copy
+
+
+def main():
+    import argparse
+
+    from . import dataset
+    from . import pipelines
+
+    parser = argparse.ArgumentParser(description='Query and update a store of table versions')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    add_parser = subparsers.add_parser('add', help='add the tables of a dataset')
+    add_parser.add_argument('store')
+    add_parser.add_argument('datasets', nargs='+')
+
+    as_of_parser = subparsers.add_parser('as-of', help='write out the tables as of a time')
+    as_of_parser.add_argument('store')
+    as_of_parser.add_argument('timestamp', help='e.g. 2018-03-18T21:00')
+    as_of_parser.add_argument('-o', '--output', required=True, help='e.g. results.json.gz')
+
+    history_parser = subparsers.add_parser('history', help='show how a station changed')
+    history_parser.add_argument('store')
+    history_parser.add_argument('region')
+    history_parser.add_argument('territory')
+    history_parser.add_argument('name')
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.store)
+    if args.command == 'add':
+        for path in args.datasets:
+            added = sum(store.add(table) for table in dataset.iter_tables(path))
+            print('%s: added %d new versions' % (path, added))
+    elif args.command == 'as-of':
+        with io.open(args.output, 'wb') as fout:
+            exporter = pipelines.LineExporter(fout)
+            for table in store.snapshot(args.timestamp):
+                exporter.export_item(table)
+            exporter.finish_exporting()
+    else:
+        for timestamp, data_type, values in store.history(args.region, args.territory, args.name):
+            print('%s %s %s' % (timestamp, data_type, json.dumps(values, ensure_ascii=False)))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,24 @@ import re
 import logging
 import datetime
 import hashlib
+import collections
 
+import lxml.etree
+import lxml.html
 import pytz
 import scrapy
+import scrapy.signals
+
+if __name__ == '__main__':
+    #
+    # Run as a script (see main), so make the package importable from anywhere.
+    #
+    import os.path as P
+    import sys
+    sys.path.insert(0, P.dirname(P.dirname(P.dirname(P.abspath(__file__)))))
+
+from prezident2018 import instrumentation
+from prezident2018 import records
 
 LOGGER = logging.getLogger(__name__)
 
@@ -69,32 +84,45 @@ TURNOUT_UIK = 'turnout_uik'
 TURNOUT_TIMES = ["10:00", "12:00", "15:00", "18:00"]
 """Different times at which the turnout is reported."""
 
+records.share(TURNOUT_TIMES)
+
 TURNOUT_COLUMNS = [3, 4, 5, 6]
 """Column indices for each of the times in TURNOUT_TIMES."""
 
 SKIP_TURNOUT_ROWS = 2
 """Skip this many rows in the turnout table because they contain headers or junk."""
 
+SINGLE_PASS_MIN_STATIONS = 50
+"""Walk a table in a single pass if it reports on at least this many stations.
+
+Smaller tables parse a little faster with an xpath per cell.  See benchmark."""
+
 XPATHS = {
     RESULTS_TIK: {
         "row_header": "/html/body/table[2]/tr[4]/td/table[6]/tr/td[1]/table/tr/td[2]",
         "col_header": "/html/body/table[2]/tr[4]/td/table[6]/tr/td[2]/div/table/tr[1]/td",
         "total": '/html/body/table[2]/tr[4]/td/table[6]/tr/td[1]/table/tr[%d]/td[%d]/nobr/b/text()',  # noqa
         "cell": '/html/body/table[2]/tr[4]/td/table[6]/tr/td[2]/div/table/tr[%d]/td[%d]/nobr/b/text()',  # noqa
+        "total_table": '/html/body/table[2]/tr[4]/td/table[6]/tr/td[1]/table',
+        "cell_table": '/html/body/table[2]/tr[4]/td/table[6]/tr/td[2]/div/table',
     },
     RESULTS_UIK: {
         'row_header': '/html/body/table[3]/tr[4]/td/table[6]/tr/td[1]/table/tr/td[2]',  # noqa
         'col_header': '/html/body/table[3]/tr[4]/td/table[6]/tr/td[2]/div/table/tr[1]/td',  # noqa
         'total': '/html/body/table[3]/tr[4]/td/table[6]/tr/td[1]/table/tr[%d]/td[%d]/nobr/b/text()',  # noqa
         'cell': '/html/body/table[3]/tr[4]/td/table[6]/tr/td[2]/div/table/tr[%d]/td[%d]/nobr/b/text()',  # noqa
+        'total_table': '/html/body/table[3]/tr[4]/td/table[6]/tr/td[1]/table',
+        'cell_table': '/html/body/table[3]/tr[4]/td/table[6]/tr/td[2]/div/table',
     },
     TURNOUT_TIK: {
         'row_header': '/html/body/table[2]/tr[4]/td/table[4]/tr/td[2]',
-        "cell": "/html/body/table[2]/tr[4]/td/table[4]/tr[%d]/td[%d]//text()"
+        "cell": "/html/body/table[2]/tr[4]/td/table[4]/tr[%d]/td[%d]//text()",
+        "cell_table": "/html/body/table[2]/tr[4]/td/table[4]",
     },
     TURNOUT_UIK: {
         "row_header": "/html/body/table[3]/tr[4]/td/table[4]/tr/td[2]",
-        "cell": "/html/body/table[3]/tr[4]/td/table[4]/tr[%d]/td[%d]//text()"
+        "cell": "/html/body/table[3]/tr[4]/td/table[4]/tr[%d]/td[%d]//text()",
+        "cell_table": "/html/body/table[3]/tr[4]/td/table[4]",
     }
 }
 """Xpaths for various parts of the table in its different incarnations.
@@ -105,6 +133,10 @@ Chrome appears to insert them by itself, since the original pages don't contain
 The dictionary is keyed by what we're trying to parse.
 
 /nobr/b/text() gives us the inner text.  It's helpful when the text spans multiple elements.
+
+The *_table xpaths point at the enclosing tables of the cell and total xpaths.
+They're used by the single-pass parser, which walks each table once instead
+of evaluating a cell xpath against the whole document for every cell.
 """
 
 
@@ -140,7 +172,35 @@ _ROW_HEADERS = (
     'Явлинский Григорий Алексеевич',
 )
 
-BAD_COLUMN = -1
+#
+# The row headers of every results table: all but the totals and the blank row.
+#
+records.share(header for header in _ROW_HEADERS[1:] if header)
+
+UNCHANGED = 'unchanged'
+"""The request meta key that marks pages identical to the previous crawl.
+
+Set by middlewares.IncrementalMiddleware.  Callbacks don't bother parsing
+tables from such pages, but still follow their links.
+"""
+
+DEFERRED = 'deferred'
+"""The request meta key that marks pages whose tables should be yielded unparsed.
+
+pipelines.ParsePoolPipeline then parses them in worker processes.  Set by
+MySpider on every response when the PARSE_POOL_SIZE setting is non-zero.
+"""
+
+UNPARSED = 'unparsed'
+"""The item key that marks unparsed pages.  See DEFERRED."""
+
+SOURCE_ENCODING = 'cp1251'
+"""The encoding that the izbirkom pages are served in."""
+
+Page = collections.namedtuple('Page', 'url body selector')
+"""The parts of a Scrapy response that the parse_ functions need."""
+
+BAD_COLUMN = records.BAD_COLUMN
 """Sometimes values are just plain missing.  We can't really skip them,
 since our stuff depends on the order of rows and columns, so let's have
 a dummy value that we use to signify something went wrong."""
@@ -170,6 +230,23 @@ class MySpider(scrapy.Spider):
     name = "myspider"
     allowed_domains = ["vybory.izbirkom.ru"]
     start_urls = (TOP_URL,)
+    defer_parsing = False
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        records.register_adapter()
+        spider = super(MySpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.defer_parsing = crawler.settings.getint('PARSE_POOL_SIZE') > 0
+        crawler.signals.connect(spider.response_received, signal=scrapy.signals.response_received)
+        return spider
+
+    def response_received(self, response, request, spider):
+        #
+        # The callbacks are plain functions, so they learn about the setting
+        # through the meta of the request they're handling.
+        #
+        if self.defer_parsing:
+            request.meta[DEFERRED] = True
 
     def parse(self, response):
         self.logger.debug("handling reponse from url: %r", response.url)
@@ -184,8 +261,12 @@ class MySpider(scrapy.Spider):
 #   - scapy.Request objects to indicate what should be scraped
 #   - dictionaries indicating scraped items
 #
+# They're instrumented with the level of the hierarchy their page is at.
+# See the instrumentation module.
+#
 
 
+@instrumentation.instrument_callback(instrumentation.CENTRAL)
 def cb_central_ik_home(response):
     """Handle the response of scraping the top-level page.
 
@@ -208,6 +289,7 @@ def cb_central_ik_home(response):
             break
 
 
+@instrumentation.instrument_callback(instrumentation.REGION)
 def cb_region_ik_home(response):
     """Handle the response of scraping an region IK page (one level below the top page).
 
@@ -246,6 +328,7 @@ def cb_region_ik_home(response):
     assert len(matched_regexes) == len(callbacks)
 
 
+@instrumentation.instrument_callback(instrumentation.REGION)
 def cb_region_ik_results(response):
     """Handle the response of scaping a regional IK result page.
 
@@ -265,9 +348,11 @@ def cb_region_ik_results(response):
     for link in ik_links:
         href = link.xpath("./@href").extract_first()
         yield scrapy.Request(href, callback=cb_intermediate_page_results)
-    yield parse_voting_summary_table(response, data_type=RESULTS_TIK)
+    if not is_unchanged(response):
+        yield parse_table(response, data_type=RESULTS_TIK)
 
 
+@instrumentation.instrument_callback(instrumentation.TIK)
 def cb_intermediate_page_results(response):
     """Handle the response of scraping an TIK result page.
 
@@ -289,10 +374,11 @@ def get_uik_link(selector):
     # Для просмотра данных по участковым избирательным комиссиям перейдите
     # на сайт избирательной комиссии субъекта Российской Федерации
     #
-    uik_link = selector.xpath(UIK_XPATH)
-    return uik_link.xpath("./@href").extract_first()
+    hrefs = evaluate(selector, UIK_XPATH + "/@href")
+    return hrefs[0] if hrefs else None
 
 
+@instrumentation.instrument_callback(instrumentation.UIK)
 def cb_parse_results_table(response):
     """Callback to handle the response of scraping a TIK result page.
 
@@ -303,18 +389,22 @@ def cb_parse_results_table(response):
     #
     # http://www.vybory.izbirkom.ru/region/izbirkom?action=show&global=true&root=12000001&tvd=2012000191040&vrn=100100031793505&prver=0&pronetvd=null&region=1&sub_region=1&type=227&vibid=2012000191040
     #
-    yield parse_voting_summary_table(response, data_type=RESULTS_UIK)
+    if not is_unchanged(response):
+        yield parse_table(response, data_type=RESULTS_UIK)
 
 
+@instrumentation.instrument_callback(instrumentation.REGION)
 def cb_region_ik_turnout(response):
     ik_links = response.selector.xpath(TURNOUT_TIK_XPATH)
     LOGGER.debug("len(ik_links): %d", len(ik_links))
     for link in ik_links:
         href = link.xpath("./@href").extract_first()
         yield scrapy.Request(href, callback=cb_intermediate_page_turnout)
-    yield parse_turnout_table(response, data_type=TURNOUT_TIK)
+    if not is_unchanged(response):
+        yield parse_table(response, data_type=TURNOUT_TIK)
 
 
+@instrumentation.instrument_callback(instrumentation.TIK)
 def cb_intermediate_page_turnout(response):
     uik_link = get_uik_link(response.selector)
     LOGGER.debug("uik_link: %r", uik_link)
@@ -322,9 +412,31 @@ def cb_intermediate_page_turnout(response):
         yield scrapy.Request(uik_link, callback=cb_parse_turnout_table_uik)
 
 
+@instrumentation.instrument_callback(instrumentation.UIK)
 def cb_parse_turnout_table_uik(response):
     LOGGER.debug("url: %r", response.url)
-    yield parse_turnout_table(response, data_type=TURNOUT_UIK)
+    if not is_unchanged(response):
+        yield parse_table(response, data_type=TURNOUT_UIK)
+
+
+def is_unchanged(response):
+    """Is the page the same as it was during the previous crawl?"""
+    return _meta_flag(response, UNCHANGED)
+
+
+def is_deferred(response):
+    """Should the table of the page be yielded unparsed?"""
+    return _meta_flag(response, DEFERRED)
+
+
+def _meta_flag(response, key):
+    try:
+        return response.meta.get(key) is True
+    except AttributeError:
+        #
+        # Responses that aren't tied to a request don't have any meta.
+        #
+        return False
 
 
 def join(list_of_strings):
@@ -339,16 +451,55 @@ def now():
     return datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
 
 
+def compile_xpath(expression):
+    """Return the compiled XPath for the expression, compiling it only once.
+
+    The parse_ functions evaluate the same handful of expressions on every page.
+    Evaluating a compiled XPath against the lxml tree directly skips both
+    re-compiling the expression and wrapping each result in a selector.
+    """
+    try:
+        xpath = _COMPILED_XPATHS[expression]
+    except KeyError:
+        instrumentation.METRICS.cache_misses['xpath'] += 1
+        if len(_COMPILED_XPATHS) >= MAX_COMPILED_XPATHS:
+            _COMPILED_XPATHS.clear()
+        #
+        # Plain strings, rather than ones that keep the whole tree alive.
+        #
+        xpath = lxml.etree.XPath(expression, smart_strings=False)
+        _COMPILED_XPATHS[expression] = xpath
+    else:
+        instrumentation.METRICS.cache_hits['xpath'] += 1
+    return xpath
+
+
+_COMPILED_XPATHS = {}
+
+MAX_COMPILED_XPATHS = 16384
+"""Start compiling afresh once this many expressions have been compiled.
+
+The cell xpaths are formatted with the row and column numbers, rather than
+using XPath variables, because libxml2 only takes the shortcut to the Nth
+child when N is a literal.  So there's an expression per cell position.
+"""
+
+
+def evaluate(root, expression):
+    """Evaluate an XPath against a selector's lxml tree.  Returns elements or strings."""
+    return compile_xpath(expression)(root.root)
+
+
 def get_name(root):
     """Return the electorate region, committee number and name."""
-    region = join(root.xpath("/html/body/table[2]/tr[1]/td/a[2]/text()").extract())
+    region = join(evaluate(root, "/html/body/table[2]/tr[1]/td/a[2]/text()"))
     del root
     return locals()
 
 
 def get_name_uik(root):
-    region = join(root.xpath("/html/body/table[3]/tr[1]/td/a[1]/text()").extract())
-    territory = join(root.xpath("/html/body/table[3]/tr[1]/td/a[2]/text()").extract())
+    region = join(evaluate(root, "/html/body/table[3]/tr[1]/td/a[1]/text()"))
+    territory = join(evaluate(root, "/html/body/table[3]/tr[1]/td/a[2]/text()"))
     del root
     return locals()
 
@@ -363,15 +514,104 @@ def myfloat(value):
 
 
 def parse_table_headers(root, xpath):
-    return [join(td.xpath(".//text()").extract()) for td in root.xpath(xpath)]
+    text = compile_xpath('.//text()')
+    return [join(text(td)) for td in evaluate(root, xpath)]
 
 
 def parse_table_cell(root, xpath_formatstr, row_number, column_number):
-    return join(root.xpath(xpath_formatstr % (row_number + 1, column_number)).extract())
+    return join(evaluate(root, xpath_formatstr % (row_number + 1, column_number)))
+
+
+class HeaderCache(object):
+    """Check the row headers of the results tables, once per distinct set of headers.
+
+    The parse functions rely on the rows of the results tables being
+    _ROW_HEADERS, which they are nationwide.  Rather than parse the headers of
+    every page to check, we look at the raw text of the header cells, which is
+    cheaper, and only parse and check headers whose raw text we haven't seen.
+    """
+
+    def __init__(self, expected):
+        self.expected = list(expected)
+        self.valid = {}
+
+    def validate(self, cells):
+        """Return True if the header cells (lxml elements) hold the expected headers."""
+        key = tuple(tuple(td.itertext()) for td in cells)
+        try:
+            valid = self.valid[key]
+        except KeyError:
+            instrumentation.METRICS.cache_misses['row_headers'] += 1
+            headers = [join(texts) for texts in key]
+            valid = self.valid[key] = headers == self.expected
+            if not valid:
+                LOGGER.warning('unexpected row headers: %r', headers)
+        else:
+            instrumentation.METRICS.cache_hits['row_headers'] += 1
+        return valid
+
+
+ROW_HEADER_CACHE = HeaderCache(_ROW_HEADERS)
+"""Validates the row headers of the results tables."""
+
+
+def _children(element, tag):
+    """Return the child elements of element with the specified tag."""
+    return [child for child in element if child.tag == tag]
+
+
+def bold_cell_text(td):
+    """Return the text of a table cell.  Equivalent to ./nobr/b/text()."""
+    texts = []
+    for nobr in _children(td, 'nobr'):
+        for bold in _children(nobr, 'b'):
+            if bold.text is not None:
+                texts.append(bold.text)
+            texts.extend(child.tail for child in bold if child.tail is not None)
+    return join(texts)
+
+
+def parse_table_rows(root, xpath, cell_text=bold_cell_text):
+    """Extract the text of all the cells of a table in a single pass.
+
+    Returns a list of rows, where each row is a list of cell strings.
+    Only the first table matching the xpath is considered.
+    """
+    tables = evaluate(root, xpath)
+    if not tables:
+        return []
+    return [
+        [cell_text(td) for td in _children(tr, 'td')]
+        for tr in _children(tables[0], 'tr')
+    ]
+
 
+def all_cell_text(td):
+    """Return the text of a table cell.  Equivalent to .//text()."""
+    return join(td.itertext())
 
-def parse_voting_summary_table(response, data_type=RESULTS_TIK):
-    """Parse the voting summary table.  Returns a dict."""
+
+def lookup_table_cell(rows, row_number, column_number):
+    """Look up a cell extracted by parse_table_rows.
+
+    Uses the same indexing as parse_table_cell: 0-based rows and 1-based columns.
+    Missing cells are returned as empty strings, like a failed xpath would be.
+    """
+    try:
+        return rows[row_number][column_number - 1]
+    except IndexError:
+        return ''
+
+
+@instrumentation.instrument_parser
+def parse_voting_summary_table(response, data_type=RESULTS_TIK, single_pass=None):
+    """Parse the voting summary table.  Returns a records.Table.
+
+    If single_pass is True, walks the table once instead of evaluating
+    a separate xpath for each cell.  The result is the same either way.
+    If it's None, walks the table once if it has at least
+    SINGLE_PASS_MIN_STATIONS columns.
+    """
     if data_type not in (RESULTS_TIK, RESULTS_UIK):
         raise ValueError('bad data_type: %r', data_type)
 
@@ -387,12 +627,17 @@ def parse_voting_summary_table(response, data_type=RESULTS_TIK):
     LOGGER.debug("result: %r", result)
 
     xpaths = XPATHS[data_type]
-    row_headers = parse_table_headers(root, xpaths["row_header"])
-    LOGGER.debug("row_headers: %r", row_headers)
+    ROW_HEADER_CACHE.validate(evaluate(root, xpaths["row_header"]))
 
     column_headers = parse_table_headers(root, xpaths["col_header"])
     LOGGER.debug("column_headers: %r", column_headers)
 
+    if single_pass is None:
+        single_pass = len(column_headers) >= SINGLE_PASS_MIN_STATIONS
+    if single_pass:
+        total_rows = parse_table_rows(root, xpaths["total_table"])
+        cell_rows = parse_table_rows(root, xpaths["cell_table"])
+
     row_names = []
     rows = []
     for row_number, row_name in enumerate(_ROW_HEADERS):
@@ -401,35 +646,48 @@ def parse_voting_summary_table(response, data_type=RESULTS_TIK):
         #
         if row_number == 0 or row_name == '':
             continue
-        #
-        # xpath rows use 1-based indexing
-        #
-        total_value = parse_table_cell(root, xpaths["total"], row_number, 3)
+
+        if single_pass:
+            total_value = lookup_table_cell(total_rows, row_number, 3)
+            values = [lookup_table_cell(cell_rows, row_number, col_number)
+                      for col_number, _ in enumerate(column_headers, 1)]
+        else:
+            #
+            # xpath rows use 1-based indexing
+            #
+            total_value = parse_table_cell(root, xpaths["total"], row_number, 3)
+            values = [parse_table_cell(root, xpaths["cell"], row_number, col_number)
+                      for col_number, _ in enumerate(column_headers, 1)]
         LOGGER.debug("row: %r total_value: %r", row_number, total_value)
 
         columns = [myfloat(total_value)]
-
-        for col_number, _ in enumerate(column_headers, 1):
-            value = parse_table_cell(root, xpaths["cell"], row_number, col_number)
-            columns.append(myfloat(value))
+        columns.extend(myfloat(value) for value in values)
 
         row_names.append(row_name)
         rows.append(columns)
 
     column_headers.insert(0, "Сумма")
 
-    result.update(
-        {
-            "row_headers": row_names, "column_headers": column_headers,
-            "data": rows, "data_type": data_type,
-            "timestamp": now().isoformat(), "url": url, "md5": md5
-        }
+    return records.Table(
+        data_type, url, md5, now().isoformat(), result['region'], result.get('territory'),
+        row_names, column_headers, rows,
     )
-    return result
 
 
-def parse_turnout_table(response, data_type=TURNOUT_TIK):
-    """Pass the voting turnout table."""
+def parse_percentages(values):
+    """Parse a sequence of strings like '49.71%' into floats."""
+    return [myfloat(value.replace('%', '')) for value in values]
+
+
+@instrumentation.instrument_parser
+def parse_turnout_table(response, data_type=TURNOUT_TIK, single_pass=None):
+    """Pass the voting turnout table.  Returns a records.Table.
+
+    If single_pass is True, walks the table once to get both the row headers
+    and the cells, instead of evaluating a separate xpath for each cell.
+    If it's None, walks the table once if it has at least
+    SINGLE_PASS_MIN_STATIONS rows of stations.
+    """
     if data_type not in (TURNOUT_TIK, TURNOUT_UIK):
         raise ValueError('bad data_type: %r', data_type)
 
@@ -447,27 +705,82 @@ def parse_turnout_table(response, data_type=TURNOUT_TIK):
     LOGGER.debug("result: %r", result)
 
     xpaths = XPATHS[data_type]
-    row_headers = parse_table_headers(root, xpaths["row_header"])
+    if single_pass is None:
+        stations = len(evaluate(root, xpaths["row_header"])) - SKIP_TURNOUT_ROWS
+        single_pass = stations >= SINGLE_PASS_MIN_STATIONS
+    if single_pass:
+        cell_rows = parse_table_rows(root, xpaths["cell_table"], cell_text=all_cell_text)
+        #
+        # Same as the row_header xpath: the 2nd cell of each row that has one.
+        #
+        row_headers = [row[1] for row in cell_rows if len(row) > 1]
+    else:
+        row_headers = parse_table_headers(root, xpaths["row_header"])
     LOGGER.debug("row_headers: %r", row_headers)
 
     important_rows = range(SKIP_TURNOUT_ROWS, len(row_headers))
 
     rows = []
     for row_num in important_rows:
-        cols = [parse_table_cell(root, xpaths['cell'], row_num, col_num)
-                for col_num in TURNOUT_COLUMNS]
-        rows.append([myfloat(c.replace('%', '')) for c in cols])
+        if single_pass:
+            cols = [lookup_table_cell(cell_rows, row_num, col_num)
+                    for col_num in TURNOUT_COLUMNS]
+        else:
+            cols = [parse_table_cell(root, xpaths['cell'], row_num, col_num)
+                    for col_num in TURNOUT_COLUMNS]
+        rows.append(parse_percentages(cols))
 
     LOGGER.debug('rows: %r', rows)
 
-    result.update(
-        {
-            "md5": md5, "url": url, "data_type": data_type,
-            "timestamp": now().isoformat(), "row_headers": row_headers[2:],
-            "column_headers": TURNOUT_TIMES, "data": rows
-        }
+    return records.Table(
+        data_type, url, md5, now().isoformat(), result['region'], result.get('territory'),
+        row_headers[2:], TURNOUT_TIMES, rows,
     )
-    return result
+
+
+def parse_table(response, data_type):
+    """Parse the table of the specified data_type from the response.
+
+    If the page is deferred (see DEFERRED), returns the unparsed page instead.
+    """
+    if is_deferred(response):
+        return {
+            UNPARSED: True, "url": response.url, "body": response.body,
+            "encoding": response.encoding, "data_type": data_type
+        }
+    return PARSERS[data_type](response, data_type=data_type)
+
+
+def make_selector(body, encoding=SOURCE_ENCODING):
+    """Parse the bytes of a page straight into a selector.
+
+    Scrapy decodes the body into text, and the selector then encodes it back
+    to UTF-8 for lxml.  lxml can parse the original bytes just as well,
+    so skip both steps.  Otherwise, does the same as the selector does.
+    """
+    parser = lxml.html.HTMLParser(recover=True, encoding=encoding)
+    root = lxml.etree.fromstring(body.strip().replace(b'\x00', b''), parser=parser)
+    if root is None:
+        root = lxml.etree.fromstring(b'<html/>', parser=parser)
+    return scrapy.Selector(root=root, type='html')
+
+
+def parse_page(url, body, encoding, data_type):
+    """Parse the table from a page that was deferred by parse_table.
+
+    Runs in a worker process, so takes and returns only picklable things.
+    """
+    selector = make_selector(body, encoding)
+    return PARSERS[data_type](Page(url, body, selector), data_type=data_type)
+
+
+PARSERS = {
+    RESULTS_TIK: parse_voting_summary_table,
+    RESULTS_UIK: parse_voting_summary_table,
+    TURNOUT_TIK: parse_turnout_table,
+    TURNOUT_UIK: parse_turnout_table,
+}
+"""The function that parses the table for each data_type."""
 
 
 def main():
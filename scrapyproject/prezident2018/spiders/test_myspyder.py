@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
+import collections
 import os.path as P
 
+import itemadapter
+import itemadapter.adapter
 import mock
 import pytest
 import scrapy
+import scrapy.utils.test
 
 from . import myspider
+from .. import instrumentation
 
 
 CURR_DIR = P.dirname(P.abspath(__file__))
@@ -310,3 +315,105 @@ def test_cb_region_ik_results():
     assert len(things) == 1 + len(TIK_NAMES)
     assert [thing.method for thing in things[:-1]] == ['GET'] * len(TIK_NAMES)
     assert 'column_headers' in things[-1]
+
+
+@pytest.mark.parametrize('filename,data_type', [
+    ('regional_ik_results.html', myspider.RESULTS_TIK),
+    ('territorial_ik_results.html', myspider.RESULTS_UIK),
+])
+def test_parse_voting_summary_table_single_pass(filename, data_type):
+    """Does the single-pass parser give the same result as the per-cell one?"""
+    response = mock_response(filename)
+    expected = myspider.parse_voting_summary_table(response, data_type, single_pass=False).to_dict()
+    actual = myspider.parse_voting_summary_table(response, data_type, single_pass=True).to_dict()
+    del expected['timestamp'], actual['timestamp']
+    assert actual == expected
+
+
+def test_parse_table_rows():
+    response = mock_response('territorial_ik_results.html')
+    xpaths = myspider.XPATHS[myspider.RESULTS_UIK]
+    rows = myspider.parse_table_rows(response.selector, xpaths['cell_table'])
+
+    assert myspider.lookup_table_cell(rows, 1, 1) == '173'
+    assert myspider.lookup_table_cell(rows, 1, 100) == ''
+    assert myspider.lookup_table_cell(rows, 100, 1) == ''
+
+
+@pytest.mark.parametrize('filename,data_type', [
+    ('regional_ik_turnout.html', myspider.TURNOUT_TIK),
+    ('territorial_ik_uik_turnout.html', myspider.TURNOUT_UIK),
+])
+def test_parse_turnout_table_single_pass(filename, data_type):
+    """Does the single-pass parser give the same result as the per-cell one?"""
+    response = mock_response(filename)
+    expected = myspider.parse_turnout_table(response, data_type, single_pass=False).to_dict()
+    actual = myspider.parse_turnout_table(response, data_type, single_pass=True).to_dict()
+    del expected['timestamp'], actual['timestamp']
+    assert actual == expected
+
+
+def test_defer_parsing():
+    """Does the PARSE_POOL_SIZE setting only affect the spider of its crawler?"""
+    get_crawler = scrapy.utils.test.get_crawler
+    pooled = myspider.MySpider.from_crawler(get_crawler(myspider.MySpider, {'PARSE_POOL_SIZE': 2}))
+    default = myspider.MySpider.from_crawler(get_crawler(myspider.MySpider))
+    assert pooled.defer_parsing and not default.defer_parsing
+
+    request = scrapy.Request('http://example.com')
+    response = scrapy.http.HtmlResponse(request.url, body=b'<html/>', request=request)
+    default.response_received(response, request, default)
+    assert not myspider.is_deferred(response)
+    pooled.response_received(response, request, pooled)
+    assert myspider.is_deferred(response)
+
+
+def test_tables_are_items():
+    """Does creating the spider let Scrapy accept its tables as items?"""
+    table = myspider.parse_table(mock_response('territorial_ik_results.html'), myspider.RESULTS_UIK)
+    with mock.patch.object(itemadapter.ItemAdapter, 'ADAPTER_CLASSES',
+                           collections.deque([itemadapter.adapter.DictAdapter])):
+        assert not itemadapter.is_item(table)
+        myspider.MySpider.from_crawler(scrapy.utils.test.get_crawler(myspider.MySpider))
+        assert itemadapter.is_item(table)
+
+
+def test_parse_page():
+    """Does parsing a deferred page give the same result as parsing the response?"""
+    response = mock_response('territorial_ik_uik_turnout.html')
+    response.encoding = 'utf-8'
+    response.meta = {myspider.DEFERRED: True}
+
+    unparsed, = list(myspider.cb_parse_turnout_table_uik(response))
+    assert unparsed[myspider.UNPARSED]
+
+    expected = myspider.parse_turnout_table(response, data_type=myspider.TURNOUT_UIK).to_dict()
+    actual = myspider.parse_page(
+        unparsed['url'], unparsed['body'], unparsed['encoding'], unparsed['data_type']
+    ).to_dict()
+    del expected['timestamp'], actual['timestamp']
+    assert actual == expected
+
+
+def test_parse_table_cell():
+    response = mock_response('territorial_ik_results.html')
+    template = myspider.XPATHS[myspider.RESULTS_UIK]['cell']
+    assert myspider.parse_table_cell(response.selector, template, 1, 1) == \
+        myspider.join(response.selector.xpath(template % (2, 1)).extract())
+    xpath = template % (2, 1)
+    assert myspider.compile_xpath(xpath) is myspider.compile_xpath(xpath)
+
+
+def test_header_cache():
+    cache = myspider.HeaderCache(myspider._ROW_HEADERS)
+    xpath = myspider.XPATHS[myspider.RESULTS_UIK]['row_header']
+    hits = instrumentation.METRICS.cache_hits['row_headers']
+    for _ in range(2):
+        response = mock_response('territorial_ik_results.html')
+        assert cache.validate(myspider.evaluate(response.selector, xpath))
+    assert instrumentation.METRICS.cache_hits['row_headers'] == hits + 1
+    assert len(cache.valid) == 1
+
+    cells = myspider.evaluate(response.selector, xpath)
+    cells[-1].text = 'Кто-то ещё'
+    assert not cache.validate(cells)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Load the results and turnout of each polling station (UIK) into NumPy arrays.
+
+The notebooks used to iterate over the results_uik and turnout_uik tables,
+station by station, every time they needed something.  Here, we do that once:
+each polling station gets a row, identified by its (region, territory, name) key,
+and its results and turnout are rows of two contiguous arrays:
+
+    >>> stations = load('results.json.gz')
+    >>> hundred_pct = stations.turnout_at('10:00') == 100
+    >>> stations.labels(hundred_pct)[:10]
+
+Values that are missing (including the turnout of stations that aren't in any
+turnout table) are NaN.
+"""
+import collections
+import math
+
+import numpy as np
+
+from . import columnar
+from . import dataset
+from .spiders import myspider
+
+MEASURES = tuple(header for header in myspider._ROW_HEADERS[1:] if header)
+"""The columns of Stations.results, in order: the row headers of the results tables."""
+
+CANDIDATES = MEASURES[12:]
+"""The candidates, in the same order as in MEASURES."""
+
+TURNOUT_TIMES = tuple(myspider.TURNOUT_TIMES)
+"""The columns of Stations.turnout, in order."""
+
+Key = collections.namedtuple('Key', 'region territory name')
+"""Identifies a polling station."""
+
+
+def iter_any_tables(path, data_type=None):
+    """Yield the tables (of one or more data_types) from a JSON-lines or columnar dataset."""
+    if not path.endswith('.col'):
+        return dataset.select(path, data_type=data_type)
+    tables = columnar.ColumnarDataset(path).iter_tables()
+    if data_type is None:
+        return tables
+    data_types = [data_type] if isinstance(data_type, str) else data_type
+    return (table for table in tables if table['data_type'] in data_types)
+
+
+def load(path):
+    """Load the polling stations from a dataset."""
+    return Stations.from_tables(
+        iter_any_tables(path, data_type=(myspider.RESULTS_UIK, myspider.TURNOUT_UIK))
+    )
+
+
+def _to_floats(values):
+    return [math.nan if value is None else value for value in values]
+
+
+class Stations(object):
+    """The results and turnout for each polling station.
+
+    keys is a list of the Key for each row, and index maps each Key back to its row.
+    results has a column for each of MEASURES, and turnout for each of TURNOUT_TIMES.
+    region_code and territory_code give the position of each row's region and territory
+    within regions and territories, so that selecting a region is a vectorised comparison.
+    """
+
+    def __init__(self, keys, results, turnout):
+        self.keys = keys
+        self.index = {key: row for (row, key) in enumerate(keys)}
+        self.results = results
+        self.turnout = turnout
+
+        self.regions = sorted(set(key.region for key in keys))
+        self.territories = sorted(set((key.region, key.territory) for key in keys))
+        region_codes = {region: code for (code, region) in enumerate(self.regions)}
+        territory_codes = {territory: code for (code, territory) in enumerate(self.territories)}
+        self.region_code = np.array(
+            [region_codes[key.region] for key in keys], dtype=np.int32
+        )
+        self.territory_code = np.array(
+            [territory_codes[key[:2]] for key in keys], dtype=np.int32
+        )
+
+    @classmethod
+    def from_tables(cls, tables):
+        """Build from the tables emitted by the spider.  Only the *_uik tables are used."""
+        keys = []
+        index = {}
+        results = {}
+        turnout = {}
+
+        def get_row(key):
+            if key not in index:
+                index[key] = len(keys)
+                keys.append(key)
+            return index[key]
+
+        for table in tables:
+            if table['data_type'] == myspider.RESULTS_UIK:
+                row_headers = table['row_headers']
+                positions = [row_headers.index(measure) for measure in MEASURES]
+                columns = list(zip(*table['data']))
+                #
+                # Skip the first column, it's the sum across all stations.
+                #
+                for name, column in zip(table['column_headers'][1:], columns[1:]):
+                    key = Key(table['region'], table['territory'], name)
+                    results[get_row(key)] = _to_floats(column[p] for p in positions)
+            elif table['data_type'] == myspider.TURNOUT_UIK:
+                #
+                # Skip the first row, it's the total across all stations.
+                #
+                for name, row in zip(table['row_headers'][1:], table['data'][1:]):
+                    key = Key(table['region'], table['territory'], name)
+                    turnout[get_row(key)] = _to_floats(row)
+
+        results_array = np.full((len(keys), len(MEASURES)), np.nan)
+        for row, values in results.items():
+            results_array[row] = values
+
+        turnout_array = np.full((len(keys), len(TURNOUT_TIMES)), np.nan)
+        for row, values in turnout.items():
+            turnout_array[row] = values
+
+        return cls(keys, results_array, turnout_array)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def measure(self, header):
+        """Return the column of results for one of MEASURES, e.g. a candidate's name."""
+        return self.results[:, MEASURES.index(header)]
+
+    def turnout_at(self, time):
+        """Return the column of turnout for one of TURNOUT_TIMES, e.g. '10:00'."""
+        return self.turnout[:, TURNOUT_TIMES.index(time)]
+
+    def in_region(self, region):
+        """Return a boolean mask selecting the stations of a region."""
+        return self.region_code == self.regions.index(region)
+
+    def labels(self, mask=None):
+        """Return 'region / territory / name' labels for the (selected) stations."""
+        rows = range(len(self)) if mask is None else np.flatnonzero(mask)
+        return ['%s / %s / %s' % self.keys[row] for row in rows]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import io
+
+import numpy as np
+
+from . import anomalies
+from . import stations
+
+
+def test_integer_score():
+    scores = anomalies.integer_score(np.array([500, 501, 50, np.nan]),
+                                     np.array([1000, 1000, 100, 1000]))
+    assert np.allclose(scores, [1, 0, 0, 0])
+
+
+def test_correlation_score():
+    turnout = np.array([0.5, 0.6, 0.4, 0.5, 0.9, 0.5])
+    share = np.array([0.5, 0.4, 0.6, 0.5, 0.9, 0.1])
+    groups = np.array([0, 0, 0, 0, 0, 1])
+    scores = anomalies.correlation_score(turnout, share, groups)
+    assert np.argmax(scores) == 4
+    assert scores[0] == scores[5] == 0
+
+
+def test_digit_score():
+    uniform = np.arange(100, 200, dtype=float).reshape(-1, 1)
+    sevens = np.full((100, 1), 117.0)
+    counts = np.vstack([uniform, sevens])
+    groups = np.repeat([0, 1], 100)
+    scores = anomalies.digit_score(counts, groups)
+    assert np.all(scores[:100] < 0.5)
+    assert np.all(scores[100:] > 10)
+
+
+def test_monotonic_score():
+    readings = np.array([
+        [10, 20, 30, 40, 50],
+        [10, 20, 15, 40, 50],
+        [10, 20, 30, 40, 39.8],
+        [np.nan] * 4 + [50],
+    ])
+    assert anomalies.monotonic_score(readings).tolist() == [0, anomalies.MONOTONIC_SCORE, 0, 0]
+
+
+def test_score_and_write(random_stations):
+    st = random_stations
+    issued = stations.MEASURES.index(anomalies.ISSUED[1])
+    st.results[:, issued] = st.results[:, 0]
+    #
+    # The third station reports that everyone voted by 10:00, more than at the end of the day.
+    #
+    st.results[2, issued] = st.results[2, 0] / 2
+    st.turnout[2] = 100
+
+    scores = anomalies.score(st)
+    assert anomalies.leader(st) in stations.CANDIDATES
+    assert set(scores) == set(anomalies.TESTS + ('total',))
+    assert scores['monotonic'][2] == anomalies.MONOTONIC_SCORE
+    assert np.count_nonzero(scores['monotonic']) == 1
+    assert np.allclose(scores['total'], sum(scores[test] for test in anomalies.TESTS))
+
+    fout = io.StringIO()
+    anomalies.write(st, scores, fout, limit=3)
+    lines = fout.getvalue().splitlines()
+    assert lines[0] == 'region,territory,name,total,integer,correlation,digits,monotonic'
+    assert len(lines) == 4
+    totals = [float(line.split(',')[3]) for line in lines[1:]]
+    assert totals == sorted(totals, reverse=True)
+    assert totals[0] == round(scores['total'].max(), 2)
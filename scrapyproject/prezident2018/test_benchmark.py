@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import mock
+import pytest
+
+from . import benchmark
+from .spiders import myspider
+
+
+def test_widen_results():
+    body = benchmark.read_fixture('territorial_ik_results.html')
+    page = benchmark.make_page('wide', benchmark.widen_results(body, myspider.RESULTS_UIK, 50))
+    result = myspider.parse_voting_summary_table(page, data_type=myspider.RESULTS_UIK)
+    assert len(result['column_headers']) == 1 + 50
+    assert all(len(row) == 1 + 50 for row in result['data'])
+    assert None not in result['data'][0]
+
+
+def test_widen_turnout():
+    body = benchmark.read_fixture('territorial_ik_uik_turnout.html')
+    page = benchmark.make_page('wide', benchmark.widen_turnout(body, myspider.TURNOUT_UIK, 50))
+    result = myspider.parse_turnout_table(page, data_type=myspider.TURNOUT_UIK)
+    #
+    # The extra row is the total across all stations.
+    #
+    assert len(result['row_headers']) == 1 + 50
+    assert None not in result['data'][-1]
+
+
+@pytest.mark.parametrize('stations', [10, myspider.SINGLE_PASS_MIN_STATIONS])
+def test_single_pass_default(stations):
+    """Do the parsers walk the table in a single pass once it's big enough?"""
+    wide = myspider.SINGLE_PASS_MIN_STATIONS <= stations
+    for filename, data_type, widen in (
+        ('territorial_ik_results.html', myspider.RESULTS_UIK, benchmark.widen_results),
+        ('territorial_ik_uik_turnout.html', myspider.TURNOUT_UIK, benchmark.widen_turnout),
+    ):
+        body = widen(benchmark.read_fixture(filename), data_type, stations)
+        page = benchmark.make_page('wide', body)
+        with mock.patch.object(myspider, 'parse_table_rows', wraps=myspider.parse_table_rows) \
+                as parse_table_rows:
+            result = myspider.PARSERS[data_type](page, data_type=data_type)
+        assert parse_table_rows.called == wide
+        expected = myspider.PARSERS[data_type](page, data_type=data_type, single_pass=not wide)
+        assert result['data'] == expected['data']
+        assert result['row_headers'] == expected['row_headers']
+
+
+def test_find_regressions():
+    baseline = {'a': {'pages_per_sec': 100}, 'b': {'pages_per_sec': 100}}
+    measurements = {'a': {'pages_per_sec': 90}, 'b': {'pages_per_sec': 50},
+                    'c': {'pages_per_sec': 1}}
+    assert benchmark.find_regressions(measurements, baseline) == ['b']
+
+
+def test_run_case():
+    measurement = benchmark.run_case(lambda: {'data': [[1, 2], [3, 4]]}, min_time=0.01)
+    assert measurement['cells'] == 4
+    assert measurement['pages_per_sec'] > 0
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from . import checkpoint
+
+CENTRAL = 'http://example.com/'
+REGIONS = ['http://example.com/region/%d' % i for i in range(2)]
+UIKS = ['http://example.com/uik/%d' % i for i in range(3)]
+
+
+def test_checkpoint(tmpdir):
+    path = str(tmpdir.join('checkpoint.jsonl'))
+    saved = checkpoint.Checkpoint(path)
+    saved.record(CENTRAL, REGIONS, 0)
+    saved.record(REGIONS[0], UIKS[:2], 1)
+    saved.record(UIKS[0], [], 1)
+    saved.record(UIKS[1], [], 1)
+    saved.record(REGIONS[1], UIKS[2:], 1)
+    saved.close()
+
+    #
+    # Simulate dying halfway through writing a line.
+    #
+    with open(path, 'ab') as fout:
+        fout.write(b'{"url": "http://exa')
+
+    loaded = checkpoint.Checkpoint(path)
+    assert len(loaded) == 5
+    assert loaded.completed(set(REGIONS + UIKS)) == set(REGIONS[:1] + UIKS[:2])
+    #
+    # The table of UIKS[1] was emitted but never made it into the output.
+    #
+    assert loaded.completed(set(REGIONS + UIKS[:1])) == set(UIKS[:1])
+
+    #
+    # Resuming adds the missing parts.
+    #
+    loaded.record(UIKS[2], [], 1)
+    loaded.record(CENTRAL, REGIONS[1:], 0)
+    loaded.close()
+    assert checkpoint.Checkpoint(path).completed(set(REGIONS + UIKS)) == set([CENTRAL] + REGIONS + UIKS)
+
+
+def test_checkpoint_redirects(tmpdir):
+    path = str(tmpdir.join('checkpoint.jsonl'))
+    saved = checkpoint.Checkpoint(path)
+    saved.record(REGIONS[0], UIKS[:1], 1, table_url=REGIONS[0])
+    saved.record(UIKS[0], [], 1, table_url=UIKS[1])
+    saved.close()
+
+    loaded = checkpoint.Checkpoint(path)
+    assert loaded.completed(set(REGIONS[:1] + UIKS[:1])) == set()
+    assert loaded.completed(set(REGIONS[:1] + UIKS[1:2])) == set(REGIONS[:1] + UIKS[:1])
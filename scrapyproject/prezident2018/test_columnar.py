@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import io
+
+from . import columnar
+from .spiders import myspider
+from .spiders.test_myspyder import mock_response
+
+FIXTURES = (
+    ('regional_ik_results.html', myspider.RESULTS_TIK),
+    ('territorial_ik_results.html', myspider.RESULTS_UIK),
+    ('regional_ik_turnout.html', myspider.TURNOUT_TIK),
+    ('territorial_ik_uik_turnout.html', myspider.TURNOUT_UIK),
+)
+
+
+def parse_fixtures():
+    return [
+        myspider.PARSERS[data_type](mock_response(filename), data_type=data_type)
+        for (filename, data_type) in FIXTURES
+    ]
+
+
+def test_round_trip(tmpdir):
+    tables = [table.to_dict() for table in parse_fixtures()]
+    tables[1]['data'][2][3] = None
+    path = str(tmpdir.join('results.col'))
+    columnar.write_dataset(tables, path)
+
+    dataset = columnar.ColumnarDataset(path)
+    assert len(dataset) == len(tables)
+    assert list(dataset.iter_tables()) == tables
+
+
+def test_arrays(tmpdir):
+    writer = columnar.ColumnarWriter()
+    for table in parse_fixtures() + parse_fixtures():
+        writer.add(table)
+    fout = io.BytesIO()
+    writer.write(fout)
+
+    assert fout.getvalue().startswith(columnar.MAGIC)
+    assert len(writer.measures[myspider.RESULTS_UIK]) == 20
+    assert len(writer.measures[myspider.TURNOUT_UIK]) == 4
+    assert len(writer.header_sets) == len(FIXTURES)
+
+    #
+    # The header only describes the arrays, everything else is in them.
+    #
+    path = tmpdir.join('results.col')
+    path.write_binary(fout.getvalue())
+    dataset = columnar.ColumnarDataset(str(path))
+    assert len(dataset) == 2 * len(FIXTURES)
+    assert dataset.table(len(FIXTURES))['data'] == dataset.table(0)['data']
+    assert dataset.header_set(1).tolist() == list(range(20))
+
+
+def test_widen(tmpdir):
+    """Tables with headers that haven't been seen before should be padded with NaN."""
+    table = parse_fixtures()[3]
+    wider = dict(table, column_headers=table['column_headers'] + ['21:00'],
+                 data=[row + [1.0] for row in table['data']])
+    path = str(tmpdir.join('results.col'))
+    columnar.write_dataset([table, wider], path)
+
+    dataset = columnar.ColumnarDataset(path)
+    assert dataset.table(0) == table
+    assert dataset.table(1) == wider
+    assert dataset.arrays['turnout_uik/values'].shape == (2 * len(table['data']), 5)
+    assert dataset.entity_names(myspider.TURNOUT_UIK)[1] == 'УИК №1'
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+
+import pytest
+
+from . import cube
+from .spiders import myspider
+from .spiders.test_myspyder import mock_response
+
+VALID = 'Число действительных избирательных бюллетеней'
+PUTIN = 'Путин Владимир Владимирович'
+
+
+@pytest.fixture
+def tables():
+    sakhalin = myspider.parse_table(mock_response('territorial_ik_results.html'),
+                                    myspider.RESULTS_UIK)
+    other = sakhalin.to_dict()
+    other['territory'] = 'Анивская'
+    other['data'] = [[2 * value for value in row] for row in other['data']]
+    elsewhere = sakhalin.to_dict()
+    elsewhere['region'] = 'Республика Адыгея (Адыгея)'
+    elsewhere['territory'] = 'Адыгейская'
+    turnout = myspider.parse_table(mock_response('territorial_ik_uik_turnout.html'),
+                                   myspider.TURNOUT_UIK)
+    return [sakhalin, other, elsewhere, turnout]
+
+
+def test_rollup(tables):
+    sakhalin = tables[0]
+    valid = sakhalin['data'][sakhalin['row_headers'].index(VALID)][0]
+    c = cube.Cube.from_tables(tables)
+
+    assert c.regions == ['Республика Адыгея (Адыгея)', 'Сахалинская область']
+    assert c.value(VALID, 'Сахалинская область', 'Александровск-Сахалинская') == valid
+    assert c.value(VALID, 'Сахалинская область') == 3 * valid
+    assert c.value(VALID) == 4 * valid
+    assert c.rollup()[VALID] == 4 * valid
+
+    stations = len(sakhalin['column_headers']) - 1
+    assert c.num_stations('Сахалинская область') == 2 * stations
+    assert c.num_stations() == 3 * stations
+
+    assert [name for (name, _) in c.drill_down()] == c.regions
+    assert c.drill_down('Сахалинская область') == [
+        ('Александровск-Сахалинская', c.rollup('Сахалинская область', 'Александровск-Сахалинская')),
+        ('Анивская', c.rollup('Сахалинская область', 'Анивская')),
+    ]
+
+
+def test_later_versions_win(tables):
+    newer = tables[0].to_dict()
+    newer['data'][0][0] += 10
+    assert cube.Cube.from_tables(tables + [newer]).total[0] == \
+        cube.Cube.from_tables(tables).total[0] + 10
+
+
+def test_load(tmpdir, tables):
+    path = str(tmpdir.join('results.json'))
+    with io.open(path, 'wt', encoding='utf-8') as fout:
+        for table in tables:
+            fout.write(json.dumps(dict(table), ensure_ascii=False) + '\n')
+
+    built = cube.load(path)
+    assert os.path.isfile(path + cube.SUFFIX)
+    loaded = cube.load(path)
+    assert loaded.territories == built.territories
+    assert loaded.rollup() == built.rollup()
+    assert loaded.num_stations('Сахалинская область') == built.num_stations('Сахалинская область')
+
+    #
+    # A newer dataset means a new cube.
+    #
+    with io.open(path, 'wt', encoding='utf-8') as fout:
+        fout.write(json.dumps(dict(tables[0]), ensure_ascii=False) + '\n')
+    stat = os.stat(path + cube.SUFFIX)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+    assert cube.load(path).regions == ['Сахалинская область']
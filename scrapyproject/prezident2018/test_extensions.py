@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from . import extensions
+
+
+def make_extension():
+    return extensions.AdaptiveConcurrencyExtension(mock.Mock(), 2.0, 16)
+
+
+def test_adaptive_concurrency_increase():
+    extension = make_extension()
+    concurrency = 4
+    for _ in range(5):
+        concurrency = extension.adjust('slot', concurrency, 0.5, 200, now=0)
+    assert concurrency == 5
+
+    for _ in range(200):
+        concurrency = extension.adjust('slot', concurrency, 0.5, 200, now=0)
+    assert concurrency == 16
+
+
+def test_adaptive_concurrency_decrease():
+    extension = make_extension()
+    assert extension.adjust('slot', 8, 0.5, 503, now=10) == 4
+    #
+    # Only back off once per target latency.
+    #
+    assert extension.adjust('slot', 4, 5.0, 200, now=11) == 4
+    assert extension.adjust('slot', 4, 5.0, 200, now=12) == 2
+    assert extension.adjust('slot', 2, 5.0, 200, now=14) == 1
+    assert extension.adjust('slot', 1, 5.0, 200, now=16) == 1
+    assert extension.adjust('other', 8, 0.5, 200, now=16) == 8
+
+
+def test_adaptive_concurrency_response_received():
+    extension = make_extension()
+    slot = mock.Mock(concurrency=8)
+    extension.crawler.engine.downloader.slots = {'example.com': slot}
+    request = mock.Mock(meta={'download_slot': 'example.com', 'download_latency': 3.0})
+    extension.response_received(mock.Mock(status=200), request, None)
+    assert slot.concurrency == 4
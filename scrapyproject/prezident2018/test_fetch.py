@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os.path as P
+
+import aiohttp
+import aiohttp.web
+import scrapy
+
+from . import fetch
+from .spiders import myspider
+from .spiders.test_myspyder import TIK_NAMES
+
+CURR_DIR = P.dirname(P.abspath(__file__))
+SPIDERS_DIR = P.join(CURR_DIR, 'spiders')
+
+REGION_URL = 'http://example.com/region'
+
+
+def read_fixture(filename):
+    with open(P.join(SPIDERS_DIR, filename), 'rb') as fin:
+        return fin.read()
+
+
+class FakeCrawler(fetch.Crawler):
+    """Serve the saved pages instead of downloading anything."""
+
+    def __init__(self, *args, **kwargs):
+        super(FakeCrawler, self).__init__(*args, **kwargs)
+        self.downloaded = []
+
+    async def download(self, session, url):
+        self.downloaded.append(url)
+        if url == REGION_URL:
+            return read_fixture('regional_ik_results.html')
+        elif 'type=453' in url:
+            return read_fixture('territorial_ik_results.html')
+        return read_fixture('territorial_ik_intermediate.html')
+
+
+def test_crawl():
+    items = []
+    crawler = FakeCrawler(items.append, concurrency=4)
+    crawler.run([scrapy.Request(REGION_URL, callback=myspider.cb_region_ik_results)])
+
+    #
+    # All the TIK pages link to the same UIK page, which only gets downloaded once.
+    #
+    assert crawler.pages == 1 + len(TIK_NAMES) + 1
+    assert len(set(crawler.downloaded)) == len(crawler.downloaded)
+    assert crawler.failed == 0
+    assert [item['data_type'] for item in items] == [myspider.RESULTS_TIK, myspider.RESULTS_UIK]
+    assert items[1]['territory'] == 'Александровск-Сахалинская'
+
+
+def test_download_retries():
+    attempts = []
+
+    async def handler(request):
+        attempts.append(request.path)
+        if len(attempts) == 1:
+            return aiohttp.web.Response(status=503)
+        return aiohttp.web.Response(body=b'<html></html>')
+
+    async def download():
+        app = aiohttp.web.Application()
+        app.router.add_get('/{name}', handler)
+        runner = aiohttp.web.AppRunner(app)
+        await runner.setup()
+        site = aiohttp.web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        crawler = fetch.Crawler(None, retry_delay=0)
+        try:
+            async with aiohttp.ClientSession() as session:
+                found = await crawler.download(session, 'http://127.0.0.1:%d/page' % port)
+                missing = await crawler.download(session, 'http://127.0.0.1:1/page')
+        finally:
+            await runner.cleanup()
+        return found, missing
+
+    found, missing = asyncio.run(download())
+    assert found == b'<html></html>'
+    assert missing is None
+    assert attempts == ['/page', '/page']
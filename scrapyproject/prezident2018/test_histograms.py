@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import collections
+import math
+
+import numpy as np
+
+from . import histograms
+from . import stations
+
+
+def test_binned():
+    centres, values = histograms.binned([0.1, 0.14, 0.16, 0.9, math.nan, 1.5], 0.1,
+                                        weights=[1, 2, 4, 8, 16, 32])
+    assert np.allclose(centres, np.arange(0, 1.05, 0.1))
+    assert values.shape == (1, 11)
+    assert values[0, 1] == 3 and values[0, 2] == 4 and values[0, 9] == 8
+    assert values.sum() == 15
+
+
+def test_vote_share(random_stations):
+    st = random_stations
+    binned = histograms.vote_share(st, width=0.01)
+    assert binned.labels == stations.CANDIDATES
+
+    for candidate in (stations.CANDIDATES[0], stations.CANDIDATES[3]):
+        expected = collections.Counter()
+        for row in range(1, len(st)):
+            votes = st.measure(candidate)[row]
+            expected[int(round(votes / st.measure(histograms.VALID)[row] * 100))] += votes
+        actual = binned.row(candidate)
+        assert {b: v for (b, v) in enumerate(actual) if v} == \
+            {b: v for (b, v) in expected.items() if v}
+
+
+def test_votes_by_turnout(random_stations):
+    st = random_stations
+    binned = histograms.votes_by_turnout(st)
+    assert len(binned.centres) == 101
+    assert binned.values.sum(axis=1).tolist() == \
+        histograms.candidate_votes(st)[1:].sum(axis=0).tolist()
+
+
+def test_turnout_times(random_stations):
+    st = random_stations
+    binned = histograms.turnout_times(st)
+    assert binned.labels == stations.TURNOUT_TIMES
+    assert binned.values.shape == (4, 101)
+    assert binned.values.sum(axis=1).tolist() == [len(st) - 1] * 4
+    expected = collections.Counter(round(value) for value in st.turnout_at('12:00')[2:])
+    expected[round(st.turnout_at('12:00')[0])] += 1
+    assert {b: v for (b, v) in enumerate(binned.row('12:00')) if v} == expected
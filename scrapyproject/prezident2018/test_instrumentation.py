@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from . import instrumentation
+from .spiders import myspider
+from .spiders.test_myspyder import TIK_NAMES, mock_response
+
+
+def test_callbacks():
+    metrics = instrumentation.METRICS
+    metrics.reset()
+
+    response = mock_response('regional_ik_results.html')
+    things = list(myspider.cb_region_ik_results(response))
+    assert len(things) == 1 + len(TIK_NAMES)
+
+    key = ('cb_region_ik_results', instrumentation.REGION)
+    assert metrics.calls[key] == 1
+    assert metrics.requests[key] == len(TIK_NAMES)
+    assert metrics.items[key] == 1
+    assert metrics.callback_seconds[key].count == 1
+    assert metrics.response_bytes[key].sum == len(response.body)
+    assert metrics.parse_seconds['parse_voting_summary_table', myspider.RESULTS_TIK].count == 1
+
+    assert metrics.queue_depth(instrumentation.TIK) == len(TIK_NAMES)
+    list(myspider.cb_intermediate_page_results(mock_response('territorial_ik_intermediate.html')))
+    assert metrics.queue_depth(instrumentation.TIK) == len(TIK_NAMES) - 1
+    assert metrics.queue_depth(instrumentation.UIK) == 1
+
+    text = metrics.to_prometheus()
+    assert 'prezident2018_callback_calls_total{callback="cb_region_ik_results",level="region"} 1' \
+        in text
+    assert 'prezident2018_queue_depth{level="uik"} 1' in text
+    metrics.reset()
+
+
+def test_histogram():
+    hist = instrumentation.Histogram((1, 10))
+    for value in (0.5, 1, 5, 50):
+        hist.observe(value)
+    assert list(hist.cumulative()) == [(1, 2), (10, 3), (float('inf'), 4)]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+from . import joinindex
+from .spiders import myspider
+from .spiders.test_myspyder import UIK_NAMES, mock_response
+
+REGION = 'Сахалинская область'
+TERRITORY = 'Александровск-Сахалинская'
+
+
+def load_fixtures():
+    results = myspider.parse_voting_summary_table(
+        mock_response('territorial_ik_results.html'), data_type=myspider.RESULTS_UIK
+    )
+    turnout = myspider.parse_turnout_table(
+        mock_response('territorial_ik_uik_turnout.html'), data_type=myspider.TURNOUT_UIK
+    ).to_dict()
+    turnout['url'] += '#turnout'
+    return [results, turnout]
+
+
+def test_build(tmpdir):
+    tables = load_fixtures()
+    #
+    # Pretend one of the stations is missing from the turnout table.
+    #
+    turnout = tables[1]
+    turnout['row_headers'] = turnout['row_headers'][:-1]
+    index = joinindex.build(tables)
+
+    assert len(index.matched()) == len(UIK_NAMES) - 1
+    assert index.unmatched_results() == [(REGION, TERRITORY, UIK_NAMES[-1], 0, len(UIK_NAMES))]
+    assert index.unmatched_turnout() == []
+
+    path = str(tmpdir.join('results.join.json'))
+    with io.open(path, 'wb') as fout:
+        index.write(fout)
+    loaded = joinindex.JoinIndex.load(path)
+    assert loaded.to_dict() == json.loads(json.dumps(index.to_dict(), ensure_ascii=False))
+    assert list(joinindex.iter_joined(tables, loaded)) == list(joinindex.iter_joined(tables, index))
+
+    #
+    # A loaded index can still be added to.
+    #
+    loaded.add(dict(turnout, url=turnout['url'] + '2', territory='Анивская'))
+    assert len(loaded.matched()) == len(index.matched())
+    assert len(loaded.unmatched_turnout()) == len(UIK_NAMES) - 1
+
+
+def test_iter_joined():
+    tables = load_fixtures()
+    index = joinindex.build(tables)
+    joined = list(joinindex.iter_joined(tables, index))
+
+    assert len(joined) == len(UIK_NAMES)
+    first = [record for record in joined if record['polling_station'] == 'УИК №1'][0]
+    assert first['turnout'] == tables[1]['data'][1]
+    assert first['results']['Число избирателей, включенных в список избирателей'] == 173
+
+
+def test_iter_joined_streams():
+    """Are tables let go of once the tables they're joined to have come by?"""
+    results, turnout = load_fixtures()
+    index = joinindex.build([results, turnout])
+    seen = []
+
+    def tables():
+        for table in (turnout, results, results):
+            seen.append(table['url'])
+            yield table
+
+    joined = joinindex.iter_joined(tables(), index)
+    first = next(joined)
+    #
+    # Both tables were needed before the first station came out.
+    #
+    assert len(seen) == 2
+    assert len([first] + list(joined)) == len(UIK_NAMES)
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+import gzip
+import inspect
+import json
+import os.path as P
+import time
+
+import mock
+import pytest
+import scrapy.exceptions
+import scrapy.http
+import scrapy.settings
+import twisted.internet.task
+
+from . import checkpoint
+from . import middlewares
+from . import pagestore
+from . import sharding
+from .spiders import myspider
+from .spiders.test_myspyder import mock_response, TIK_NAMES
+
+CURR_DIR = P.dirname(P.abspath(__file__))
+SPIDERS_DIR = P.join(CURR_DIR, 'spiders')
+
+URL = 'http://example.com/results'
+
+
+def make_response(url, filename):
+    with open(P.join(SPIDERS_DIR, filename), 'rb') as fin:
+        body = fin.read()
+    request = scrapy.Request(url)
+    return scrapy.http.HtmlResponse(url, body=body, encoding='cp1251', request=request)
+
+
+def write_previous(path, tables):
+    with gzip.open(path, 'wb') as fout:
+        for table in tables:
+            fout.write((json.dumps(table, ensure_ascii=False) + '\n').encode('utf-8'))
+
+
+def test_incremental(tmpdir):
+    response = make_response(URL, 'territorial_ik_results.html')
+    previous_path = str(tmpdir.join('results.json.gz'))
+    write_previous(previous_path, [
+        {'url': URL, 'md5': pagestore.md5(response.body), 'data_type': myspider.RESULTS_UIK,
+         'timestamp': '2018-03-19T01:02:03.456789+00:00'},
+        {'url': 'http://example.com/gone', 'md5': 'abc', 'data_type': myspider.RESULTS_UIK,
+         'timestamp': '2018-03-19T01:02:03.456789+00:00'},
+    ])
+    manifest_path = str(tmpdir.join('delta.json'))
+    middleware = middlewares.IncrementalMiddleware(
+        middlewares.load_previous(previous_path), manifest_path
+    )
+    spider = mock.Mock()
+
+    middleware.process_request(response.request, spider)
+    assert response.request.headers['If-Modified-Since'] == b'Mon, 19 Mar 2018 01:02:03 GMT'
+
+    response = middleware.process_response(response.request, response, spider)
+    assert myspider.is_unchanged(response)
+    assert list(myspider.cb_parse_results_table(response)) == []
+
+    changed = make_response('http://example.com/other', 'territorial_ik_results.html')
+    changed = middleware.process_response(changed.request, changed, spider)
+    assert not myspider.is_unchanged(changed)
+    for item in myspider.cb_parse_results_table(changed):
+        middleware.item_scraped(item, changed, spider)
+
+    middleware.spider_closed(spider)
+    with open(manifest_path) as fin:
+        manifest = json.load(fin)
+    assert manifest == {
+        'new': ['http://example.com/other'], 'changed': [], 'unchanged': [URL],
+        'missing': ['http://example.com/gone'],
+    }
+
+
+def test_fast_decode():
+    response = make_response(URL, 'territorial_ik_results.html')
+    fast = middlewares.FastDecodeMiddleware().process_response(response.request, response, None)
+    assert isinstance(fast, middlewares.FastHtmlResponse)
+    assert fast.body is response.body
+
+    expected = myspider.parse_voting_summary_table(response, data_type=myspider.RESULTS_UIK).to_dict()
+    actual = myspider.parse_voting_summary_table(fast, data_type=myspider.RESULTS_UIK).to_dict()
+    del expected['timestamp'], actual['timestamp']
+    assert actual == expected
+    assert actual['territory'] == 'Александровск-Сахалинская'
+
+
+def test_fast_decode_other_encodings():
+    response = scrapy.http.HtmlResponse(URL, body=b'<html></html>', encoding='utf-8')
+    assert middlewares.FastDecodeMiddleware().process_response(None, response, None) is response
+
+
+@pytest.mark.parametrize('method', [
+    middlewares.FastDecodeMiddleware.process_response,
+    middlewares.PageStoreMiddleware.process_request,
+    middlewares.PageStoreMiddleware.process_response,
+    middlewares.IncrementalMiddleware.process_request,
+    middlewares.IncrementalMiddleware.process_response,
+])
+def test_spider_is_optional(method):
+    """Scrapy deprecates middleware methods that require a spider argument."""
+    parameter = inspect.signature(method).parameters.get('spider')
+    assert parameter is None or parameter.default is None
+
+
+def test_region_scheduling():
+    middleware = middlewares.RegionSchedulingMiddleware(active_regions=2)
+    central = mock_response('central_ik_home.html')
+    central.meta = {}
+    requests = list(middleware.process_spider_output(
+        central, myspider.cb_central_ik_home(central), None
+    ))
+    assert [r.meta[middlewares.REGION_RANK] for r in requests] == [0, 1]
+    assert requests[0].priority > requests[1].priority
+    assert len(middleware.held) == 85
+
+    #
+    # Deeper pages of a region come before the shallower pages of that region,
+    # and all of them come before the pages of the next region.
+    #
+    region = mock_response('regional_ik_results.html')
+    region.meta = {middlewares.REGION_RANK: 1}
+    output = list(middleware.process_spider_output(
+        region, myspider.cb_region_ik_results(region), None
+    ))
+    tik_requests = [thing for thing in output if isinstance(thing, scrapy.Request)]
+    assert len(tik_requests) == len(TIK_NAMES)
+    assert tik_requests[0].priority > requests[1].priority
+    assert tik_requests[0].priority < requests[0].priority
+
+    #
+    # Once all the requests of a region are handled, the next region is released.
+    #
+    for request in tik_requests:
+        tik = mock_response('territorial_ik_intermediate.html')
+        tik.meta = request.meta
+        output = list(middleware.process_spider_output(
+            tik, myspider.cb_intermediate_page_results(tik), None
+        ))
+        uik, = output
+        assert uik.priority > request.priority
+        uik_response = mock_response('territorial_ik_results.html')
+        uik_response.meta = uik.meta
+        output = list(middleware.process_spider_output(
+            uik_response, myspider.cb_parse_results_table(uik_response), None
+        ))
+    released = output[-1]
+    assert released.meta[middlewares.REGION_RANK] == 2
+    assert len(middleware.held) == 84
+
+    #
+    # The pages of the released region aren't held back.
+    #
+    region.meta = released.meta
+    output = list(middleware.process_spider_output(
+        region, myspider.cb_region_ik_results(region), None
+    ))
+    assert len(output) == 1 + len(TIK_NAMES)
+    assert len(middleware.held) == 84
+
+
+def test_region_scheduling_interleaved():
+    """Do the regions stay within the limit while the pages of a region are handled side by side?"""
+    middleware = middlewares.RegionSchedulingMiddleware(active_regions=1)
+    central = mock_response('central_ik_home.html')
+    central.meta = {}
+    first, = middleware.process_spider_output(central, myspider.cb_central_ik_home(central), None)
+    released = []
+
+    def receive(request, filename, callback):
+        """Return the output of the response to a request, to be handled later."""
+        response = mock_response(filename)
+        response.meta = request.meta
+        return middleware.process_spider_output(response, callback(response), None)
+
+    def handle(output):
+        requests = []
+        for thing in output:
+            if not isinstance(thing, scrapy.Request):
+                continue
+            elif thing.meta[middlewares.REGION_RANK] == 0:
+                requests.append(thing)
+            else:
+                released.append(thing)
+        assert all(count >= 0 for count in middleware.outstanding.values())
+        assert len(middleware.outstanding) <= 1
+        return requests
+
+    tik_requests = handle(receive(first, 'regional_ik_results.html',
+                                  myspider.cb_region_ik_results))
+    assert len(tik_requests) > 1
+
+    #
+    # All the intermediate pages arrive at once, and while Scrapy is still
+    # working through them, the UIK pages they link to come back.
+    #
+    tik_outputs = [receive(request, 'territorial_ik_intermediate.html',
+                           myspider.cb_intermediate_page_results) for request in tik_requests]
+    for output in tik_outputs:
+        uik_request, = handle(output)
+        handle(receive(uik_request, 'territorial_ik_results.html',
+                       myspider.cb_parse_results_table))
+        if output is not tik_outputs[-1]:
+            assert not released
+    assert [request.meta[middlewares.REGION_RANK] for request in released] == [1]
+
+
+def test_region_scheduling_idle():
+    middleware = middlewares.RegionSchedulingMiddleware(active_regions=2)
+    middleware.crawler = mock.Mock()
+    central = mock_response('central_ik_home.html')
+    central.meta = {}
+    list(middleware.process_spider_output(central, myspider.cb_central_ik_home(central), None))
+
+    with pytest.raises(scrapy.exceptions.DontCloseSpider):
+        middleware.spider_idle(None)
+    assert middleware.crawler.engine.crawl.call_count == 2
+    assert len(middleware.held) == 83
+
+    #
+    # With nothing left to release, the spider is let go.
+    #
+    middleware.held.clear()
+    middleware.spider_idle(None)
+    assert middleware.crawler.engine.crawl.call_count == 2
+
+
+def test_region_scheduling_dropped():
+    """Do requests that never reach the spider still count towards finishing their region?"""
+    middleware = middlewares.RegionSchedulingMiddleware(active_regions=1)
+    middleware.crawler = mock.Mock()
+    central = mock_response('central_ik_home.html')
+    central.meta = {}
+    first, = list(middleware.process_spider_output(
+        central, myspider.cb_central_ik_home(central), None
+    ))
+
+    region = mock_response('regional_ik_results.html')
+    region.meta = first.meta
+    tik_requests = [thing for thing in middleware.process_spider_output(
+        region, myspider.cb_region_ik_results(region), None
+    ) if isinstance(thing, scrapy.Request)]
+
+    #
+    # Dropped by the duplicate filter, or an error page dropped by HttpErrorMiddleware.
+    #
+    for request in tik_requests[:-1]:
+        middleware.request_dropped(request, None)
+    middleware.request_dropped(tik_requests[0], None)
+    assert middleware.crawler.engine.crawl.call_count == 0
+    error = mock_response('territorial_ik_intermediate.html')
+    error.meta = tik_requests[-1].meta
+    assert middleware.process_spider_exception(error, ValueError(), None) is None
+    assert middleware.crawler.engine.crawl.call_count == 1
+    released = middleware.crawler.engine.crawl.call_args[0][0]
+    assert released.meta[middlewares.REGION_RANK] == 1
+
+    #
+    # A callback error after the response was counted doesn't release another region.
+    #
+    middleware.spider_error(None, error, None)
+    assert middleware.crawler.engine.crawl.call_count == 1
+
+
+def test_checkpoint_resume(tmpdir):
+    path = str(tmpdir.join('checkpoint.jsonl'))
+    region = mock_response('regional_ik_results.html')
+    tik_urls = [thing.url for thing in myspider.cb_region_ik_results(region)
+                if isinstance(thing, scrapy.Request)]
+
+    saved = checkpoint.Checkpoint(path)
+    saved.record(tik_urls[0], ['http://example.com/uik'], 0)
+    saved.record('http://example.com/uik', [], 1)
+    written = {'http://example.com/uik', region.url}
+    middleware = middlewares.CheckpointMiddleware(saved, saved.completed(written), written)
+
+    #
+    # The table of the region page is already in the output, so isn't emitted again.
+    #
+    output = list(middleware.process_spider_output(
+        region, myspider.cb_region_ik_results(region), None
+    ))
+    assert [thing.url for thing in output] == tik_urls[1:]
+    assert middleware.skipped == 1
+    assert saved.children[region.url] == set(tik_urls[1:])
+    assert saved.items[region.url] == 1
+
+
+def test_checkpoint_redirected_and_dropped(tmpdir):
+    path = str(tmpdir.join('checkpoint.jsonl'))
+    saved = checkpoint.Checkpoint(path)
+    middleware = middlewares.CheckpointMiddleware(saved)
+    saved.record('http://example.com/tik', ['http://example.com/uik'], 0)
+
+    #
+    # The UIK page was redirected, and its table quarantined.
+    #
+    uik = mock_response('territorial_ik_results.html')
+    uik.meta = {'redirect_urls': ['http://example.com/uik']}
+    table, = list(middleware.process_spider_output(
+        uik, myspider.cb_parse_results_table(uik), None
+    ))
+    middleware.item_dropped(table, uik, scrapy.exceptions.DropItem('quarantined'), None)
+    saved.close()
+
+    loaded = checkpoint.Checkpoint(path)
+    assert loaded.table_urls['http://example.com/uik'] == uik.url
+    assert loaded.dropped == {uik.url}
+    assert loaded.completed(set()) == {'http://example.com/tik', 'http://example.com/uik'}
+
+
+def test_feed_paths(tmpdir):
+    path = tmpdir.join('results.json')
+    path.write('')
+    settings = scrapy.settings.Settings({'FEEDS': {
+        str(path): {'format': 'lines'},
+        'file://' + str(path): {'format': 'jsonlines'},
+        str(tmpdir.join('results.col')): {'format': 'columnar'},
+        str(tmpdir.join('missing.json')): {'format': 'lines'},
+    }})
+    assert middlewares.feed_paths(settings) == [str(path), str(path)]
+
+
+def test_shard(tmpdir):
+    queue_path = str(tmpdir.join('regions.sqlite'))
+    workers = [
+        middlewares.ShardMiddleware(sharding.RegionQueue(queue_path), name)
+        for name in ('a', 'b')
+    ]
+    central = mock_response('central_ik_home.html')
+    central.request = scrapy.Request(myspider.TOP_URL)
+    urls = [request.url for request in myspider.cb_central_ik_home(central)]
+
+    claimed = []
+    for worker in workers:
+        worker.crawler = mock.Mock()
+        request, = worker.process_spider_output(central, myspider.cb_central_ik_home(central), None)
+        assert request.meta[middlewares.SHARD_REGION]
+        claimed.append(request.url)
+    assert claimed == urls[:2]
+
+    #
+    # The pages of a region pass through.
+    #
+    region = mock_response('regional_ik_home.html')
+    region.request = scrapy.Request(urls[0], callback=myspider.cb_region_ik_home)
+    assert len(list(workers[0].process_spider_output(
+        region, myspider.cb_region_ik_home(region), None
+    ))) == 2
+
+    with pytest.raises(scrapy.exceptions.DontCloseSpider):
+        workers[0].spider_idle(None)
+    request, = [args[0] for (args, _) in workers[0].crawler.engine.crawl.call_args_list]
+    assert request.url == urls[2]
+    assert request.meta[middlewares.REGION_RANK] == 2
+
+    #
+    # a gets interrupted halfway through its second region, b finishes its first.
+    #
+    workers[0].spider_closed(None, 'shutdown')
+    workers[1].spider_closed(None, 'finished')
+    counts = sharding.RegionQueue(queue_path).counts()
+    assert counts == {'pending': len(urls) - 2, 'claimed': 0, 'done': 2}
+
+
+def test_shard_renewal(tmpdir):
+    """Does a region that takes longer than the claim timeout stay claimed?"""
+    queue_path = str(tmpdir.join('regions.sqlite'))
+    clock = twisted.internet.task.Clock()
+    clock.advance(time.time())
+    worker = middlewares.ShardMiddleware(sharding.RegionQueue(queue_path), 'a',
+                                         claim_timeout=60, clock=clock)
+    worker.crawler = mock.Mock()
+    worker.spider_opened(None)
+    central = mock_response('central_ik_home.html')
+    central.request = scrapy.Request(myspider.TOP_URL)
+    request, = worker.process_spider_output(central, myspider.cb_central_ik_home(central), None)
+
+    other = sharding.RegionQueue(queue_path)
+    for _ in range(10):
+        clock.advance(30)
+        url, _ = other.claim('b', timeout=60, now=clock.seconds())
+        assert url != request.url
+
+    #
+    # Once the worker stops renewing, the region goes to someone else.
+    #
+    worker.spider_closed(None, 'shutdown')
+    assert not clock.getDelayedCalls()
+    worker.queue = sharding.RegionQueue(queue_path)
+    worker.queue.touch([request.url], 'a', now=clock.seconds())
+    clock.advance(61)
+    url, _ = other.claim('b', timeout=60, now=clock.seconds())
+    assert url == request.url
+
+
+def poll_response(filename, url, callback, meta):
+    response = mock_response(filename)
+    response.url = url
+    response.request = scrapy.Request(url, callback=callback, meta=meta)
+    response.meta = response.request.meta
+    return response
+
+
+def test_polling():
+    middleware = middlewares.PollingMiddleware(60, rounds=1)
+    middleware.crawler = mock.Mock()
+
+    def handle(response):
+        middleware.process_spider_input(response, None)
+        callback = response.request.callback
+        return list(middleware.process_spider_output(response, callback(response), None))
+
+    region_url = 'http://example.com/region'
+    region = poll_response('regional_ik_results.html', region_url,
+                           myspider.cb_region_ik_results, {})
+    output = handle(region)
+    assert len(output) == 1 + len(TIK_NAMES)
+    assert output[0].meta[middlewares.POLL_ROOT] == region_url
+
+    tik = poll_response('territorial_ik_intermediate.html', 'http://example.com/tik',
+                        myspider.cb_intermediate_page_results, output[0].meta)
+    uik_request, = handle(tik)
+    uik_url = 'http://example.com/uik'
+    uik = poll_response('territorial_ik_results.html', uik_url,
+                        myspider.cb_parse_results_table, uik_request.meta)
+    assert len(handle(uik)) == 1
+    assert middleware.below == {region_url: [uik_url]}
+
+    #
+    # Nothing happens until the interval has passed.
+    #
+    with pytest.raises(scrapy.exceptions.DontCloseSpider):
+        middleware.spider_idle(None, now=0)
+    with pytest.raises(scrapy.exceptions.DontCloseSpider):
+        middleware.spider_idle(None, now=30)
+    assert not middleware.crawler.engine.crawl.called
+    with pytest.raises(scrapy.exceptions.DontCloseSpider):
+        middleware.spider_idle(None, now=60)
+    poll, = [args[0] for (args, _) in middleware.crawler.engine.crawl.call_args_list]
+    assert poll.url == region_url and poll.meta[middlewares.POLL]
+
+    #
+    # An unchanged region page means nothing below it changed either.
+    #
+    assert handle(poll_response('regional_ik_results.html', region_url,
+                                myspider.cb_region_ik_results, poll.meta)) == []
+
+    #
+    # A changed one yields its table and requests for the pages below it.
+    #
+    output = handle(poll_response('regional_ik_turnout.html', region_url,
+                                  myspider.cb_region_ik_results, dict(poll.meta)))
+    table, uik_poll = output
+    assert table['data_type'] == myspider.RESULTS_TIK
+    assert uik_poll.url == uik_url
+
+    uik = poll_response('territorial_ik_results.html', uik_url,
+                        myspider.cb_parse_results_table, uik_poll.meta)
+    assert handle(uik) == []
+    assert middleware.changed == 1
+
+    #
+    # That was the last round.
+    #
+    middleware.spider_idle(None, now=120)
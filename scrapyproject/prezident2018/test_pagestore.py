@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import os.path as P
+
+import mock
+import pytest
+import scrapy
+
+from . import middlewares
+from . import pagestore
+from .spiders import myspider
+
+CURR_DIR = P.dirname(P.abspath(__file__))
+SPIDERS_DIR = P.join(CURR_DIR, 'spiders')
+
+
+def read_fixture(filename):
+    with open(P.join(SPIDERS_DIR, filename), 'rb') as fin:
+        return fin.read()
+
+
+def test_put_get(tmpdir):
+    store = pagestore.PageStore(str(tmpdir))
+    body = read_fixture('territorial_ik_results.html')
+    digest = store.put('http://example.com/a', body, 'cp1251')
+    store.put('http://example.com/b', body, 'cp1251')
+    store.close()
+
+    assert digest == pagestore.md5(body)
+
+    #
+    # The store should survive being reopened, and identical bodies should be shared.
+    #
+    store = pagestore.PageStore(str(tmpdir))
+    assert len(store) == 2
+    assert store.get('http://example.com/a') == (body, 'cp1251')
+    assert store.get('http://example.com/b') == (body, 'cp1251')
+    assert store.get('http://example.com/c') is None
+    assert len(tmpdir.join('pages').listdir()) == 1
+    store.close()
+
+
+def test_incomplete_index(tmpdir):
+    body = read_fixture('territorial_ik_results.html')
+    store = pagestore.PageStore(str(tmpdir))
+    store.put('http://example.com/a', body, 'cp1251')
+    store.close()
+
+    #
+    # Simulate dying halfway through writing a line.
+    #
+    with open(str(tmpdir.join(pagestore.INDEX_FILENAME)), 'ab') as fout:
+        fout.write(b'{"url": "http://exa')
+
+    store = pagestore.PageStore(str(tmpdir))
+    assert len(store) == 1
+    store.put('http://example.com/b', body, 'cp1251')
+    store.close()
+
+    store = pagestore.PageStore(str(tmpdir))
+    assert store.get('http://example.com/a') == (body, 'cp1251')
+    assert store.get('http://example.com/b') == (body, 'cp1251')
+    store.close()
+
+
+def test_replay(tmpdir):
+    url = 'http://example.com/results'
+    body = read_fixture('territorial_ik_results.html')
+    store = pagestore.PageStore(str(tmpdir))
+    store.put(url, body, 'cp1251')
+
+    middleware = middlewares.PageStoreMiddleware(store, replay=True)
+    spider = mock.Mock()
+    response = middleware.process_request(scrapy.Request(url), spider)
+
+    assert response.url == url
+    assert response.body == body
+
+    result = myspider.parse_voting_summary_table(response, data_type=myspider.RESULTS_UIK)
+    assert result['md5'] == pagestore.md5(body)
+    assert result['territory'] == 'Александровск-Сахалинская'
+
+    with pytest.raises(scrapy.exceptions.IgnoreRequest):
+        middleware.process_request(scrapy.Request('http://example.com/missing'), spider)
+    store.close()
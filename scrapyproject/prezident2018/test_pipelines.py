@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import gzip
+import inspect
+import io
+import json
+
+import mock
+import pytest
+import scrapy.exceptions
+import twisted.internet.task
+
+from . import dataset
+from . import pipelines
+from . import records
+from .spiders import myspider
+from .spiders.test_myspyder import mock_response
+
+ITEMS = [{'url': 'http://example.com/%d' % i, 'region': 'Сахалинская область'} for i in range(5)]
+
+
+@pytest.mark.parametrize('filename', ['results.json', 'results.json.gz'])
+def test_line_exporter(tmpdir, filename):
+    path = str(tmpdir.join(filename))
+    with io.open(path, 'wb') as fout:
+        exporter = pipelines.LineExporter(fout, flush_items=2, clock=twisted.internet.task.Clock())
+        exporter.start_exporting()
+        for item in ITEMS:
+            exporter.export_item(item)
+        exporter.finish_exporting()
+
+    assert list(dataset.iter_tables(path)) == ITEMS
+
+    with io.open(path + '.idx', 'rt') as fin:
+        index = [json.loads(line) for line in fin]
+    assert [entry.get('items') for entry in index] == [2, 2, 1, 5]
+    assert index[-1]['complete']
+
+
+@pytest.mark.parametrize('filename', ['results.json', 'results.json.gz'])
+def test_line_exporter_timer(tmpdir, filename):
+    """Are the items flushed once flush_seconds pass, even if no more come?"""
+    path = str(tmpdir.join(filename))
+    clock = twisted.internet.task.Clock()
+    with io.open(path, 'wb') as fout:
+        exporter = pipelines.LineExporter(fout, flush_seconds=60, clock=clock)
+        exporter.start_exporting()
+        exporter.export_item(ITEMS[0])
+        exporter.export_item(ITEMS[1])
+        clock.advance(59)
+        #
+        # Uncompressed items aren't held back at all.
+        #
+        assert (fout.tell() > 0) == (not filename.endswith('.gz'))
+        clock.advance(1)
+        assert list(dataset.iter_tables(path)) == ITEMS[:2]
+
+        exporter.export_item(ITEMS[2])
+        exporter.finish_exporting()
+        assert not clock.getDelayedCalls()
+
+    with io.open(path + '.idx', 'rt') as fin:
+        index = [json.loads(line) for line in fin]
+    assert [entry.get('items') for entry in index] == [2, 1, 3]
+    assert dataset.repair(path) == 0
+
+
+def test_line_exporter_crash(tmpdir):
+    """Everything up to the last flush should be readable if the crawl dies."""
+    path = str(tmpdir.join('results.json.gz'))
+    with io.open(path, 'wb') as fout:
+        exporter = pipelines.LineExporter(fout, flush_items=2)
+        for item in ITEMS:
+            exporter.export_item(item)
+        #
+        # Simulate dying halfway through writing the next batch.
+        #
+        fout.write(gzip.compress(b'{"url": "http://example.com/5"}\n')[:20])
+
+    assert list(dataset.iter_tables(path)) == ITEMS[:4]
+
+    with io.open(path + '.idx', 'rt') as fin:
+        index = [json.loads(line) for line in fin]
+    assert 'complete' not in index[-1]
+
+
+def test_repair(tmpdir):
+    """After repairing a dataset, another crawl can append to it."""
+    path = str(tmpdir.join('results.json.gz'))
+    with io.open(path, 'wb') as fout:
+        exporter = pipelines.LineExporter(fout, flush_items=2)
+        for item in ITEMS:
+            exporter.export_item(item)
+        fout.write(gzip.compress(b'{"url": "http://example.com/5"}\n')[:20])
+
+    assert dataset.repair(path) == 20
+    assert dataset.repair(path) == 0
+
+    with io.open(path, 'ab') as fout:
+        exporter = pipelines.LineExporter(fout, flush_items=2)
+        exporter.export_item(ITEMS[4])
+        exporter.finish_exporting()
+
+    assert list(dataset.iter_tables(path)) == ITEMS
+
+
+def test_line_exporter_resume(tmpdir):
+    """Does the index of an output appended to by several crawls end with one footer?"""
+    path = str(tmpdir.join('results.json.gz'))
+    for mode, items in (('wb', ITEMS[:2]), ('ab', ITEMS[2:4]), ('ab', ITEMS[4:])):
+        with io.open(path, mode) as fout:
+            exporter = pipelines.LineExporter(fout, flush_items=2, flush_seconds=0)
+            exporter.start_exporting()
+            for item in items:
+                exporter.export_item(item)
+            exporter.finish_exporting()
+
+    assert list(dataset.iter_tables(path)) == ITEMS
+    index = dataset.read_index(path + '.idx')
+    assert [entry.get('complete') for entry in index] == [None, None, None, True]
+    assert [entry['items'] for entry in index] == [2, 2, 1, 5]
+    assert dataset.repair(path) == 0
+
+
+def test_validation_pipeline(tmpdir):
+    path = str(tmpdir.join('quarantine.jsonl'))
+    pipeline = pipelines.ValidationPipeline(path)
+    pipeline.open_spider(None)
+
+    good = myspider.parse_table(mock_response('territorial_ik_results.html'), myspider.RESULTS_UIK)
+    assert pipeline.process_item(good, None) is good
+
+    bad = good.to_dict()
+    bad['data'][0][0] = myspider.BAD_COLUMN
+    with pytest.raises(scrapy.exceptions.DropItem):
+        pipeline.process_item(bad, None)
+    pipeline.close_spider(None)
+
+    with io.open(path, 'rt', encoding='utf-8') as fin:
+        record, = [json.loads(line) for line in fin]
+    assert record['failures'] == [{'check': 'missing', 'columns': ['Сумма']},
+                                  {'check': 'total', 'columns': ['Сумма']}]
+    assert record['table'] == bad
+
+
+def test_pipelines_keep_tables(tmpdir):
+    """Do tables that pass through the pipelines stay compact all the way?"""
+    table = myspider.parse_table(mock_response('territorial_ik_results.html'), myspider.RESULTS_UIK)
+    validation = pipelines.ValidationPipeline(str(tmpdir.join('quarantine.jsonl')))
+    snapshot = pipelines.SnapshotPipeline(str(tmpdir.join('snapshots.jsonl')))
+    exporter = pipelines.ColumnarExporter(io.BytesIO())
+    validation.open_spider()
+    snapshot.open_spider()
+    snapshot.process_item(table)
+
+    with mock.patch.object(records.Table, 'rows', autospec=True,
+                           side_effect=records.Table.rows) as rows:
+        assert validation.process_item(table) is table
+        #
+        # The store has this version already.
+        #
+        assert snapshot.process_item(table) is table
+        exporter.export_item(table)
+    assert not rows.called
+
+    validation.close_spider()
+    snapshot.close_spider()
+
+
+def test_select(tmpdir):
+    tables = [
+        {'data_type': 'results_uik', 'region': 'Сахалинская область', 'territory': 'Анивская',
+         'data': [[1]]},
+        {'data_type': 'turnout_uik', 'region': 'Сахалинская область', 'territory': 'Анивская',
+         'data': [[2]]},
+        #
+        # The region only appears as a row header.
+        #
+        {'data_type': 'results_tik', 'region': 'Республика Адыгея (Адыгея)',
+         'row_headers': ['Сахалинская область'], 'data': [[3]]},
+    ]
+    path = str(tmpdir.join('results.json.gz'))
+    with gzip.open(path, 'wb') as fout:
+        fout.write((json.dumps(tables[0], ensure_ascii=False) + '\n').encode('utf-8'))
+        #
+        # Scrapy's own exporter escapes non-ASCII characters.
+        #
+        for table in tables[1:]:
+            fout.write((json.dumps(table) + '\n').encode('utf-8'))
+
+    assert list(dataset.select(path)) == tables
+    assert list(dataset.select(path, region='Сахалинская область')) == tables[:2]
+    assert list(dataset.select(path, data_type=('results_uik', 'results_tik'),
+                               fields=('data',))) == [{'data': [[1]]}, {'data': [[3]]}]
+
+    with mock.patch('json.loads', wraps=json.loads) as loads:
+        assert list(dataset.select(path, data_type='turnout_uik', territory='Анивская')) == \
+            tables[1:2]
+    assert loads.call_count == 1
+
+
+@pytest.mark.parametrize('method', [
+    pipelines.ParsePoolPipeline.open_spider,
+    pipelines.ParsePoolPipeline.close_spider,
+    pipelines.ParsePoolPipeline.process_item,
+    pipelines.ValidationPipeline.open_spider,
+    pipelines.ValidationPipeline.close_spider,
+    pipelines.ValidationPipeline.process_item,
+    pipelines.SnapshotPipeline.open_spider,
+    pipelines.SnapshotPipeline.close_spider,
+    pipelines.SnapshotPipeline.process_item,
+])
+def test_spider_is_optional(method):
+    """Scrapy deprecates pipeline methods that require a spider argument."""
+    parameter = inspect.signature(method).parameters.get('spider')
+    assert parameter is None or parameter.default is None
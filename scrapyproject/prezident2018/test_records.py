@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import collections
+import pickle
+
+import itemadapter
+import mock
+import pytest
+
+from . import records
+from . import stations
+from .spiders import myspider
+from .spiders.test_myspyder import mock_response
+
+
+@pytest.fixture
+def table():
+    return myspider.parse_table(mock_response('territorial_ik_results.html'), myspider.RESULTS_UIK)
+
+
+@pytest.fixture
+def adapter_classes():
+    """Keep the adapters that tests register from leaking into other tests."""
+    classes = collections.deque(
+        cls for cls in itemadapter.ItemAdapter.ADAPTER_CLASSES if cls is not records.TableAdapter
+    )
+    with mock.patch.object(itemadapter.ItemAdapter, 'ADAPTER_CLASSES', classes):
+        yield classes
+
+
+def test_to_dict(table):
+    as_dict = table.to_dict()
+    assert list(as_dict) == list(records.KEYS)
+    assert as_dict['territory'] == 'Александровск-Сахалинская'
+    assert as_dict['row_headers'] == list(stations.MEASURES)
+    assert len(as_dict['data']) == len(stations.MEASURES)
+    assert all(len(row) == len(as_dict['column_headers']) for row in as_dict['data'])
+    assert records.Table.from_dict(as_dict) == table == as_dict
+
+
+def test_tik_has_no_territory():
+    table = myspider.parse_table(mock_response('regional_ik_turnout.html'), myspider.TURNOUT_TIK)
+    assert 'territory' not in table
+    assert table.get('territory') is None
+    assert len(table) == len(table.to_dict()) == len(records.KEYS) - 1
+
+
+def test_missing_cells():
+    table = records.Table('turnout_uik', 'http://example.com', 'md5', 'now', 'region', 'territory',
+                          ['Сумма', 'УИК №1'], myspider.TURNOUT_TIMES, [[1, 2, 3, 4], [5, None, 7, 8]])
+    assert table['data'] == [[1, 2, 3, 4], [5, None, 7, 8]]
+    assert records.Table.from_dict(table.to_dict()) == table
+
+    table = records.Table('turnout_uik', 'http://example.com', 'md5', 'now', 'region', 'territory',
+                          ['Сумма', 'УИК №1'], myspider.TURNOUT_TIMES,
+                          [[1.5, 2, 3, 4], [5, myspider.BAD_COLUMN, 7, 8]])
+    assert table['data'] == [[1.5, 2, 3, 4], [5, myspider.BAD_COLUMN, 7, 8]]
+    assert isinstance(table['data'][1][1], int)
+
+
+
+@pytest.mark.parametrize('data', [[[1, 2, 3, 4], [5]], [[], [1]], [[], []], []])
+def test_ragged(data):
+    table = records.Table('turnout_uik', 'http://example.com', 'md5', 'now', 'region', 'territory',
+                          ['Сумма', 'УИК №1'], myspider.TURNOUT_TIMES, data)
+    assert table['data'] == data
+    assert records.Table.from_dict(table.to_dict()) == table
+
+
+def test_shared_headers(table):
+    turnout = myspider.parse_table(mock_response('regional_ik_turnout.html'), myspider.TURNOUT_TIK)
+    other = records.Table.from_dict(table.to_dict())
+    assert other.row_headers is table.row_headers
+    assert turnout.column_headers is records.shared(myspider.TURNOUT_TIMES)
+
+
+def test_read_only(table, adapter_classes):
+    records.register_adapter()
+    with pytest.raises(TypeError):
+        table['url'] = 'http://example.com'
+    with pytest.raises(AttributeError):
+        table.extra = 1
+    with pytest.raises(TypeError):
+        itemadapter.ItemAdapter(table)['url'] = 'http://example.com'
+
+
+def test_item(table, adapter_classes):
+    assert not itemadapter.is_item(table)
+    records.register_adapter()
+    records.register_adapter()
+    assert list(adapter_classes).count(records.TableAdapter) == 1
+    assert itemadapter.is_item(table)
+    assert itemadapter.ItemAdapter(table).asdict() == table.to_dict()
+
+
+def test_pickle(table):
+    assert pickle.loads(pickle.dumps(table)) == table
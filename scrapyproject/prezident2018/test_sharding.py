@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import io
+
+from . import dataset
+from . import pipelines
+from . import sharding
+
+REGIONS = ['http://example.com/region/%d' % i for i in range(3)]
+
+
+def test_region_queue(tmpdir):
+    path = str(tmpdir.join('regions.sqlite'))
+    queue = sharding.RegionQueue(path)
+    assert queue.fill(REGIONS) == 3
+    other = sharding.RegionQueue(path)
+    assert other.fill(REGIONS) == 0
+
+    assert queue.claim('a', now=0) == (REGIONS[0], 0)
+    assert other.claim('b', now=0) == (REGIONS[1], 1)
+    assert queue.counts() == {'pending': 1, 'claimed': 2, 'done': 0}
+
+    #
+    # b dies, so its region goes to a once the claim times out.
+    #
+    queue.touch([REGIONS[0]], 'a', now=90)
+    assert queue.claim('a', timeout=100, now=99) == (REGIONS[2], 2)
+    assert queue.claim('a', timeout=100, now=150) == (REGIONS[1], 1)
+    assert queue.claim('a', timeout=100, now=150) is None
+
+    queue.done(REGIONS[:2])
+    queue.release(REGIONS[2:])
+    assert other.counts() == {'pending': 1, 'claimed': 0, 'done': 2}
+    queue.close()
+    other.close()
+
+
+def write_shard(path, tables):
+    with io.open(path, 'wb') as fout:
+        exporter = pipelines.LineExporter(fout)
+        for table in tables:
+            exporter.export_item(table)
+        exporter.finish_exporting()
+
+
+def test_merge(tmpdir):
+    tables = [{'url': url, 'data_type': 'results_tik'} for url in REGIONS]
+    shards = [str(tmpdir.join('shard%d.json.gz' % i)) for i in range(2)]
+    write_shard(shards[0], tables[:2])
+    write_shard(shards[1], tables[1:])
+
+    path = str(tmpdir.join('results.json.gz'))
+    with io.open(path, 'wb') as fout:
+        assert sharding.merge(shards, fout) == 3
+    assert list(dataset.iter_tables(path)) == tables
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import os.path as P
+
+from . import snapshots
+from .spiders import myspider
+from .spiders.test_myspyder import mock_response, UIK_NAMES
+
+
+def make_versions(count):
+    """Return versions of a results_uik table where the votes keep coming in."""
+    response = mock_response('territorial_ik_results.html')
+    table = myspider.parse_voting_summary_table(response, data_type=myspider.RESULTS_UIK)
+    versions = []
+    for i in range(count):
+        version = snapshots._copy_table(table)
+        version['data'][-1][1] += i
+        version['timestamp'] = '2018-03-%02dT00:00:00.000000+00:00' % (10 + i)
+        version['md5'] = 'md5-%d' % i
+        versions.append(version)
+    return versions
+
+
+def test_snapshot_store(tmpdir):
+    path = str(tmpdir.join('snapshots.jsonl'))
+    versions = make_versions(20)
+    url = versions[0]['url']
+
+    store = snapshots.SnapshotStore(path)
+    for version in versions:
+        assert store.add(version)
+    assert not store.add(versions[-1])
+    assert not store.add(versions[0])
+
+    assert [v.full for v in store.versions[url]] == [True] + [False] * 15 + [True] + [False] * 3
+    full_size = len(snapshots.json.dumps(versions[0]))
+    assert P.getsize(path) < 4 * full_size
+
+    assert store.as_of(url, '2018-03-01') is None
+    assert store.as_of(url, '2018-03-10T12:00') == versions[0]
+    assert store.as_of(url, '2018-03-20T12:00') == versions[10]
+    assert store.as_of(url, '2018-04-01') == versions[-1]
+    assert list(store.iter_versions(url)) == versions
+    assert list(store.snapshot('2018-03-25T12:00')) == [versions[15]]
+    store.close()
+
+    #
+    # The history of a station only includes the versions where it changed.
+    #
+    store = snapshots.SnapshotStore(path)
+    table = versions[0]
+    history = store.history(table['region'], table['territory'], UIK_NAMES[0])
+    assert len(history) == 20
+    timestamp, data_type, values = history[-1]
+    assert (timestamp, data_type) == (versions[-1]['timestamp'], myspider.RESULTS_UIK)
+    assert values[table['row_headers'][-1]] == versions[-1]['data'][-1][1]
+    assert len(store.history(table['region'], table['territory'], UIK_NAMES[1])) == 1
+    store.close()
+
+
+def test_snapshot_store_cache(tmpdir):
+    """Do the tables that fell out of the cache still get diffed against their latest version?"""
+    path = str(tmpdir.join('snapshots.jsonl'))
+    versions = make_versions(3)
+    others = []
+    for i, version in enumerate(make_versions(2)):
+        version['url'] = 'http://example.com/%d' % i
+        others.append(version)
+
+    store = snapshots.SnapshotStore(path, cache_size=1)
+    for version in [versions[0]] + others + versions[1:]:
+        assert store.add(version)
+        assert len(store._latest) == 1
+    assert [v.full for v in store.versions[versions[0]['url']]] == [True, False, False]
+    assert store.latest(versions[0]['url']) == versions[-1]
+    assert store.latest(others[0]['url']) == others[0]
+    assert list(store._latest) == [others[0]['url']]
+    store.close()
+
+
+def test_snapshot_store_crash(tmpdir):
+    path = str(tmpdir.join('snapshots.jsonl'))
+    versions = make_versions(3)
+    store = snapshots.SnapshotStore(path)
+    store.add(versions[0])
+    store.add(versions[1])
+    store.close()
+
+    with open(path, 'ab') as fout:
+        fout.write(b'{"url": "http://exa')
+
+    store = snapshots.SnapshotStore(path)
+    assert store.latest(versions[0]['url']) == versions[1]
+    store.add(versions[2])
+    store.close()
+    assert list(snapshots.SnapshotStore(path).iter_versions(versions[0]['url'])) == versions
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from . import stations
+from .spiders import myspider
+from .spiders.test_myspyder import UIK_NAMES, mock_response
+
+
+def load_fixtures():
+    results = myspider.parse_voting_summary_table(
+        mock_response('territorial_ik_results.html'), data_type=myspider.RESULTS_UIK
+    )
+    turnout = myspider.parse_turnout_table(
+        mock_response('territorial_ik_uik_turnout.html'), data_type=myspider.TURNOUT_UIK
+    )
+    return results, turnout
+
+
+def test_from_tables():
+    results, turnout = load_fixtures()
+    st = stations.Stations.from_tables([results, turnout])
+
+    assert len(st) == len(UIK_NAMES)
+    assert [key.name for key in st.keys] == list(UIK_NAMES)
+    assert st.regions == ['Сахалинская область']
+    assert st.results.shape == (len(UIK_NAMES), 20)
+    assert st.turnout.shape == (len(UIK_NAMES), 4)
+    assert not np.isnan(st.turnout).any()
+
+    key = stations.Key('Сахалинская область', 'Александровск-Сахалинская', 'УИК №1')
+    row = st.index[key]
+    assert st.measure(stations.MEASURES[0])[row] == 173
+    assert st.measure('Путин Владимир Владимирович')[row] == results['data'][15][1]
+    assert list(st.turnout[row]) == turnout['data'][1]
+
+    assert st.in_region('Сахалинская область').all()
+    assert st.labels(st.turnout_at('10:00') > 100) == []
+
+
+def test_missing_turnout():
+    results, _ = load_fixtures()
+    st = stations.Stations.from_tables([results])
+    assert np.isnan(st.turnout).all()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import copy
+
+import pytest
+
+from . import records
+from . import validation
+from .spiders import myspider
+from .spiders.test_myspyder import mock_response
+
+FIXTURES = {
+    myspider.RESULTS_TIK: 'regional_ik_results.html',
+    myspider.RESULTS_UIK: 'territorial_ik_results.html',
+    myspider.TURNOUT_TIK: 'regional_ik_turnout.html',
+    myspider.TURNOUT_UIK: 'territorial_ik_uik_turnout.html',
+}
+
+
+def parse(data_type):
+    return myspider.parse_table(mock_response(FIXTURES[data_type]), data_type).to_dict()
+
+
+@pytest.mark.parametrize('data_type', sorted(FIXTURES))
+def test_check_fixtures(data_type):
+    assert validation.check(parse(data_type)) == []
+    assert validation.check(records.Table.from_dict(parse(data_type))) == []
+
+
+def test_check_results():
+    table = parse(myspider.RESULTS_UIK)
+    headers = table['column_headers']
+    #
+    # A ballot too many in the stationary box of the first UIK,
+    # and the ballots issued in the second UIK went missing.
+    #
+    table['data'][7][1] += 1
+    table['data'][3][2] = myspider.BAD_COLUMN
+    failures = {failure.check: failure.columns for failure in validation.check(table)}
+    assert failures == {
+        'missing': [headers[2]],
+        'cast': [headers[1], headers[2]],
+        'counted': [headers[1]],
+        'total': ['Сумма'],
+    }
+
+    #
+    # A blank cell is missing, and doesn't make its column or row fail to add up.
+    #
+    table = parse(myspider.RESULTS_UIK)
+    table['data'][9][1] = None
+    assert validation.check(table) == [validation.Failure('missing', [headers[1]])]
+
+    table = parse(myspider.RESULTS_UIK)
+    table['row_headers'] = table['row_headers'][1:]
+    assert validation.check(table) == [validation.Failure('rows', [])]
+
+    table = parse(myspider.RESULTS_UIK)
+    table['data'][0].pop()
+    assert validation.check(table) == [validation.Failure('shape', [])]
+    assert validation.check(records.Table.from_dict(table)) == [validation.Failure('shape', [])]
+
+
+def test_check_turnout():
+    table = parse(myspider.TURNOUT_UIK)
+    table['data'][2][3] = 101.5
+    assert validation.check(table) == [validation.Failure('percent', [table['row_headers'][2]])]
+
+    table = parse(myspider.TURNOUT_UIK)
+    table['data'][2][3] = None
+    assert validation.check(table) == [validation.Failure('missing', [table['row_headers'][2]])]
+
+
+def test_crosscheck():
+    crosscheck = validation.CrossCheck()
+    uik = parse(myspider.RESULTS_UIK)
+    assert crosscheck.add(uik) == []
+    assert len(crosscheck.totals) == 1
+    assert crosscheck.add(parse(myspider.RESULTS_TIK)) == []
+    assert not crosscheck.totals
+
+    crosscheck.add(parse(myspider.TURNOUT_TIK))
+    assert crosscheck.add(parse(myspider.TURNOUT_UIK)) == []
+
+    turnout = records.Table.from_dict(parse(myspider.TURNOUT_UIK))
+    assert crosscheck.add(turnout) == []
+    assert crosscheck.add(records.Table.from_dict(parse(myspider.TURNOUT_TIK))) == []
+    assert not crosscheck.totals
+
+    wrong = copy.deepcopy(uik)
+    wrong['data'][0][0] += 1
+    crosscheck.add(wrong)
+    mismatch, = crosscheck.add(parse(myspider.RESULTS_TIK))
+    assert mismatch['territory'] == 'Александровск-Сахалинская'
+    assert mismatch['total'][0] == mismatch['summary'][0] + 1
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Check that the tables add up.
+
+check(table) looks at one table at a time.  For the results tables, it checks
+every column (each UIK or TIK, and the Сумма column) at once, leaving the
+columns with blank cells out of the checks that add them up:
+
+    shape       the rows aren't all the same length
+    missing     cells that couldn't be parsed (myspider.BAD_COLUMN) or were blank
+    rows        the row headers aren't the ones we know how to check
+    cast        more ballots in the boxes than were issued
+    counted     valid + invalid ballots isn't the number of ballots in the boxes
+    candidates  the votes for the candidates don't add up to the valid ballots
+    total       the Сумма column isn't the sum of the other columns
+
+and for the turnout tables:
+
+    shape, missing  as above
+    percent     a turnout outside 0-100%
+
+CrossCheck compares the tables of different levels, which arrive in any order:
+the column of each TIK in its region's results_tik table against the Сумма
+column of that TIK's results_uik table, and likewise the row of each TIK in
+its turnout_tik table against the ВСЕГО row of its turnout_uik table.
+"""
+import collections
+
+import numpy as np
+
+from . import records
+from . import stations
+from .spiders import myspider
+
+PERCENT_TOLERANCE = 0.01
+"""How far apart two turnout percentages can be and still be the same."""
+
+MAX_COLUMNS = 10
+"""Name at most this many of the columns that failed a check."""
+
+Failure = collections.namedtuple('Failure', 'check columns')
+"""A check that failed, and the headers of the columns that failed it."""
+
+#
+# Rows of the results tables, after the parser drops Сумма and the blank row.
+# See stations.MEASURES.
+#
+_ISSUED_ROWS = [2, 3, 4]
+_CAST_ROWS = [6, 7]
+_INVALID_ROW = 8
+_VALID_ROW = 9
+_CANDIDATE_ROWS = slice(12, None)
+
+
+def check(table):
+    """Check a table.  Returns a list of Failure, empty if the table is fine."""
+    data = _cells(table)
+    if data is None:
+        return [Failure('shape', [])]
+    blank = np.isnan(data)
+    missing = (data == myspider.BAD_COLUMN) | blank
+
+    failures = []
+    if table['data_type'] in (myspider.RESULTS_TIK, myspider.RESULTS_UIK):
+        if tuple(table['row_headers']) != stations.MEASURES:
+            return [Failure('rows', [])]
+        columns = table['column_headers']
+        failures.append(_failure('missing', columns, missing.any(axis=0)))
+
+        known = ~blank.any(axis=0)
+        cast = data[_CAST_ROWS].sum(axis=0)
+        valid = data[_VALID_ROW]
+        failures.append(_failure('cast', columns, known & (cast > data[_ISSUED_ROWS].sum(axis=0))))
+        failures.append(_failure('counted', columns, known & (valid + data[_INVALID_ROW] != cast)))
+        failures.append(_failure(
+            'candidates', columns, known & (data[_CANDIDATE_ROWS].sum(axis=0) != valid)
+        ))
+        if columns[1:]:
+            known = ~blank.any(axis=1)
+            wrong = (known & (data[:, 0] != data[:, 1:].sum(axis=1))).any()
+            failures.append(_failure('total', columns[:1], np.array([wrong])))
+    elif table['data_type'] in (myspider.TURNOUT_TIK, myspider.TURNOUT_UIK):
+        rows = table['row_headers']
+        failures.append(_failure('missing', rows, missing.any(axis=1)))
+        failures.append(_failure('percent', rows, ((data < 0) | (data > 100)).any(axis=1)))
+    return [failure for failure in failures if failure is not None]
+
+
+def _cells(table):
+    """Return the cells of a table as a 2D array, or None if the rows aren't all the same length.
+
+    Blank cells (None) are NaN.
+    """
+    if isinstance(table, records.Table) and table.lengths is None:
+        return np.frombuffer(table.values).reshape(-1, table.width)
+    rows = table['data']
+    if len(set(len(row) for row in rows)) > 1:
+        return None
+    return np.array(rows, dtype=float).reshape(len(rows), -1)
+
+
+def _failure(name, headers, failed):
+    """Return a Failure naming the headers where failed is True, or None."""
+    positions = np.flatnonzero(failed)
+    if not len(positions):
+        return None
+    return Failure(name, [headers[position] for position in positions[:MAX_COLUMNS]])
+
+
+class CrossCheck(object):
+    """Compare the TIK summaries with the totals of the tables below them.
+
+    Feed it each table with add.  Whichever of the two tables arrives first
+    waits in summaries or totals, keyed by (data_type, region, territory),
+    until the other one does.
+    """
+
+    def __init__(self):
+        self.summaries = {}
+        self.totals = {}
+
+    def add(self, table):
+        """Add a table.  Returns a list of mismatches, as dicts."""
+        data_type = table['data_type']
+        region = table['region']
+        mismatches = []
+        #
+        # Tables of the wrong shape fail check, so there's nothing to compare.
+        #
+        data = _cells(table)
+        if data is None:
+            return mismatches
+        if data_type == myspider.RESULTS_TIK:
+            for column, territory in enumerate(table['column_headers'][1:], 1):
+                key = (myspider.RESULTS_UIK, region, territory)
+                self.summaries[key] = data[:, column]
+                mismatches.append(self._compare(key))
+        elif data_type == myspider.TURNOUT_TIK:
+            for row, territory in zip(data[1:], table['row_headers'][1:]):
+                key = (myspider.TURNOUT_UIK, region, territory)
+                self.summaries[key] = row
+                mismatches.append(self._compare(key))
+        elif data_type in (myspider.RESULTS_UIK, myspider.TURNOUT_UIK) and len(data):
+            key = (data_type, region, table['territory'])
+            self.totals[key] = data[:, 0] if data_type == myspider.RESULTS_UIK else data[0]
+            mismatches.append(self._compare(key))
+        return [mismatch for mismatch in mismatches if mismatch is not None]
+
+    def _compare(self, key):
+        if key not in self.summaries or key not in self.totals:
+            return None
+        summary = self.summaries.pop(key)
+        total = self.totals.pop(key)
+        tolerance = PERCENT_TOLERANCE if key[0] == myspider.TURNOUT_UIK else 0
+        if summary.shape == total.shape and np.allclose(summary, total, rtol=0, atol=tolerance):
+            return None
+        data_type, region, territory = key
+        return {
+            'check': 'tik', 'data_type': data_type, 'region': region, 'territory': territory,
+            'summary': summary.tolist(), 'total': total.tolist(),
+        }